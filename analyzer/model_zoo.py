@@ -0,0 +1,220 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# analyzer.model_zoo.py
+
+'''
+@summary: Side by side evaluation of candidate classifiers on the lagged
+          return features of create_lagged_series. The feature matrix is
+          built once and placed in shared memory, and the candidates are
+          fitted and cross-validated concurrently by worker processes
+          reading it in place.
+'''
+
+# General imports
+from concurrent.futures import ProcessPoolExecutor
+import logging
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+from sklearn.base import clone
+from sklearn.discriminant_analysis import LinearDiscriminantAnalysis as LDA
+from sklearn.discriminant_analysis import QuadraticDiscriminantAnalysis as QDA
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.linear_model import LogisticRegression
+from sklearn.model_selection import TimeSeriesSplit
+from sklearn.naive_bayes import GaussianNB
+from sklearn.neighbors import KNeighborsClassifier
+from sklearn.svm import SVC
+
+# local imports
+from performance.performance import create_batch_summary_stats
+from utils.create_lagged_series import create_lagged_series
+
+
+# Per-process view of the shared data block, set once by the pool
+# initializer so that tasks only carry an unfitted estimator.
+_worker_state = {}
+
+
+def default_models():
+    """
+    :return: (dict) name -> unfitted estimator of the standard candidates.
+    """
+    return {
+        'QDA': QDA(),
+        'LDA': LDA(),
+        'LR': LogisticRegression(),
+        'GNB': GaussianNB(),
+        'KNN': KNeighborsClassifier(n_neighbors=50),
+        'RF': RandomForestClassifier(n_estimators=200, max_depth=4,
+                                     random_state=0),
+        'SVC': SVC(C=1.0, gamma='scale'),
+    }
+
+
+def _init_worker(shm_name, shape, n_features, n_splits):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    data = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+    _worker_state['shm'] = shm
+    _worker_state['X'] = data[:, :n_features]
+    _worker_state['y'] = data[:, n_features]
+    _worker_state['splits'] = list(TimeSeriesSplit(n_splits=n_splits)
+                                   .split(data))
+
+
+def _evaluate_model(task):
+    """
+    Walk-forward cross validation of one candidate.
+
+    :return: (tuple) name, accuracy of every fold, out-of-sample
+             predictions (NaN on the bars never tested).
+    """
+    name, estimator = task
+    X, y = _worker_state['X'], _worker_state['y']
+    predictions = np.full(len(y), np.nan)
+    scores = []
+    for train, test in _worker_state['splits']:
+        model = clone(estimator)
+        try:
+            model.fit(X[train], y[train])
+            pred = model.predict(X[test])
+        except Exception as e:
+            logging.error("Model [%s] failed on a fold: %s", name, e)
+            scores.append(np.nan)
+            continue
+        predictions[test] = pred
+        scores.append(np.mean(pred == y[test]))
+    return name, np.array(scores), predictions
+
+
+class ModelZoo(object):
+
+    """
+    Compares classifiers on one feature matrix.
+
+    evaluate() copies the features and the direction into a single
+    shared memory block; every worker maps it without a copy and runs a
+    walk-forward TimeSeriesSplit for the candidates it is given. The
+    out-of-sample predictions are turned into long/flat equity curves,
+    like SPYDailyForecastStrategy trades, and summarised with the
+    batched performance statistics.
+    """
+
+    def __init__(self, X, y, returns, feature_names=None, periods=252):
+        """
+        :param X: (array-like) features, one row per bar.
+        :param y: (array-like) direction (+1/-1) to predict for each bar.
+        :param returns: (array-like) percentage return realised on each
+                        bar, used for the backtest statistics.
+        :param feature_names: (list) names of the feature columns.
+        :param periods: periods used to annualise the Sharpe ratio.
+        """
+        self.X = np.asarray(X, dtype=np.float64)
+        self.y = np.asarray(y, dtype=np.float64)
+        self.returns = np.asarray(returns, dtype=np.float64)
+        if not len(self.X) == len(self.y) == len(self.returns):
+            raise ValueError("X, y and returns must have the same length.")
+        self.feature_names = feature_names
+        self.periods = periods
+
+    @classmethod
+    def from_lagged_series(cls, symbol, start_date, end_date,
+                           features=('Lag1', 'Lag2'), lags=5, periods=252,
+                           csv_dir=None):
+        """
+        Builds the zoo from the create_lagged_series features of a symbol,
+        read from the local bar store csv_dir when given.
+        """
+        ret = create_lagged_series(symbol, start_date, end_date, lags=lags,
+                                   csv_dir=csv_dir)
+        ret = ret[ret.index >= start_date]
+        ret = ret[list(features) + ['Direction', 'Today']].dropna()
+        return cls(ret[list(features)].values, ret['Direction'].values,
+                   ret['Today'].values, feature_names=list(features),
+                   periods=periods)
+
+    def evaluate(self, models=None, n_splits=5, n_jobs=None,
+                 rank_by='Accuracy'):
+        """
+        Fits and cross-validates every candidate.
+
+        :param models: (dict) name -> unfitted estimator, default_models()
+                       when None.
+        :param n_splits: (int) walk-forward folds.
+        :param n_jobs: (int) worker processes, None for one per CPU and 1
+                       to run in this process.
+        :param rank_by: (str) column the table is sorted by, best first.
+        :return: (DataFrame) one row per model.
+        """
+        models = models or default_models()
+        n_features = self.X.shape[1]
+        shape = (len(self.y), n_features + 1)
+
+        shm = shared_memory.SharedMemory(create=True,
+                                         size=max(int(np.prod(shape)) * 8, 1))
+        try:
+            data = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+            data[:, :n_features] = self.X
+            data[:, n_features] = self.y
+            del data
+
+            init_args = (shm.name, shape, n_features, n_splits)
+            tasks = list(models.items())
+            logging.info("Evaluating %d models on %d bars x %d features",
+                         len(tasks), shape[0], n_features)
+            if n_jobs == 1:
+                _init_worker(*init_args)
+                results = [_evaluate_model(t) for t in tasks]
+                _worker_state.pop('shm').close()
+                _worker_state.clear()
+            else:
+                with ProcessPoolExecutor(max_workers=n_jobs,
+                                         initializer=_init_worker,
+                                         initargs=init_args) as pool:
+                    results = list(pool.map(_evaluate_model, tasks))
+        finally:
+            shm.close()
+            shm.unlink()
+
+        return self._results_table(results, rank_by)
+
+    def _results_table(self, results, rank_by):
+        names = [name for name, _, _ in results]
+        predictions = np.array([pred for _, _, pred in results])
+
+        # Long when the next bar is predicted up, flat otherwise, over
+        # the bars every model was tested on
+        tested = np.isfinite(predictions).all(axis=0)
+        period_returns = np.where(predictions[:, tested] > 0,
+                                  self.returns[tested] / 100.0, 0.0)
+        names.append('Buy and Hold')
+        period_returns = np.vstack((period_returns,
+                                    self.returns[tested] / 100.0))
+        equity = np.hstack((np.ones((len(names), 1)),
+                            np.cumprod(1.0 + period_returns, axis=1)))
+        stats = create_batch_summary_stats(equity, periods=self.periods)
+
+        table = pd.DataFrame(stats, index=names)
+        table.insert(0, 'Accuracy', [np.nanmean(s) for _, s, _ in results] +
+                     [np.mean(self.y[tested] > 0)])
+        table.insert(1, 'Accuracy Std', [np.nanstd(s) for _, s, _ in results] +
+                     [np.nan])
+        return table.sort_values(rank_by, ascending=False)
+
+
+if __name__ == "__main__":
+    import datetime
+    import sys
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    ch = logging.StreamHandler(sys.stdout)
+    ch.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    root.addHandler(ch)
+
+    zoo = ModelZoo.from_lagged_series(sys.argv[1] if len(sys.argv) > 1
+                                      else 'SPY',
+                                      datetime.datetime(2001, 1, 10),
+                                      datetime.datetime(2005, 12, 31))
+    with pd.option_context('display.width', 200):
+        print(zoo.evaluate())
@@ -0,0 +1,258 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# analyzer.multi_symbol_forecast.py
+
+'''
+@summary: Forecast strategy over a whole symbol universe. One model per
+          symbol is trained across a process pool at startup and every
+          bar all the symbols are predicted in one vectorized call.
+'''
+
+
+from concurrent.futures import ProcessPoolExecutor
+import datetime
+import logging
+
+from dateutil.relativedelta import relativedelta
+import numpy as np
+from sklearn.discriminant_analysis import QuadraticDiscriminantAnalysis as QDA
+
+from strategy.strategy import Strategy
+from strategy.features import RollingFeatureEngine
+from events.events_impl import SignalEvent
+from backtest.backtest import Backtest
+
+from datahandler.csv_data_handler import HistoricCSVDataHandler
+from execution.simulated_execution import SimulatedExecutionHandler
+from portfolio.portfolio import Portfolio
+from utils.create_lagged_series import create_lagged_series
+
+
+FEATURES = ['Lag1', 'Lag2']
+
+
+def fit_symbol_model(symbol, start_date, end_date, csv_dir=None):
+    """
+    Fits the QDA direction model of one symbol on its Lag1/Lag2 returns
+    between start_date and end_date. Module level so it can run in a
+    worker process.
+
+    :param csv_dir: (str) local bar store, see create_lagged_series.
+
+    :return: (tuple) symbol, fitted model or None, error message or None.
+    """
+    try:
+        ret = create_lagged_series(symbol, start_date, end_date, lags=5,
+                                   csv_dir=csv_dir)
+        ret = ret[ret.index > start_date + relativedelta(days=3)]
+        ret = ret[FEATURES + ['Direction']].dropna()
+        model = QDA()
+        model.fit(ret[FEATURES].values, ret['Direction'].values)
+    except Exception as e:
+        return symbol, None, str(e)
+    return symbol, model, None
+
+
+class StackedQDA(object):
+
+    """
+    The fitted QDA models of many symbols stacked into arrays, so that
+    row i of a feature matrix is scored by model i in a handful of numpy
+    operations whatever the number of symbols.
+
+    The scores are the per-class log posteriors of sklearn's QDA:
+    -0.5 * (|(x - mean_k) R_k S_k^-1/2|^2 + sum(log S_k)) + log(prior_k).
+    The classes of all the models are merged; a class a model never saw
+    gets a score of -inf.
+    """
+
+    def __init__(self, models):
+        """
+        :param models: (list) fitted QuadraticDiscriminantAnalysis models.
+        """
+        self.classes = np.unique(np.concatenate([m.classes_ for m in models]))
+        n, c = len(models), len(self.classes)
+        d = models[0].means_.shape[1]
+
+        self.means = np.zeros((n, c, d))
+        self.weights = np.zeros((n, c, d, d))
+        self.const = np.full((n, c), -np.inf)
+        for i, model in enumerate(models):
+            cols = np.searchsorted(self.classes, model.classes_)
+            for k, col in enumerate(cols):
+                scaling = model.scalings_[k]
+                self.means[i, col] = model.means_[k]
+                self.weights[i, col] = model.rotations_[k] * scaling ** -0.5
+                self.const[i, col] = -0.5 * np.sum(np.log(scaling)) + \
+                    np.log(model.priors_[k])
+
+    def decision_function(self, X, rows=None):
+        """
+        :param X: (ndarray) n_rows x n_features.
+        :param rows: (ndarray) model index of every row of X, None when
+                     X has one row per model.
+        :return: (ndarray) n_rows x n_classes scores.
+        """
+        if rows is None:
+            means, weights, const = self.means, self.weights, self.const
+        else:
+            means, weights, const = self.means[rows], self.weights[rows], \
+                self.const[rows]
+        centered = X[:, None, :] - means
+        projected = np.einsum('ncd,ncde->nce', centered, weights)
+        return -0.5 * np.einsum('nce,nce->nc', projected, projected) + const
+
+    def predict(self, X, rows=None):
+        """
+        :return: (ndarray) the predicted class of every row.
+        """
+        return self.classes[np.argmax(self.decision_function(X, rows),
+                                      axis=1)]
+
+
+class MultiSymbolForecastStrategy(Strategy):
+
+    """
+    Generalizes SPYDailyForecastStrategy to every symbol of the data
+    handler: each symbol gets its own QDA model, trained in parallel at
+    startup, and goes long when its next return is predicted up and
+    exits when it is predicted down.
+
+    Each bar the latest prices go through a RollingFeatureEngine and the
+    models of all the symbols are evaluated at once by StackedQDA, so a
+    bar costs a few array operations rather than one predict() per
+    symbol. A SignalEvent is emitted only for the symbols whose position
+    changes. Symbols whose model could not be trained are not traded.
+    """
+
+    def __init__(self, bars, events, n_jobs=None,
+                 model_start_date=datetime.datetime(2001, 1, 10),
+                 model_end_date=datetime.datetime(2006, 1, 3)):
+        """
+        :param bars: The DataHandler object.
+        :param events: The Event Queue object.
+        :param n_jobs: (int) training processes, None for one per CPU.
+        :param model_start_date: (datetime) start of the training window.
+        :param model_end_date: (datetime) end of the training window.
+        """
+        self.bars = bars
+        self.symbol_list = self.bars.symbol_list
+        self.events = events
+
+        self.strategy_id = '000002'
+        self.model_start_date = model_start_date
+        self.model_end_date = model_end_date
+
+        n = len(self.symbol_list)
+        self.long_market = np.zeros(n, dtype=bool)
+        self.up_count = 0
+        self.down_count = 0
+
+        self.models = self.create_symbol_forecast_models(n_jobs)
+        self.tradable = np.array([m is not None for m in self.models],
+                                 dtype=bool)
+        # Row of each symbol's model in the stacked arrays
+        self.model_rows = np.cumsum(self.tradable) - 1
+        self.stacked = None
+        if self.tradable.any():
+            self.stacked = StackedQDA([m for m in self.models if m is not None])
+        self.features = RollingFeatureEngine(n_symbols=n, lags=(1, 2),
+                                             window=2)
+
+    def create_symbol_forecast_models(self, n_jobs=None):
+        """
+        Trains one model per symbol across a process pool.
+
+        :return: (list) fitted models in symbol_list order, None for the
+                 symbols that failed.
+        """
+        n = len(self.symbol_list)
+        models = {}
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            results = executor.map(
+                fit_symbol_model, self.symbol_list,
+                [self.model_start_date] * n, [self.model_end_date] * n,
+                [getattr(self.bars, 'csv_dir', None)] * n,
+                chunksize=max(1, n // 64))
+            for symbol, model, error in results:
+                if model is None:
+                    logging.error("No model for %s, not traded [%s]",
+                                  symbol, error)
+                models[symbol] = model
+        logging.info("Trained %d models out of %d symbols",
+                     sum(m is not None for m in models.values()), n)
+        return [models[s] for s in self.symbol_list]
+
+    def predict(self):
+        """
+        :return: (ndarray) predicted direction per symbol, 0 for the
+                 symbols without a model or full features yet.
+        """
+        preds = np.zeros(len(self.symbol_list))
+        X = self.features.features[:, :len(FEATURES)]
+        idx = np.flatnonzero(self.tradable & np.isfinite(X).all(axis=1))
+        if len(idx):
+            preds[idx] = self.stacked.predict(X[idx], self.model_rows[idx])
+        return preds
+
+    def calculate_signals(self, event):
+        """
+        Calculate the SignalEvents of all the symbols based on market data.
+        """
+        if event.type != 'MARKET' or self.stacked is None:
+            return
+
+        prices = [self.bars.get_latest_bar_value(s, "adj_close")
+                  for s in self.symbol_list]
+        self.features.update(prices)
+        if not self.features.is_ready:
+            return
+
+        preds = self.predict()
+        self.up_count += int(np.count_nonzero(preds > 0))
+        self.down_count += int(np.count_nonzero(preds < 0))
+
+        enter = (preds > 0) & ~self.long_market
+        leave = (preds < 0) & self.long_market
+        self.long_market[enter] = True
+        self.long_market[leave] = False
+        for i in np.flatnonzero(enter | leave):
+            sym = self.symbol_list[i]
+            signal = SignalEvent(self.strategy_id, sym,
+                                 self.bars.get_latest_bar_datetime(sym),
+                                 'LONG' if enter[i] else 'EXIT', 1.0)
+            self.events.put(signal)
+
+    def dump_updown_count(self):
+        logging.info("Up [%d]" % self.up_count)
+        logging.info("Down [%d]" % self.down_count)
+
+
+if __name__ == "__main__":
+    import sys
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+
+    ch = logging.StreamHandler(sys.stdout)
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+    ch.setFormatter(formatter)
+    root.addHandler(ch)
+
+    csv_dir = '/home/divya/PycharmProjects/StockAnalyzer/csv_data/'
+    symbol_list = sys.argv[1:] or ['SPY']
+    initial_capital = 100000.0
+
+    start_date = datetime.datetime(2006, 1, 3)
+    heartbeat = 0.0
+    backtest = Backtest(csv_dir,
+                        symbol_list,
+                        initial_capital,
+                        heartbeat,
+                        start_date,
+                        HistoricCSVDataHandler,
+                        SimulatedExecutionHandler,
+                        Portfolio,
+                        MultiSymbolForecastStrategy,
+                        batch_signals=True)
+
+    backtest.simulate_trading()
@@ -10,6 +10,7 @@
 import datetime
 from dateutil.relativedelta import relativedelta
 
+import numpy as np
 import pandas as pd
 from sklearn.discriminant_analysis import QuadraticDiscriminantAnalysis as QDA
 
@@ -21,10 +22,44 @@ from backtest.backtest import Backtest
 from datahandler.csv_data_handler import HistoricCSVDataHandler
 from execution.simulated_execution import SimulatedExecutionHandler
 from portfolio.portfolio import Portfolio
-from utils.create_lagged_series import create_lagged_series
+from strategy.retraining import RetrainingScheduler
+from utils.create_lagged_series import (create_lagged_series,
+                                        lagged_series_source)
 import logging
 
 
+def direction_training_set(returns):
+    """
+    Pairs of consecutive percentage returns with the direction of the
+    next return as the response, the training set of every direction
+    model of the strategy.
+
+    The features are ordered as _predict() builds them: Lag1 is the
+    older return of the pair and Lag2 the newer one.
+
+    :param returns: (ndarray) percentage returns, oldest first.
+    :return: X, y - (DataFrame, ndarray) the rows with finite values.
+    """
+    X = pd.DataFrame({'Lag1': returns[:-2], 'Lag2': returns[1:-1]})
+    y = np.sign(returns[2:])
+    valid = np.isfinite(X.values).all(axis=1) & np.isfinite(y)
+    return X[valid], y[valid]
+
+
+def fit_direction_model(prices):
+    """
+    Fits a QDA on the direction_training_set of a price window. Module
+    level so it can run in a worker process.
+
+    :param prices: (ndarray) adj_close of the training window.
+    :return: the fitted model.
+    """
+    returns = (prices[1:] / prices[:-1] - 1.0) * 100.0
+    model = QDA()
+    model.fit(*direction_training_set(returns))
+    return model
+
+
 class SPYDailyForecastStrategy(Strategy):
 
     """
@@ -32,9 +67,27 @@ class SPYDailyForecastStrategy(Strategy):
     Analyzer to predict the returns for a subsequent time
     period and then generated long/exit signals based on the
     prediction.
+
+    With precompute_predictions=True the lag features of the whole
+    replay window are built with array operations and the model is
+    called once, the bars then only look their prediction up.
+
+    With a model_cache (utils.model_cache.ModelCache) the fitted model is
+    reused across runs as long as the training data and the parameters
+    are unchanged. A local bar file is identified by its modification
+    time, so a hit does not load it at all; data downloaded from Yahoo
+    is fetched and hashed.
+
+    With retrain_every (bars, 'M' or 'W') the model is refitted in the
+    background on the trailing retrain_window bars and swapped in one bar
+    later, see strategy.retraining.RetrainingScheduler. Precomputed
+    predictions would be stale after a swap, so retraining turns them
+    off.
     """
 
-    def __init__(self, bars, events):
+    def __init__(self, bars, events, precompute_predictions=False,
+                 model_cache=None, retrain_every=None, retrain_window=1260,
+                 retrain_executor='thread', retrain_deterministic=True):
         self.bars = bars
         self.symbol_list = self.bars.symbol_list
         self.events = events
@@ -51,30 +104,136 @@ class SPYDailyForecastStrategy(Strategy):
         self.up_count = 0
         self.down_count = 0
         
+        self.model_cache = model_cache
         self.model = self.create_symbol_forecast_model()
 
+        self.retrain_window = retrain_window
+        self.retrainer = None
+        if retrain_every is not None:
+            self.retrainer = RetrainingScheduler(
+                fit_direction_model, self.model, every=retrain_every,
+                executor=retrain_executor,
+                deterministic=retrain_deterministic)
+            if precompute_predictions:
+                logging.warning("Retraining enabled, predictions are not "
+                                "precomputed")
+                precompute_predictions = False
+
+        self.predictions = None
+        if precompute_predictions:
+            self.predictions = self.precompute_predictions()
+
     def create_symbol_forecast_model(self):
+        symbol = self.symbol_list[0]
+        csv_dir = getattr(self.bars, 'csv_dir', None)
+        model = QDA()
+        # Days back of the Lag1 and Lag2 features, see
+        # direction_training_set
+        lags = [2, 1]
+        key = None
+        snpret = None
+        if self.model_cache is not None:
+            if csv_dir is not None:
+                # A local file is identified by its path and modification
+                # time, so a hit loads nothing
+                key = self.model_cache.make_key(
+                    symbol, self.model_start_date, self.model_end_date,
+                    lags, model,
+                    source=lagged_series_source(symbol, csv_dir))
+            else:
+                # Downloaded history can be revised or extended, so the
+                # series itself is hashed
+                snpret = create_lagged_series(
+                    symbol, self.model_start_date,
+                    self.model_end_date, lags=5)
+                key = self.model_cache.make_key(
+                    symbol, self.model_start_date, self.model_end_date,
+                    lags, model, data=snpret)
+            cached = self.model_cache.get(symbol, key)
+            if cached is not None:
+                return cached
+
         # Create a lagged series of the S&P500 US stock market index
-        snpret = create_lagged_series(
-            self.symbol_list[0], self.model_start_date,
-            self.model_end_date, lags=5
-        )
+        if snpret is None:
+            snpret = create_lagged_series(
+                symbol, self.model_start_date,
+                self.model_end_date, lags=5, csv_dir=csv_dir
+            )
 
-        # Use the prior two days of returns as predictor
-        # values, with direction as the response
-        X = snpret[["Lag1", "Lag2"]]
-        y = snpret["Direction"]
-        
-        # Skip days with NaN
+        # Use the prior two days of returns as predictor values, with
+        # direction as the response, built like the retrained models so
+        # that the features mean the same before and after a swap
         skip_till_date = self.model_start_date + relativedelta(days=3)
-        X = X[X.index > skip_till_date]
-        y = y[y.index > skip_till_date]
-        logging.debug(snpret[snpret.index > skip_till_date])
+        first = snpret.index.searchsorted(skip_till_date, side='right')
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug("%s", snpret[snpret.index > skip_till_date])
 
-        model = QDA()
-        model.fit(X, y)
+        model.fit(*direction_training_set(
+            snpret["Today"].values[max(first - 2, 0):]))
+        if self.model_cache is not None:
+            logging.info("Model cache miss for %s, fitted", symbol)
+            self.model_cache.put(symbol, key, model)
         return model
 
+    def precompute_predictions(self):
+        """
+        Predicts the direction for every bar of the replay window with a
+        single model call.
+
+        On bar n (1-based) calculate_signals reads
+        get_latest_bars_values(bars=3), which for the CSV handler holds
+        the prices of bars n-5, n-4 and n-3, so Lag1 and Lag2 are the
+        returns r[n-6] and r[n-5] (r[k] = p[k+1] / p[k] - 1).
+
+        :return: (ndarray) prediction indexed by bar number, NaN where
+                 no prediction is made.
+        """
+        prices = self.bars.get_all_bars_values(self.symbol_list[0],
+                                               "adj_close")
+        predictions = np.full(len(prices) + 1, np.nan)
+        if len(prices) < 6:
+            return predictions
+
+        returns = (prices[1:] / prices[:-1] - 1.0) * 100.0
+        X = pd.DataFrame({'Lag1': returns[:-4], 'Lag2': returns[1:-3]})
+        valid = np.isfinite(X.values).all(axis=1)
+        predictions[6:][valid] = self.model.predict(X[valid])
+        return predictions
+
+    def _training_snapshot(self):
+        """
+        Copies the trailing retrain_window adj_close prices, the input of
+        fit_direction_model().
+        """
+        prices = np.array(self.bars.get_latest_bars_values(
+            self.symbol_list[0], "adj_close", bars=self.retrain_window),
+            dtype=np.float64)[-self.retrain_window:]
+        if len(prices) < 30:
+            return None
+        return (prices,)
+
+    def _predict(self):
+        """
+        Returns the model prediction for the current bar.
+        """
+        if self.predictions is not None:
+            # After the last bar the window, hence the prediction, repeats
+            return self.predictions[min(self.bar_index,
+                                        len(self.predictions) - 1)]
+
+        lags = self.bars.get_latest_bars_values(
+            self.symbol_list[0], "adj_close", bars=3
+        )
+        pred_series = pd.Series(
+            {
+                'Lag0': lags[0],
+                'Lag1': lags[1],
+                'Lag2': lags[2]
+            }
+        ).pct_change()*100.0
+        pred_series = pred_series.drop('Lag0')
+        return self.model.predict(pred_series)
+
     def calculate_signals(self, event):
         """
         Calculate the SignalEvents based on market data.
@@ -85,19 +244,13 @@ class SPYDailyForecastStrategy(Strategy):
 
         if event.type == 'MARKET':
             self.bar_index += 1
+            if self.retrainer is not None:
+                self.model = self.retrainer.on_bar(
+                    self.bar_index,
+                    self.bars.get_latest_bar_datetime(sym),
+                    self._training_snapshot)
             if self.bar_index > 5:
-                lags = self.bars.get_latest_bars_values(
-                    self.symbol_list[0], "adj_close", bars=3
-                )
-                pred_series = pd.Series(
-                    {
-                        'Lag0': lags[0],
-                        'Lag1': lags[1],
-                        'Lag2': lags[2]
-                    }
-                ).pct_change()*100.0
-                pred_series = pred_series.drop('Lag0')
-                pred = self.model.predict(pred_series)
+                pred = self._predict()
 
                 if pred > 0:
                     self.up_count += 1
@@ -116,6 +269,13 @@ class SPYDailyForecastStrategy(Strategy):
                     signal = SignalEvent(sid, sym, dt, 'EXIT', 1.0)
                     self.events.put(signal)
                     
+    def end_of_run(self):
+        """
+        Stops the background retraining.
+        """
+        if self.retrainer is not None:
+            self.retrainer.shutdown()
+
     def dump_updown_count(self):
         logging.info("Up [%d]" % self.up_count)
         logging.info("Down [%d]" % self.down_count)
@@ -11,6 +11,10 @@ import time
 import logging
 import matplotlib.pyplot as plt
 
+from portfolio.journal import ResultsJournal
+from backtest.signal_replay import SignalRecorder
+from backtest.profiling import ComponentProfiler, StackSampler
+
 class Backtest(object):
 
     """
@@ -20,7 +24,12 @@ class Backtest(object):
 
     def __init__(self, source_dir, symbol_list, initial_capital,
                  heartbeat, start_date, data_handler,
-                 execution_handler, portfolio, strategy):
+                 execution_handler, portfolio, strategy,
+                 portfolio_params=None, batch_signals=False,
+                 journal_dir=None, execution_params=None,
+                 strategy_params=None, data_handler_params=None,
+                 record_signals=None, profile=False, profile_sampling=None,
+                 memory_monitor=None, telemetry=None):
         """
         Initializes the backtest.
 
@@ -33,6 +42,32 @@ class Backtest(object):
         :param execution_handler: (obj)  Handles the orders/fills for trades.
         :param portfolio: (obj) Keeps track of portfolio positions.
         :param strategy: (obj) generates signals based on market data.
+        :param portfolio_params: (dict) extra keyword arguments for the
+                                 portfolio, e.g. a risk_engine.
+        :param batch_signals: (bool) hand all the signals of a bar to the
+                              portfolio at once (Portfolio.update_signals).
+        :param journal_dir: (str) directory where a per-run ResultsJournal
+                            of holdings, equity and fills is written, e.g.
+                            'results'. None keeps the results in memory
+                            only.
+        :param execution_params: (dict) extra keyword arguments for the
+                                 execution handler, e.g. a commission model.
+        :param strategy_params: (dict) extra keyword arguments for the
+                                strategy.
+        :param data_handler_params: (dict) extra keyword arguments for the
+                                    data handler, e.g. a shared_spec.
+        :param record_signals: (str) file where the signals of the run are
+                               recorded, to be replayed with
+                               backtest.signal_replay.ReplayStrategy.
+        :param profile: (bool) time the hot-path component methods and
+                        report them next to the performance stats.
+        :param profile_sampling: (dbl) also sample the call stacks every
+                                 that many seconds, for deeper dives.
+        :param memory_monitor: (MemoryMonitor) snapshots the memory of the
+                               components, see backtest.memory.
+        :param telemetry: (Telemetry) publishes the progress of the run to
+                          a file or a local HTTP endpoint, see
+                          backtest.telemetry.
         """
 
         self.source_dir = source_dir
@@ -45,16 +80,42 @@ class Backtest(object):
         self.execution_handler_cls = execution_handler
         self.portfolio_cls = portfolio
         self.strategy_cls = strategy
+        self.portfolio_params = portfolio_params or {}
+        self.execution_params = execution_params or {}
+        self.strategy_params = strategy_params or {}
+        self.data_handler_params = data_handler_params or {}
+        self.batch_signals = batch_signals
+        self.journal = None
+        if journal_dir is not None:
+            self.journal = ResultsJournal(journal_dir)
+            self.portfolio_params = dict(self.portfolio_params,
+                                         journal=self.journal)
+        self.signal_recorder = None
+        if record_signals is not None:
+            self.signal_recorder = SignalRecorder(record_signals)
+        self.bar_count = 0
 
         self.events = queue.Queue()
 
         self.signals = 0
         self.orders = 0
         self.fills = 0
+        self.events_processed = 0
+        self.wall_time = None
         self.num_strats = 1
 
         self._generate_trading_instances()
 
+        self.profiler = None
+        if profile:
+            self.profiler = ComponentProfiler()
+            self.profiler.instrument(self)
+        self.sampler = None
+        if profile_sampling:
+            self.sampler = StackSampler(interval=profile_sampling)
+        self.memory_monitor = memory_monitor
+        self.telemetry = telemetry
+
     def _generate_trading_instances(self):
         """
         Generates the trading instance objects from their class types.
@@ -64,17 +125,21 @@ class Backtest(object):
             self.data_handler = self.data_handler_cls(self.events,
                                                       self.source_dir,
                                                       self.symbol_list,
-                                                      self.start_date)
+                                                      self.start_date,
+                                                      **self.data_handler_params)
             logging.info("Creating Strategy...")
             self.strategy = self.strategy_cls(self.data_handler,
-                                              self.events)
+                                              self.events,
+                                              **self.strategy_params)
             logging.info("Creating Portfolio...")
             self.portfolio = self.portfolio_cls(self.data_handler,
                                                 self.events,
                                                 self.start_date,
-                                                self.initial_capital)
+                                                self.initial_capital,
+                                                **self.portfolio_params)
             logging.info("Creating ExecutionHandler...")
-            self.execution_handler = self.execution_handler_cls(self.events)
+            self.execution_handler = self.execution_handler_cls(
+                self.events, self.data_handler, **self.execution_params)
         except:
             import sys
             print("Problem creating trading instances. Exception occurred [%s]" % sys.exc_info()[0])
@@ -84,42 +149,124 @@ class Backtest(object):
         """
         Executes the backtest.
         """
+        if self.sampler is not None:
+            self.sampler.start()
+        if self.telemetry is not None:
+            self.telemetry.start(self)
+        start = time.time()
+        try:
+            self._event_loop()
+            self._settle()
+        finally:
+            self.wall_time = time.time() - start
+            self.strategy.end_of_run()
+            if self.sampler is not None:
+                self.sampler.stop()
+            if self.telemetry is not None:
+                self.telemetry.finish(self)
+            if self.memory_monitor is not None:
+                self.memory_monitor.finish(self, self.bar_count)
+            if self.journal is not None:
+                self.journal.close()
+            if self.signal_recorder is not None:
+                self.signal_recorder.close()
+            self.data_handler.close()
+
+    def _event_loop(self):
+        """
+        Pulls the bars and dispatches the events until the data runs out.
+        """
         i = 0
         while True:
             i += 1
-            logging.debug("Iteration [%d]" %i)
+            logging.debug("Iteration [%d]", i)
             # Update the market bars
             if self.data_handler.continue_backtest == True:
                 self.data_handler.update_bars()
             else:
                 break
+            if self.memory_monitor is not None:
+                self.memory_monitor.on_bar(self, i)
+            if self.telemetry is not None:
+                self.telemetry.on_bar(self)
 
             # Handle the events
+            pending_signals = []
             while True:
                 try:
                     event = self.events.get(False)
                 except queue.Empty:
+                    if pending_signals:
+                        # Bar is settled, size all its signals together
+                        self.portfolio.update_signals(pending_signals)
+                        pending_signals = []
+                        continue
+                    # Let batching execution handlers release their fills
+                    self.execution_handler.end_of_bar()
+                    if not self.events.empty():
+                        continue
                     break
                 else:
                     if event is not None:
+                        self.events_processed += 1
                         if event.type == 'MARKET':
+                            self.bar_count += 1
+                            self.execution_handler.update_market(event)
                             self.strategy.calculate_signals(event)
                             self.portfolio.update_timeindex()
 
                         elif event.type == 'SIGNAL':
                             self.signals += 1
-                            self.portfolio.update_signal(event)
+                            if self.signal_recorder is not None:
+                                self.signal_recorder.record(
+                                    self.bar_count, event)
+                            if self.batch_signals:
+                                pending_signals.append(event)
+                            else:
+                                self.portfolio.update_signal(event)
 
                         elif event.type == 'ORDER':
                             self.orders += 1
                             self.execution_handler.execute_order(event)
 
+                        elif event.type == 'ORDER_BATCH':
+                            self.orders += len(event.orders)
+                            self.execution_handler.execute_orders(event.orders)
+
                         elif event.type == 'FILL':
                             self.fills += 1
                             self.portfolio.update_fill(event)
 
+                        elif event.type == 'FILL_BATCH':
+                            self.fills += len(event.fills)
+                            self.portfolio.update_fills(event.fills)
+
             time.sleep(self.heartbeat)
 
+    def _settle(self):
+        """
+        Lets the execution handler settle the orders still open once the
+        data has run out and books the fills it puts on the queue.
+        """
+        self.execution_handler.end_of_run()
+        while True:
+            try:
+                event = self.events.get(False)
+            except queue.Empty:
+                break
+            if event is None:
+                continue
+            self.events_processed += 1
+            if event.type == 'FILL':
+                self.fills += 1
+                self.portfolio.update_fill(event)
+            elif event.type == 'FILL_BATCH':
+                self.fills += len(event.fills)
+                self.portfolio.update_fills(event.fills)
+            else:
+                logging.warning("Dropped %s event left after the run",
+                                event.type)
+
     def _output_performance(self, graph=False):
         """
         Outputs the strategy performance from the backtest.
@@ -146,9 +293,19 @@ class Backtest(object):
         logging.info("Orders: {}".format(self.orders))
         logging.info("Fills: {}".format(self.fills))
 
+        if self.profiler is not None:
+            self.profiler.log_report(self.wall_time, self.bar_count,
+                                     self.events_processed)
+        if self.sampler is not None:
+            self.sampler.log_report()
+
+        if self.journal is not None:
+            logging.info("Results journal: {}".format(self.journal.path))
+
         # plot the results
         if graph == True:
             self._graph_equity_curve(self.portfolio.equity_curve)
+        return stats
 
     def _graph_equity_curve(self, equity_curve_dataframe):
         """
@@ -184,7 +341,9 @@ class Backtest(object):
     def simulate_trading(self, graph_results=True):
         """
         Simulates the backtest and outputs portfolio performance.
+
+        :return: (dict) the summary statistics of the portfolio.
         """
         self._run_backtest()
         self.strategy.dump_updown_count()
-        self._output_performance(graph=graph_results)
\ No newline at end of file
+        return self._output_performance(graph=graph_results)
\ No newline at end of file
@@ -0,0 +1,558 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# backtest.distributed.py
+
+'''
+@summary: Coordinator/worker job system spreading Backtest runs over
+          several processes or machines with a multiprocessing manager,
+          without an external broker. Jobs are leased to workers,
+          retried when a worker fails or goes silent, and their results
+          are collected into one SQLite store.
+'''
+
+# General imports
+import argparse
+import copy
+import ipaddress
+import itertools
+import json
+import logging
+import multiprocessing
+from multiprocessing.managers import BaseManager
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import traceback
+import uuid
+from collections import deque
+
+import numpy as np
+
+
+def shard_symbols(base_job, symbol_list, shard_size):
+    """
+    Splits a universe into jobs of shard_size symbols each.
+
+    :param base_job: (dict) Backtest keyword arguments shared by all the
+                     shards.
+    :return: (list) one job per shard.
+    """
+    jobs = []
+    for start in range(0, len(symbol_list), shard_size):
+        job = copy.deepcopy(base_job)
+        job['symbol_list'] = list(symbol_list[start:start + shard_size])
+        jobs.append(job)
+    return jobs
+
+
+def parameter_grid(base_job, grid):
+    """
+    One job per combination of the grid values. A key is either a
+    Backtest keyword argument or '<dict argument>.<key>', e.g.
+    'strategy_params.retrain_every'.
+
+    :param grid: (dict) key -> list of values.
+    :return: (list) the jobs.
+    """
+    keys = sorted(grid)
+    jobs = []
+    for values in itertools.product(*[grid[k] for k in keys]):
+        job = copy.deepcopy(base_job)
+        for key, value in zip(keys, values):
+            if '.' in key:
+                outer, inner = key.split('.', 1)
+                job[outer] = dict(job.get(outer) or {})
+                job[outer][inner] = value
+            else:
+                job[key] = value
+        jobs.append(job)
+    return jobs
+
+
+def _describe(job):
+    # Readable, JSON safe summary of a job for the results store
+    out = {}
+    for key, value in job.items():
+        if isinstance(value, type):
+            value = '%s.%s' % (value.__module__, value.__name__)
+        out[key] = value
+    return json.dumps(out, sort_keys=True, default=str)
+
+
+def _plain(stats):
+    # numpy scalars do not survive json
+    return dict((k, v.item() if isinstance(v, np.generic) else v)
+                for k, v in stats.items())
+
+
+class JobQueue(object):
+
+    """
+    The coordinator's job table, served to the workers by a manager.
+
+    lease() hands a pending job to a worker for lease_seconds; the
+    worker extends the lease with renew() while it runs. A job whose
+    lease expires or which fails is put back in the queue, up to
+    max_attempts, then recorded as failed. All the methods are called
+    from the manager's server threads, hence the lock.
+
+    Workers are only told that the work is done once the queue has been
+    sealed, i.e. no more jobs will be submitted, and every job is
+    finished; until then an idle worker keeps polling.
+    """
+
+    def __init__(self, store, lease_seconds=60.0, max_attempts=3):
+        self.store = store
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._pending = deque()
+        self._leases = {}
+        self._attempts = {}
+        self._finished = set()
+        self._sealed = False
+
+    def submit(self, jobs):
+        """
+        Queues Backtest keyword argument dicts.
+
+        :return: (list) the job ids.
+        """
+        ids = []
+        with self._lock:
+            if self._sealed:
+                raise ValueError("The job queue is sealed.")
+            for job in jobs:
+                job_id = uuid.uuid4().hex[:12]
+                self._jobs[job_id] = job
+                self._attempts[job_id] = 0
+                self._pending.append(job_id)
+                self.store.add_job(job_id, job)
+                ids.append(job_id)
+        return ids
+
+    def _reap(self):
+        # Requeue the jobs of workers that stopped renewing their lease
+        now = time.time()
+        for job_id, (token, worker, deadline) in list(self._leases.items()):
+            if deadline < now:
+                del self._leases[job_id]
+                logging.warning("Lease of job %s by %s expired", job_id,
+                                worker)
+                self._retry(job_id, worker, 'lease expired')
+
+    def _retry(self, job_id, worker, error):
+        if self._attempts[job_id] >= self.max_attempts:
+            self._finished.add(job_id)
+            self.store.record(job_id, 'failed', worker, self._attempts[job_id],
+                              error=error)
+        else:
+            self._pending.append(job_id)
+
+    def lease(self, worker):
+        """
+        :return: (tuple) job id, lease token and job; (None, None, None)
+                 when nothing is pending right now, and
+                 (None, None, 'done') once the queue is sealed and every
+                 job is finished.
+        """
+        with self._lock:
+            self._reap()
+            if not self._pending:
+                if self._sealed and len(self._finished) == len(self._jobs):
+                    return None, None, 'done'
+                return None, None, None
+            job_id = self._pending.popleft()
+            token = uuid.uuid4().hex
+            self._attempts[job_id] += 1
+            self._leases[job_id] = (token, worker,
+                                    time.time() + self.lease_seconds)
+            self.store.record(job_id, 'running', worker,
+                              self._attempts[job_id])
+            return job_id, token, self._jobs[job_id]
+
+    def renew(self, job_id, token):
+        """
+        :return: (bool) False if the lease was lost, e.g. it expired.
+        """
+        with self._lock:
+            lease = self._leases.get(job_id)
+            if lease is None or lease[0] != token:
+                return False
+            self._leases[job_id] = (token, lease[1],
+                                    time.time() + self.lease_seconds)
+            return True
+
+    def complete(self, job_id, token, stats, elapsed):
+        """
+        Stores the result of a job, ignored if the lease was lost.
+        """
+        with self._lock:
+            lease = self._leases.get(job_id)
+            if lease is None or lease[0] != token:
+                return False
+            del self._leases[job_id]
+            self._finished.add(job_id)
+            self.store.record(job_id, 'done', lease[1],
+                              self._attempts[job_id], stats=stats,
+                              elapsed=elapsed)
+            return True
+
+    def fail(self, job_id, token, error):
+        """
+        Reports a failed run; the job is retried or recorded as failed.
+        """
+        with self._lock:
+            lease = self._leases.get(job_id)
+            if lease is None or lease[0] != token:
+                return False
+            del self._leases[job_id]
+            logging.warning("Job %s failed on %s: %s", job_id, lease[1],
+                            error.strip().splitlines()[-1] if error else '')
+            self._retry(job_id, lease[1], error)
+            return True
+
+    def status(self):
+        """
+        :return: (dict) number of pending, running and finished jobs.
+        """
+        with self._lock:
+            self._reap()
+            return {'pending': len(self._pending),
+                    'running': len(self._leases),
+                    'finished': len(self._finished),
+                    'total': len(self._jobs)}
+
+    def is_done(self):
+        """
+        :return: (bool) True when every job submitted so far is finished.
+        """
+        with self._lock:
+            return len(self._finished) == len(self._jobs)
+
+    def seal(self):
+        """
+        Closes the queue to new jobs, so that the workers stop once the
+        jobs already submitted are finished.
+        """
+        with self._lock:
+            self._sealed = True
+
+
+class ResultsStore(object):
+
+    """
+    SQLite table of the jobs with their status, attempts, worker,
+    statistics (JSON) and error. Only the coordinator writes to it.
+    """
+
+    def __init__(self, path='distributed_results.db'):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                job TEXT,
+                status TEXT,
+                worker TEXT,
+                attempts INTEGER,
+                stats TEXT,
+                error TEXT,
+                elapsed REAL,
+                updated REAL
+            )''')
+        self._conn.commit()
+
+    def add_job(self, job_id, job):
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT INTO jobs (job_id, job, status, attempts, updated) '
+                'VALUES (?, ?, ?, 0, ?)',
+                (job_id, _describe(job), 'pending', time.time()))
+
+    def record(self, job_id, status, worker, attempts, stats=None,
+               error=None, elapsed=None):
+        with self._lock, self._conn:
+            self._conn.execute(
+                'UPDATE jobs SET status = ?, worker = ?, attempts = ?, '
+                'stats = ?, error = ?, elapsed = ?, updated = ? '
+                'WHERE job_id = ?',
+                (status, worker, attempts,
+                 json.dumps(stats) if stats is not None else None, error,
+                 elapsed, time.time(), job_id))
+
+    def results(self):
+        """
+        :return: (list) one dict per job, with the stats decoded.
+        """
+        with self._lock:
+            cur = self._conn.execute(
+                'SELECT job_id, job, status, worker, attempts, stats, error, '
+                'elapsed FROM jobs ORDER BY rowid')
+            cols = [c[0] for c in cur.description]
+            rows = [dict(zip(cols, row)) for row in cur.fetchall()]
+        for row in rows:
+            row['job'] = json.loads(row['job'])
+            row['stats'] = json.loads(row['stats']) if row['stats'] else None
+        return rows
+
+    def close(self):
+        self._conn.close()
+
+
+# The JobQueue of a coordinator, living in its manager server process
+_job_queue = None
+
+
+def _init_job_queue(store_path, lease_seconds, max_attempts):
+    global _job_queue
+    _job_queue = JobQueue(ResultsStore(store_path), lease_seconds,
+                          max_attempts)
+
+
+def _get_job_queue():
+    return _job_queue
+
+
+def _is_loopback(host):
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+class JobManager(BaseManager):
+
+    """
+    Manager serving the coordinator's JobQueue as 'jobs'.
+    """
+
+
+JobManager.register('jobs', callable=_get_job_queue)
+
+
+class Coordinator(object):
+
+    """
+    Serves a JobQueue on host:port for workers started anywhere with
+    run_worker() (or 'python -m backtest.distributed worker ...'), and
+    can start local worker processes itself.
+
+    The queue lives in a JobManager server process started by the
+    coordinator, which talks to it through a proxy like the workers do;
+    the results are read from the SQLite store the queue writes.
+
+    Jobs are dicts of Backtest keyword arguments. The classes they name
+    are pickled by reference, so every worker must be able to import
+    them, i.e. run the same code.
+
+    Jobs can be submitted in several rounds, with wait() after each
+    one; the workers keep polling until seal() (or close()) says no
+    more jobs are coming.
+
+    The manager protocol unpickles what it receives, so the authkey is
+    all that stands between the port and code execution on the
+    coordinator and the workers. Without one a random key is generated,
+    which is only allowed on a loopback interface.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, authkey=None,
+                 store_path='distributed_results.db', lease_seconds=60.0,
+                 max_attempts=3):
+        """
+        :param host: (str) interface to listen on, '0.0.0.0' for remote
+                     workers (with an explicit authkey).
+        :param port: (int) port to listen on, 0 picks a free port.
+        :param authkey: (bytes) shared secret of the workers, required
+                        unless host is a loopback address, where None
+                        generates a random one (see self.authkey).
+        :param store_path: (str) SQLite file collecting the results.
+        :param lease_seconds: (dbl) time a worker may go silent before its
+                              job is handed to another one.
+        :param max_attempts: (int) runs of a job before it is failed.
+        """
+        if authkey is None:
+            if not _is_loopback(host):
+                raise ValueError("An explicit authkey is required to "
+                                 "listen on %s." % host)
+            authkey = os.urandom(32)
+        self.authkey = authkey
+        self._local_workers = []
+
+        self._manager = JobManager(address=(host, port), authkey=authkey)
+        self._manager.start(_init_job_queue,
+                            (store_path, lease_seconds, max_attempts))
+        self.address = self._manager.address
+        self.jobs = self._manager.jobs()
+        # Opened once the server has created the table
+        self.store = ResultsStore(store_path)
+        logging.info("Job coordinator listening on %s:%d", *self.address)
+
+    def submit(self, jobs):
+        return self.jobs.submit(jobs)
+
+    def seal(self):
+        """
+        No more jobs will be submitted, the workers exit once the queue
+        is drained.
+        """
+        self.jobs.seal()
+
+    def start_local_workers(self, n_workers):
+        """
+        Starts n_workers worker processes on this host.
+        """
+        first = len(self._local_workers)
+        for i in range(first, first + n_workers):
+            proc = multiprocessing.Process(
+                target=run_worker, args=(self.address, self.authkey),
+                kwargs={'worker_id': '%s-local-%d' % (socket.gethostname(),
+                                                      i)},
+                name='backtest-worker-%d' % i)
+            proc.daemon = True
+            proc.start()
+            self._local_workers.append(proc)
+
+    def wait(self, timeout=None, poll=0.5):
+        """
+        Blocks until every job is finished.
+
+        :return: (bool) False if the timeout expired first.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while not self.jobs.is_done():
+            if deadline is not None and time.time() > deadline:
+                return False
+            # Drive the lease reaper even with no worker asking for jobs
+            self.jobs.status()
+            time.sleep(poll)
+        return True
+
+    def results(self):
+        return self.store.results()
+
+    def close(self):
+        """
+        Seals the queue, waits for the local workers and stops serving.
+        """
+        self.seal()
+        for proc in self._local_workers:
+            proc.join(5.0)
+            if proc.is_alive():
+                proc.terminate()
+        self.jobs = None
+        self._manager.shutdown()
+        self.store.close()
+
+
+def _run_job(job):
+    # Imported here so that the coordinator does not need the backtest
+    # dependencies, only the workers
+    from backtest.backtest import Backtest
+    job = dict(job)
+    graph = job.pop('graph_results', False)
+    backtest = Backtest(**job)
+    return _plain(backtest.simulate_trading(graph_results=graph))
+
+
+def run_worker(address, authkey, worker_id=None, poll=1.0):
+    """
+    Leases jobs from a coordinator and runs them until it reports that
+    every job is finished. The lease is renewed from a side thread while
+    a backtest runs.
+
+    :param address: (tuple) host and port of the coordinator.
+    :param authkey: (bytes) shared secret of the coordinator.
+    :param worker_id: (str) name reported to the coordinator.
+    :param poll: (dbl) seconds between lease attempts when idle.
+    :return: (int) number of jobs run.
+    """
+    worker_id = worker_id or '%s-%d' % (socket.gethostname(), os.getpid())
+
+    class _ClientManager(BaseManager):
+        pass
+
+    _ClientManager.register('jobs')
+    manager = _ClientManager(address=tuple(address), authkey=authkey)
+    manager.connect()
+    jobs = manager.jobs()
+
+    done = 0
+    while True:
+        try:
+            job_id, token, job = jobs.lease(worker_id)
+        except (EOFError, OSError):
+            logging.warning("Lost the coordinator, worker %s stops",
+                            worker_id)
+            break
+        if job == 'done':
+            break
+        if job_id is None:
+            time.sleep(poll)
+            continue
+
+        stop = threading.Event()
+
+        def _renew():
+            # A proxy is not thread safe, the renewer gets its own
+            renew_proxy = manager.jobs()
+            while not stop.wait(1.0):
+                if not renew_proxy.renew(job_id, token):
+                    break
+
+        renewer = threading.Thread(target=_renew)
+        renewer.daemon = True
+        renewer.start()
+        start = time.time()
+        try:
+            stats = _run_job(job)
+        except Exception:
+            stop.set()
+            jobs.fail(job_id, token, traceback.format_exc())
+        else:
+            stop.set()
+            jobs.complete(job_id, token, stats, time.time() - start)
+            done += 1
+        renewer.join()
+    logging.info("Worker %s finished after %d jobs", worker_id, done)
+    return done
+
+
+if __name__ == "__main__":
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    ch = logging.StreamHandler(sys.stdout)
+    ch.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    root.addHandler(ch)
+
+    parser = argparse.ArgumentParser(description='Distributed backtest '
+                                                 'worker.')
+    parser.add_argument('role', choices=['worker'])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, required=True)
+    parser.add_argument('--authkey',
+                        default=os.environ.get('BACKTEST_AUTHKEY'),
+                        help='shared secret of the coordinator, '
+                             '$BACKTEST_AUTHKEY by default')
+    parser.add_argument('--processes', type=int, default=1)
+    args = parser.parse_args()
+    if not args.authkey:
+        parser.error('an authkey is required, pass --authkey or set '
+                     'BACKTEST_AUTHKEY')
+
+    address = (args.host, args.port)
+    authkey = args.authkey.encode('utf-8')
+    procs = [multiprocessing.Process(target=run_worker,
+                                     args=(address, authkey))
+             for _ in range(args.processes)]
+    for proc in procs:
+        proc.start()
+    for proc in procs:
+        proc.join()
@@ -0,0 +1,237 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# backtest.memory.py
+
+'''
+@summary: Memory accounting of backtest runs. The footprint of the big
+          component structures is snapshotted every N bars, growth
+          rates are fitted over the run, and tracemalloc reports the top
+          allocation sites at the peak and their growth since the start.
+'''
+
+# General imports
+import logging
+import os
+import sys
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+
+def _frame_bytes(frame):
+    try:
+        return int(frame.memory_usage(index=True, deep=True).sum())
+    except AttributeError:
+        return 0
+
+
+def _deep_sizeof(obj):
+    """
+    Size of an object and its direct contents: the items of a tuple,
+    list or dict, the deep memory usage of pandas objects.
+    """
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        return int(obj.memory_usage(index=True, deep=True)
+                   if isinstance(obj, pd.Series)
+                   else obj.memory_usage(index=True, deep=True).sum())
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(_deep_sizeof(k) + _deep_sizeof(v)
+                    for k, v in obj.items())
+    elif isinstance(obj, (list, tuple)):
+        size += sum(_deep_sizeof(v) for v in obj)
+    return size
+
+
+def _sequence_sizeof(seq, sample=8):
+    """
+    Estimated size of a long list of similar items: the list itself plus
+    its length times the mean size of its last `sample` items, so the
+    cost does not grow with the run.
+    """
+    if not seq:
+        return sys.getsizeof(seq)
+    tail = seq[-sample:]
+    return sys.getsizeof(seq) + \
+        len(seq) * sum(_deep_sizeof(v) for v in tail) // len(tail)
+
+
+def _rss_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def component_footprint(backtest):
+    """
+    Bytes held by each of the big structures of a backtest.
+
+    :return: (dict) component name -> bytes (queue: events waiting).
+    """
+    out = {}
+    bars = backtest.data_handler
+    if hasattr(bars, 'all_data_dic'):
+        out['data_handler.all_data_dic'] = sum(
+            _frame_bytes(f) for f in bars.all_data_dic.values())
+    if hasattr(bars, 'latest_symbol_data'):
+        out['data_handler.latest_symbol_data'] = sum(
+            _sequence_sizeof(v) for v in bars.latest_symbol_data.values())
+    store = getattr(bars, 'store', None)
+    if store is not None and getattr(store, 'values', None) is not None:
+        out['data_handler.shared_store'] = store.values.nbytes + \
+            store.index.nbytes
+
+    portfolio = backtest.portfolio
+    out['portfolio.all_positions'] = _sequence_sizeof(portfolio.all_positions)
+    out['portfolio.all_holdings'] = _sequence_sizeof(portfolio.all_holdings)
+    if isinstance(portfolio.equity_curve, pd.DataFrame):
+        out['portfolio.equity_curve'] = _frame_bytes(portfolio.equity_curve)
+
+    out['events.queue_depth'] = backtest.events.qsize()
+    return out
+
+
+class MemoryMonitor(object):
+
+    """
+    Snapshots the memory of a run every `interval` bars: process RSS,
+    Python heap traced by tracemalloc (with trace=True) and the
+    footprint of the components (see component_footprint).
+
+    The snapshot with the highest traced heap (or RSS) so far is kept as
+    the peak, together with its top allocation sites. The report fits a
+    line through every series to give its growth per bar, which
+    separates data that is loaded once from structures growing with the
+    run, and compares the peak allocation sites with the first snapshot
+    to point at leaks.
+
+    tracemalloc roughly doubles the cost of allocations; trace=False
+    keeps the component accounting only.
+    """
+
+    def __init__(self, interval=1000, trace=True, top_n=10, frames=1):
+        """
+        :param interval: (int) bars between snapshots.
+        :param trace: (bool) track Python allocations with tracemalloc.
+        :param top_n: (int) allocation sites reported.
+        :param frames: (int) stack frames kept per allocation site.
+        """
+        self.interval = interval
+        self.trace = trace
+        self.top_n = top_n
+        self.frames = frames
+        self.rows = []
+        self.peak = None
+        self._first_snapshot = None
+        self._peak_snapshot = None
+        if trace and not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+
+    def snapshot(self, backtest, bar):
+        """
+        Records one snapshot.
+
+        :param backtest: the Backtest being run.
+        :param bar: (int) bar number.
+        """
+        row = {'bar': bar, 'rss': _rss_bytes()}
+        if self.trace:
+            row['traced'], row['traced_peak'] = tracemalloc.get_traced_memory()
+        row.update(component_footprint(backtest))
+        self.rows.append(row)
+
+        level = row.get('traced', row['rss'])
+        if self.peak is None or level >= self.peak.get('traced',
+                                                       self.peak['rss']):
+            self.peak = row
+            if self.trace:
+                self._peak_snapshot = tracemalloc.take_snapshot()
+                if self._first_snapshot is None:
+                    self._first_snapshot = self._peak_snapshot
+
+    def on_bar(self, backtest, bar):
+        """
+        Snapshots on the first bar, the baseline of the growth figures,
+        then every `interval` bars; call once per bar.
+        """
+        if bar == 1 or bar % self.interval == 0:
+            self.snapshot(backtest, bar)
+
+    def to_dataframe(self):
+        """
+        :return: (DataFrame) one row per snapshot, indexed by bar.
+        """
+        return pd.DataFrame(self.rows).set_index('bar')
+
+    def growth_rates(self):
+        """
+        :return: (Series) bytes per bar of every series, by least squares.
+        """
+        frame = self.to_dataframe()
+        if len(frame) < 2:
+            return pd.Series(dtype=np.float64)
+        bars = frame.index.values.astype(np.float64)
+        return pd.Series(dict(
+            (col, np.polyfit(bars, frame[col].values.astype(np.float64),
+                             1)[0])
+            for col in frame.columns))
+
+    def top_sites(self):
+        """
+        :return: (list) (site, bytes at peak, growth since the first
+                 snapshot) of the top allocation sites at the peak.
+        """
+        if self._peak_snapshot is None:
+            return []
+        stats = self._peak_snapshot.compare_to(self._first_snapshot,
+                                               'lineno')
+        stats.sort(key=lambda s: -s.size)
+        return [(str(s.traceback), s.size, s.size_diff)
+                for s in stats[:self.top_n]]
+
+    def log_report(self):
+        """
+        Logs the peak footprint, the growth rates and the top sites.
+        """
+        if not self.rows:
+            return
+        growth = self.growth_rates()
+        logging.info('**********  MEMORY  *************')
+        logging.info("Peak at bar %d:", self.peak['bar'])
+        for key, value in sorted(self.peak.items()):
+            if key == 'bar':
+                continue
+            rate = growth.get(key)
+            if key == 'events.queue_depth':
+                logging.info("  %-34s %12d events", key, value)
+            else:
+                logging.info("  %-34s %10.1f MB  %s", key, value / 1e6,
+                             '' if rate is None or np.isnan(rate)
+                             else '%+.1f KB/1k bars' % rate)
+        for site, size, diff in self.top_sites():
+            logging.info("  %-60s %10.1f MB (%+.1f MB)", site, size / 1e6,
+                         diff / 1e6)
+
+    def finish(self, backtest, bar):
+        """
+        Takes the last snapshot, unless bar was just snapshotted, logs
+        the report and stops tracemalloc. Backtest calls it when the run
+        ends, including a run that failed.
+        """
+        if not self.rows or self.rows[-1]['bar'] != bar:
+            self.snapshot(backtest, bar)
+        self.log_report()
+        self.stop()
+
+    def stop(self):
+        """
+        Stops tracemalloc.
+        """
+        if self.trace and tracemalloc.is_tracing():
+            tracemalloc.stop()
@@ -0,0 +1,191 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# backtest.profiling.py
+
+'''
+@summary: Hot-path instrumentation of a Backtest. The component methods
+          are wrapped with timers only when profiling is enabled, so a
+          run without it executes exactly the unwrapped code.
+'''
+
+# General imports
+from array import array
+from collections import Counter
+import logging
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+
+# (component attribute of Backtest, method) pairs timed by default
+HOT_PATH = (
+    ('data_handler', 'update_bars'),
+    ('strategy', 'calculate_signals'),
+    ('portfolio', 'update_timeindex'),
+    ('portfolio', 'update_signal'),
+    ('portfolio', 'update_signals'),
+    ('execution_handler', 'execute_order'),
+    ('execution_handler', 'execute_orders'),
+    ('portfolio', 'update_fill'),
+    ('portfolio', 'update_fills'),
+)
+
+
+class ComponentProfiler(object):
+
+    """
+    Times every call of the hot-path methods of a Backtest.
+
+    instrument() replaces each method by a timing wrapper set on the
+    instance, which appends the call duration to a compact array; the
+    report gives calls, cumulative time, mean, percentiles and the
+    share of the wall time of every method, plus bars and events per
+    second. Times are inclusive of the callees.
+    """
+
+    def __init__(self, methods=HOT_PATH):
+        """
+        :param methods: (tuple) (component, method) pairs to time.
+        """
+        self.methods = methods
+        self.durations = {}
+
+    def _wrap(self, name, func):
+        durations = self.durations.setdefault(name, array('d'))
+        append = durations.append
+        clock = time.perf_counter
+
+        def timed(*args, **kwargs):
+            start = clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                append(clock() - start)
+        return timed
+
+    def instrument(self, backtest):
+        """
+        Wraps the methods of the backtest components.
+        """
+        for component, method in self.methods:
+            obj = getattr(backtest, component, None)
+            func = getattr(obj, method, None)
+            if func is None:
+                continue
+            name = '%s.%s' % (type(obj).__name__, method)
+            setattr(obj, method, self._wrap(name, func))
+
+    def report(self, wall_time=None, bars=None, events=None):
+        """
+        :param wall_time: (dbl) duration of the run in seconds.
+        :param bars: (int) bars processed.
+        :param events: (int) events processed.
+        :return: (dict) statistics per method name, and 'run' totals.
+        """
+        out = {}
+        for name, durations in self.durations.items():
+            if not durations:
+                continue
+            values = np.frombuffer(durations, dtype=np.float64)
+            p50, p90, p99 = np.percentile(values, [50, 90, 99])
+            out[name] = {'calls': len(values), 'total': values.sum(),
+                         'mean': values.mean(), 'p50': p50, 'p90': p90,
+                         'p99': p99, 'max': values.max()}
+            if wall_time:
+                out[name]['share'] = values.sum() / wall_time
+        if wall_time:
+            out['run'] = {'wall_time': wall_time,
+                          'bars_per_sec': (bars or 0) / wall_time,
+                          'events_per_sec': (events or 0) / wall_time}
+        return out
+
+    def log_report(self, wall_time=None, bars=None, events=None):
+        """
+        Logs the report, slowest method first.
+        """
+        report = self.report(wall_time, bars, events)
+        run = report.pop('run', None)
+        logging.info('**********  PROFILE  ************')
+        if run is not None:
+            logging.info("Wall time: %.3fs, %.1f bars/s, %.1f events/s",
+                         run['wall_time'], run['bars_per_sec'],
+                         run['events_per_sec'])
+        for name, stats in sorted(report.items(),
+                                  key=lambda kv: -kv[1]['total']):
+            logging.info("%-40s calls=%-8d total=%.4fs (%4.1f%%) "
+                         "mean=%.1fus p50=%.1fus p90=%.1fus p99=%.1fus "
+                         "max=%.1fus", name, stats['calls'], stats['total'],
+                         100.0 * stats.get('share', 0.0),
+                         stats['mean'] * 1e6, stats['p50'] * 1e6,
+                         stats['p90'] * 1e6, stats['p99'] * 1e6,
+                         stats['max'] * 1e6)
+
+
+class StackSampler(object):
+
+    """
+    Statistical profiler for deeper dives: a daemon thread samples the
+    stack of the profiled thread every `interval` seconds and counts the
+    functions found on top of it (self time) and anywhere in it
+    (cumulative time). The profiled code itself is not instrumented.
+    """
+
+    def __init__(self, interval=0.005, thread_id=None):
+        """
+        :param interval: (dbl) seconds between samples.
+        :param thread_id: (int) thread to sample, the caller's by default.
+        """
+        self.interval = interval
+        self.thread_id = thread_id or threading.current_thread().ident
+        self.samples = 0
+        self.self_counts = Counter()
+        self.cumulative_counts = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def _label(code):
+        return '%s:%d(%s)' % (os.path.basename(code.co_filename),
+                              code.co_firstlineno, code.co_name)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            self.samples += 1
+            self.self_counts[self._label(frame.f_code)] += 1
+            seen = set()
+            while frame is not None:
+                seen.add(self._label(frame.f_code))
+                frame = frame.f_back
+            self.cumulative_counts.update(seen)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run,
+                                        name='stack-sampler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def log_report(self, top=15):
+        """
+        Logs the functions seen most often, by self and cumulative
+        samples.
+        """
+        if not self.samples:
+            return
+        logging.info("Sampled %d stacks every %.1fms", self.samples,
+                     self.interval * 1e3)
+        for title, counts in (('self', self.self_counts),
+                              ('cumulative', self.cumulative_counts)):
+            logging.info("Top %d functions by %s samples:", top, title)
+            for label, count in counts.most_common(top):
+                logging.info("  %5.1f%%  %s", 100.0 * count / self.samples,
+                             label)
@@ -0,0 +1,197 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# backtest.signal_replay.py
+
+'''
+@summary: Record the SignalEvent stream of a backtest to a compact
+          binary file and replay it into a Portfolio and an
+          ExecutionHandler without running the Strategy, to evaluate
+          sizing and execution variants cheaply.
+'''
+
+# General imports
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import struct
+
+import pandas as pd
+
+from events.events_impl import SignalEvent
+from strategy.strategy import Strategy
+
+
+MAGIC = b'SIGREC02'
+
+# Record kinds: a string table entry, then the signals referring to it
+_STRING = 0
+_SIGNAL = 1
+
+# kind, string id, utf-8 length
+_STRING_HEADER = struct.Struct('<BII')
+# kind, bar number, symbol id, strategy id, signal type id, strength,
+# datetime in ns since the epoch
+_SIGNAL_RECORD = struct.Struct('<BIIIIdq')
+_NO_DATETIME = -2 ** 63
+
+
+class SignalRecorder(object):
+
+    """
+    Appends the signals of a run to a file as they are generated.
+
+    Each signal is a fixed 33 byte record holding the bar number it was
+    generated on; symbols, strategy ids and signal types are written
+    once to an inline string table and referred to by id, so a partial
+    file (e.g. an interrupted run) is still readable.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: (str) file to write.
+        """
+        self.path = path
+        self.count = 0
+        self._ids = {}
+        self._file = open(path, 'wb')
+        self._file.write(MAGIC)
+
+    def _string_id(self, value):
+        value = '' if value is None else str(value)
+        string_id = self._ids.get(value)
+        if string_id is None:
+            string_id = self._ids[value] = len(self._ids)
+            data = value.encode('utf-8')
+            self._file.write(_STRING_HEADER.pack(_STRING, string_id,
+                                                 len(data)))
+            self._file.write(data)
+        return string_id
+
+    def record(self, bar, event):
+        """
+        :param bar: (int) number of the bar the signal belongs to.
+        :param event: (SignalEvent) the signal.
+        """
+        if event.datetime is None:
+            dt = _NO_DATETIME
+        else:
+            dt = pd.Timestamp(event.datetime).value
+        self._file.write(_SIGNAL_RECORD.pack(
+            _SIGNAL, bar, self._string_id(event.symbol),
+            self._string_id(event.strategy_id),
+            self._string_id(event.signal_type), float(event.strength), dt))
+        self.count += 1
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._file.close()
+        logging.info("Recorded %d signals to %s", self.count, self.path)
+
+
+def load_signals(path):
+    """
+    Reads a file written by SignalRecorder.
+
+    :return: (dict) bar number -> list of SignalEvent, in recorded order.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError("%s is not a signal recording." % path)
+
+    strings = {}
+    signals = {}
+    pos = len(MAGIC)
+    while pos < len(data):
+        kind = data[pos]
+        if kind == _STRING:
+            if pos + _STRING_HEADER.size > len(data):
+                break
+            _, string_id, length = _STRING_HEADER.unpack_from(data, pos)
+            pos += _STRING_HEADER.size
+            strings[string_id] = data[pos:pos + length].decode('utf-8')
+            pos += length
+        elif kind == _SIGNAL:
+            if pos + _SIGNAL_RECORD.size > len(data):
+                # Truncated last record
+                break
+            _, bar, symbol, strategy_id, signal_type, strength, dt = \
+                _SIGNAL_RECORD.unpack_from(data, pos)
+            pos += _SIGNAL_RECORD.size
+            signals.setdefault(bar, []).append(SignalEvent(
+                strings[strategy_id], strings[symbol],
+                None if dt == _NO_DATETIME else pd.Timestamp(dt),
+                strings[signal_type], strength))
+        else:
+            raise ValueError("Corrupt signal recording %s at byte %d"
+                             % (path, pos))
+    return signals
+
+
+class ReplayStrategy(Strategy):
+
+    """
+    Strategy putting back the signals of a recording on the bar they
+    were generated, instead of computing them. Used with the same data
+    handler and start date as the recorded run, the Portfolio and the
+    ExecutionHandler see the same events as in that run.
+    """
+
+    def __init__(self, bars, events, path):
+        """
+        :param bars: The DataHandler object.
+        :param events: The Event Queue object.
+        :param path: (str) file written by SignalRecorder.
+        """
+        self.bars = bars
+        self.symbol_list = self.bars.symbol_list
+        self.events = events
+        self.signals = load_signals(path)
+        self.bar = 0
+        self.replayed = 0
+
+    def calculate_signals(self, event):
+        """
+        Puts the recorded signals of the current bar on the queue.
+        """
+        if event.type == 'MARKET':
+            self.bar += 1
+            for signal in self.signals.get(self.bar, ()):
+                self.events.put(signal)
+                self.replayed += 1
+
+    def dump_updown_count(self):
+        logging.info("Replayed [%d] signals" % self.replayed)
+
+
+def _run_variant(kwargs):
+    from backtest.backtest import Backtest
+    return Backtest(**kwargs).simulate_trading(graph_results=False)
+
+
+def replay_variants(path, variants, n_jobs=None, **backtest_kwargs):
+    """
+    Replays one recording under several portfolio / execution set-ups,
+    in parallel.
+
+    :param path: (str) file written by SignalRecorder.
+    :param variants: (list) dicts of Backtest keyword arguments that
+                     override backtest_kwargs, e.g. {'portfolio_params':
+                     {'sizer': EqualWeightSizer()}}.
+    :param n_jobs: (int) processes, None for one per CPU and 1 to run in
+                   this process.
+    :param backtest_kwargs: Backtest keyword arguments common to all the
+                            variants, except the strategy.
+    :return: (list) summary statistics of each variant, in order.
+    """
+    jobs = []
+    for variant in variants:
+        kwargs = dict(backtest_kwargs, strategy=ReplayStrategy)
+        kwargs.update(variant)
+        kwargs['strategy_params'] = dict(kwargs.get('strategy_params') or {},
+                                         path=path)
+        jobs.append(kwargs)
+    if n_jobs == 1:
+        return [_run_variant(kwargs) for kwargs in jobs]
+    with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+        return list(pool.map(_run_variant, jobs))
@@ -0,0 +1,240 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# backtest.telemetry.py
+
+'''
+@summary: Live progress of long backtests. A snapshot of the simulated
+          date, throughput, queue depth, ETA and equity is published
+          every few seconds of wall time to a JSON file and / or a local
+          HTTP endpoint, without any formatting in between.
+'''
+
+# General imports
+import json
+import logging
+import os
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Snapshot fields exported as Prometheus gauges on /metrics
+GAUGES = (
+    ('bars', 'backtest_bars', 'Bars processed.'),
+    ('total_bars', 'backtest_total_bars', 'Bars in the replay window.'),
+    ('events', 'backtest_events', 'Events processed.'),
+    ('bars_per_sec', 'backtest_bars_per_second',
+     'Bars per second over the last interval.'),
+    ('events_per_sec', 'backtest_events_per_second',
+     'Events per second over the last interval.'),
+    ('queue_depth', 'backtest_queue_depth', 'Events waiting in the queue.'),
+    ('eta_seconds', 'backtest_eta_seconds', 'Estimated seconds left.'),
+    ('equity', 'backtest_equity', 'Marked-to-market portfolio value.'),
+    ('signals', 'backtest_signals', 'Signals generated.'),
+    ('orders', 'backtest_orders', 'Orders sent.'),
+    ('fills', 'backtest_fills', 'Fills received.'),
+    ('elapsed', 'backtest_elapsed_seconds', 'Wall time since the start.'),
+)
+
+
+def _total_bars(bars):
+    """
+    Bars in the replay window, None when the data handler cannot tell.
+    """
+    try:
+        return len(bars.get_all_bars_values(bars.symbol_list[0],
+                                            'adj_close'))
+    except (AttributeError, IndexError, KeyError, NotImplementedError):
+        return None
+
+
+class Telemetry(object):
+
+    """
+    Publishes the progress of a running Backtest.
+
+    on_bar() only reads the clock until `interval` seconds have passed
+    since the last snapshot, so the per-bar cost is negligible. A
+    snapshot is a plain dict: it is written atomically to `path` as
+    JSON, and served by the HTTP endpoint (with port set) as JSON on /
+    and in the Prometheus text format on /metrics. The endpoint thread
+    only ever reads the last published dict.
+    """
+
+    def __init__(self, interval=5.0, path=None, port=None, host='127.0.0.1',
+                 log=False):
+        """
+        :param interval: (dbl) seconds of wall time between snapshots.
+        :param path: (str) JSON file rewritten with every snapshot.
+        :param port: (int) port of the HTTP endpoint, 0 picks a free port,
+                     None disables it.
+        :param host: (str) interface of the HTTP endpoint.
+        :param log: (bool) also log a progress line with every snapshot.
+        """
+        self.interval = interval
+        self.path = path
+        self.log = log
+        self.latest = {'status': 'starting'}
+        self._start = None
+        self._next = 0.0
+        self._last = None
+        self._total_bars = None
+
+        self._httpd = None
+        self._thread = None
+        if port is not None:
+            self._httpd = ThreadingHTTPServer((host, port),
+                                              self._handler_class())
+            self._httpd.daemon_threads = True
+            self.host, self.port = self._httpd.server_address[:2]
+
+    @property
+    def url(self):
+        if self._httpd is None:
+            return None
+        return 'http://%s:%d' % (self.host, self.port)
+
+    def _handler_class(self):
+        telemetry = self
+
+        class _Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path.startswith('/metrics'):
+                    body = telemetry.prometheus().encode('utf-8')
+                    content_type = 'text/plain; version=0.0.4'
+                elif self.path in ('/', '/status'):
+                    body = json.dumps(telemetry.latest).encode('utf-8')
+                    content_type = 'application/json'
+                else:
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, fmt, *args):
+                logging.debug(fmt, *args)
+
+        return _Handler
+
+    def start(self, backtest):
+        """
+        Starts the clock and the HTTP endpoint.
+        """
+        self._start = time.time()
+        self._next = self._start + self.interval
+        self._last = (self._start, 0, 0)
+        self._total_bars = _total_bars(backtest.data_handler)
+        if self._httpd is not None and self._thread is None:
+            self._thread = threading.Thread(target=self._httpd.serve_forever,
+                                            name='backtest-telemetry')
+            self._thread.daemon = True
+            self._thread.start()
+            logging.info("Backtest telemetry on %s/metrics", self.url)
+        self.publish(backtest, self._start, status='running')
+
+    def on_bar(self, backtest):
+        """
+        Publishes a snapshot when the interval has elapsed; call once per
+        bar.
+        """
+        now = time.time()
+        if now >= self._next:
+            self._next = now + self.interval
+            self.publish(backtest, now, status='running')
+
+    def snapshot(self, backtest, now, status):
+        """
+        :return: (dict) the progress of the backtest at `now`.
+        """
+        last_time, last_bars, last_events = self._last
+        bars = backtest.bar_count
+        events = backtest.events_processed
+        span = now - last_time
+        bars_per_sec = (bars - last_bars) / span if span > 0 else None
+        events_per_sec = (events - last_events) / span if span > 0 else None
+        self._last = (now, bars, events)
+
+        data_handler = backtest.data_handler
+        try:
+            sim_time = str(data_handler.get_latest_bar_datetime(
+                data_handler.symbol_list[0]))
+        except (IndexError, KeyError):
+            sim_time = None
+
+        portfolio = backtest.portfolio
+        try:
+            equity = float(portfolio.current_equity())
+        except (AttributeError, KeyError):
+            equity = float(portfolio.current_holdings['total'])
+
+        eta = None
+        if self._total_bars is not None and bars_per_sec:
+            eta = max(self._total_bars - bars, 0) / bars_per_sec
+
+        return {'status': status, 'time': now, 'elapsed': now - self._start,
+                'simulated_datetime': sim_time, 'bars': bars,
+                'total_bars': self._total_bars, 'events': events,
+                'bars_per_sec': bars_per_sec,
+                'events_per_sec': events_per_sec,
+                'queue_depth': backtest.events.qsize(), 'eta_seconds': eta,
+                'equity': equity, 'signals': backtest.signals,
+                'orders': backtest.orders, 'fills': backtest.fills}
+
+    def publish(self, backtest, now, status):
+        """
+        Takes a snapshot and writes it out.
+        """
+        snapshot = self.snapshot(backtest, now, status)
+        self.latest = snapshot
+        if self.path is not None:
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(snapshot, f)
+            os.replace(tmp, self.path)
+        if self.log:
+            logging.info("Progress: %s bar %d/%s, %.0f bars/s, equity %.2f",
+                         snapshot['simulated_datetime'], snapshot['bars'],
+                         snapshot['total_bars'],
+                         snapshot['bars_per_sec'] or 0.0, snapshot['equity'])
+
+    def prometheus(self):
+        """
+        :return: (str) the last snapshot in the Prometheus text format.
+        """
+        snapshot = self.latest
+        lines = []
+        for key, name, help_text in GAUGES:
+            value = snapshot.get(key)
+            if value is None:
+                continue
+            lines.append('# HELP %s %s' % (name, help_text))
+            lines.append('# TYPE %s gauge' % name)
+            lines.append('%s %r' % (name, float(value)))
+        lines.append('backtest_running %d'
+                     % (snapshot.get('status') == 'running'))
+        return '\n'.join(lines) + '\n'
+
+    def finish(self, backtest):
+        """
+        Publishes the final snapshot; the endpoint keeps serving it until
+        stop().
+        """
+        self.publish(backtest, time.time(), status='finished')
+
+    def stop(self):
+        """
+        Shuts the HTTP endpoint down.
+        """
+        if self._thread is not None:
+            self._httpd.shutdown()
+            self._thread.join()
+            self._thread = None
+        if self._httpd is not None:
+            self._httpd.server_close()
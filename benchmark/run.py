@@ -0,0 +1,212 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# benchmark.run.py
+
+'''
+@summary: Runs the benchmark scenarios on synthetic data and writes the
+          timings to a JSON file, and compares two such files, e.g. the
+          results of two commits:
+
+          python -m benchmark.run --symbols 10 --bars 5000 --resolution minute
+          python -m benchmark.run compare old.json new.json
+'''
+
+# General imports
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmark.scenarios import SCENARIOS
+from benchmark.synthetic import RESOLUTIONS, bars_per_year, write_csv_dir
+
+
+def git_commit():
+    """
+    :return: (str) the commit of the tree, with '-dirty' when it has
+             uncommitted changes, None outside a git checkout.
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        commit = subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=root,
+            stderr=subprocess.DEVNULL).decode().strip()
+        dirty = subprocess.check_output(
+            ['git', 'status', '--porcelain', '--untracked-files=no'],
+            cwd=root, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ('-dirty' if dirty else '')
+
+
+def environment():
+    return {'python': platform.python_version(),
+            'numpy': np.__version__, 'pandas': pd.__version__,
+            'platform': platform.platform(), 'machine': platform.machine(),
+            'cpus': os.cpu_count()}
+
+
+def time_scenario(scenario, ctx, repeat):
+    """
+    Sets the scenario up and times it `repeat` times.
+
+    :return: (dict) the timings in seconds and the throughput.
+    """
+    times = []
+    items = None
+    for _ in range(repeat):
+        run = scenario(ctx)
+        start = time.perf_counter()
+        result = run()
+        elapsed = time.perf_counter() - start
+        if isinstance(result, tuple):
+            # The scenario timed its own hot section
+            result, elapsed = result
+        items = result
+        times.append(elapsed)
+    best = min(times)
+    return {'times': times, 'min': best, 'median': float(np.median(times)),
+            'mean': float(np.mean(times)), 'items': items,
+            'items_per_sec': items / best if best > 0 else None}
+
+
+def run_benchmarks(n_symbols=5, n_bars=2000, resolution='daily', seed=0,
+                   repeat=3, scenarios=None, data_dir=None):
+    """
+    Generates the data and times the scenarios.
+
+    :param n_symbols: (int) symbols generated.
+    :param n_bars: (int) bars per symbol.
+    :param resolution: (str) 'daily', 'minute' or 'tick'.
+    :param seed: (int) seed of the synthetic data.
+    :param repeat: (int) timings per scenario, the best one is reported.
+    :param scenarios: (list) names of the scenarios, all by default.
+    :param data_dir: (str) directory for the CSV files, a temporary one
+                     removed afterwards by default.
+    :return: (dict) the results, ready to be dumped as JSON.
+    """
+    names = list(scenarios or SCENARIOS)
+    for name in names:
+        if name not in SCENARIOS:
+            raise ValueError("Unknown scenario %s, expected one of %s"
+                             % (name, ', '.join(SCENARIOS)))
+
+    tmp_dir = None
+    if data_dir is None:
+        data_dir = tmp_dir = tempfile.mkdtemp(prefix='benchmark-')
+    ctx = {'csv_dir': data_dir, 'n_bars': n_bars,
+           'start_date': datetime.datetime(1999, 1, 1),
+           'periods': bars_per_year(resolution)}
+    results = {}
+    try:
+        ctx['symbol_list'] = write_csv_dir(data_dir, n_symbols, n_bars,
+                                           resolution, seed)
+        for name in names:
+            logging.info("Running %s...", name)
+            results[name] = time_scenario(SCENARIOS[name], ctx, repeat)
+            logging.info("%-30s %10.4fs  %12.0f items/s", name,
+                         results[name]['min'],
+                         results[name]['items_per_sec'] or 0.0)
+    finally:
+        store = ctx.get('shared_store')
+        if store is not None:
+            store.unlink()
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return {'commit': git_commit(),
+            'timestamp': datetime.datetime.utcnow().isoformat() + 'Z',
+            'environment': environment(),
+            'parameters': {'symbols': n_symbols, 'bars': n_bars,
+                           'resolution': resolution, 'seed': seed,
+                           'repeat': repeat},
+            'scenarios': results}
+
+
+def compare(old, new):
+    """
+    Speed-up of every scenario present in both result files, from their
+    best timings.
+
+    :param old: (dict) results of the baseline.
+    :param new: (dict) results of the candidate.
+    :return: (dict) scenario -> (old seconds, new seconds, speed-up).
+    """
+    if old.get('parameters') != new.get('parameters'):
+        logging.warning("The runs used different parameters: %s vs %s",
+                        old.get('parameters'), new.get('parameters'))
+    out = {}
+    for name, stats in new['scenarios'].items():
+        base = old['scenarios'].get(name)
+        if base is None:
+            continue
+        out[name] = (base['min'], stats['min'], base['min'] / stats['min'])
+    return out
+
+
+def _default_output(commit, resolution):
+    return os.path.join('benchmark_results', '%s-%s.json'
+                        % (commit or 'nogit', resolution))
+
+
+if __name__ == "__main__":
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    ch = logging.StreamHandler(sys.stdout)
+    ch.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    root.addHandler(ch)
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'compare':
+        parser = argparse.ArgumentParser(description='Compare two '
+                                                     'benchmark results.')
+        parser.add_argument('command', choices=['compare'])
+        parser.add_argument('old')
+        parser.add_argument('new')
+        args = parser.parse_args()
+        with open(args.old) as f:
+            old = json.load(f)
+        with open(args.new) as f:
+            new = json.load(f)
+        logging.info("%s -> %s", old.get('commit'), new.get('commit'))
+        for name, (before, after, speedup) in compare(old, new).items():
+            logging.info("%-30s %10.4fs -> %10.4fs  x%.2f", name, before,
+                         after, speedup)
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser(description='Benchmark the engine on '
+                                                 'synthetic data.')
+    parser.add_argument('--symbols', type=int, default=5)
+    parser.add_argument('--bars', type=int, default=2000)
+    parser.add_argument('--resolution', choices=RESOLUTIONS,
+                        default='daily')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS))
+    parser.add_argument('--data-dir', help='keep the generated CSV files '
+                                           'in this directory')
+    parser.add_argument('--output', help='results file, '
+                                         'benchmark_results/<commit>-'
+                                         '<resolution>.json by default')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.symbols, args.bars, args.resolution,
+                             args.seed, args.repeat, args.scenarios,
+                             args.data_dir)
+    output = args.output or _default_output(results['commit'],
+                                            args.resolution)
+    directory = os.path.dirname(output)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    logging.info("Results written to %s", output)
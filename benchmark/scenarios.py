@@ -0,0 +1,227 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# benchmark.scenarios.py
+
+'''
+@summary: Benchmark scenarios of the engine. A scenario does its set-up
+          untimed and returns the callable to time, which returns the
+          number of items (bars, events, runs) it processed.
+'''
+
+# General imports
+from collections import OrderedDict
+import time
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+import numpy as np
+
+from backtest.backtest import Backtest
+from datahandler.csv_data_handler import HistoricCSVDataHandler
+from datahandler.shared_memory_data_handler import (SharedBarStore,
+                                                    SharedMemoryDataHandler)
+from events.events_impl import FillEvent, SignalEvent
+from execution.simulated_execution import SimulatedExecutionHandler
+from performance.performance import (create_batch_summary_stats,
+                                     create_drawdowns, create_sharpe_ratio)
+from portfolio.portfolio import Portfolio
+from strategy.strategy import Strategy
+
+
+class CycleStrategy(Strategy):
+
+    """
+    Deterministic strategy of the benchmarks: every symbol goes long for
+    `hold` bars out of 2*hold, with the cycles of the symbols staggered,
+    so that the signal, order and fill paths carry a steady load
+    independent of the data.
+    """
+
+    def __init__(self, bars, events, hold=5):
+        self.bars = bars
+        self.symbol_list = self.bars.symbol_list
+        self.events = events
+        self.hold = hold
+        self.bar = 0
+
+    def calculate_signals(self, event):
+        if event.type == 'MARKET':
+            self.bar += 1
+            period = 2 * self.hold
+            for i, symbol in enumerate(self.symbol_list):
+                phase = (self.bar + i) % period
+                if phase == 0:
+                    self.events.put(SignalEvent('BENCH', symbol, None,
+                                                'LONG', 1.0))
+                elif phase == self.hold:
+                    self.events.put(SignalEvent('BENCH', symbol, None,
+                                                'EXIT', 1.0))
+
+    def dump_updown_count(self):
+        pass
+
+
+def _drain(events):
+    while not events.empty():
+        events.get(False)
+
+
+def _csv_handler(ctx):
+    return HistoricCSVDataHandler(queue.Queue(), ctx['csv_dir'],
+                                  ctx['symbol_list'], ctx['start_date'])
+
+
+def load_csv(ctx):
+    """
+    HistoricCSVDataHandler start-up: parsing and aligning the files.
+    Items: bars loaded.
+    """
+    def run():
+        _csv_handler(ctx)
+        return ctx['n_bars'] * len(ctx['symbol_list'])
+    return run
+
+
+def update_bars_csv(ctx):
+    """
+    HistoricCSVDataHandler.update_bars over the whole data set.
+    Items: bar updates (one per symbol per call).
+    """
+    bars = _csv_handler(ctx)
+
+    def run():
+        count = 0
+        while bars.continue_backtest:
+            bars.update_bars()
+            _drain(bars.events)
+            count += bars.continue_backtest
+        return count * len(ctx['symbol_list'])
+    return run
+
+
+def update_bars_shared(ctx):
+    """
+    SharedMemoryDataHandler.update_bars over the whole data set, the
+    store being loaded once outside the timings. Items: bar updates.
+    """
+    store = ctx.get('shared_store')
+    if store is None:
+        store = ctx['shared_store'] = SharedBarStore.create(
+            ctx['csv_dir'], ctx['symbol_list'], ctx['start_date'])
+    bars = SharedMemoryDataHandler(queue.Queue(), ctx['csv_dir'],
+                                   ctx['symbol_list'], ctx['start_date'],
+                                   shared_spec=store.spec)
+
+    def run():
+        count = 0
+        try:
+            while bars.continue_backtest:
+                bars.update_bars()
+                _drain(bars.events)
+                count += bars.continue_backtest
+        finally:
+            bars.close()
+        return count * len(ctx['symbol_list'])
+    return run
+
+
+def backtest_loop(ctx):
+    """
+    The full Backtest event loop with CycleStrategy, the CSV handler,
+    the simulated execution and the Portfolio, with no results journal;
+    the start-up and the performance output are not timed. Items: events
+    processed.
+    """
+    backtest = Backtest(ctx['csv_dir'], ctx['symbol_list'], 100000.0, 0.0,
+                        ctx['start_date'], HistoricCSVDataHandler,
+                        SimulatedExecutionHandler, Portfolio, CycleStrategy,
+                        journal_dir=None)
+
+    def run():
+        backtest._run_backtest()
+        return backtest.events_processed
+    return run
+
+
+def portfolio_bookkeeping(ctx):
+    """
+    Portfolio.update_timeindex every bar and one update_fill per symbol
+    every 5 bars, timed apart from the bar updates feeding them.
+    Items: bars.
+    """
+    bars = _csv_handler(ctx)
+    portfolio = Portfolio(bars, bars.events, ctx['start_date'], 100000.0)
+    symbols = ctx['symbol_list']
+
+    def run():
+        clock = time.perf_counter
+        elapsed = 0.0
+        count = 0
+        while True:
+            bars.update_bars()
+            _drain(bars.events)
+            if not bars.continue_backtest:
+                break
+            count += 1
+            start = clock()
+            portfolio.update_timeindex()
+            if count % 5 == 0:
+                direction = 'BUY' if count % 10 == 0 else 'SELL'
+                for symbol in symbols:
+                    portfolio.update_fill(FillEvent(
+                        None, symbol, 'BENCH', 100, direction, 0))
+            elapsed += clock() - start
+        start = clock()
+        portfolio.create_equity_curve_dataframe()
+        elapsed += clock() - start
+        return count, elapsed
+    return run
+
+
+def _equity(ctx):
+    frame = _csv_handler(ctx).all_data_dic[ctx['symbol_list'][0]]
+    return frame['adj_close'] / frame['adj_close'].iloc[0]
+
+
+def performance_sharpe_drawdowns(ctx):
+    """
+    create_sharpe_ratio and create_drawdowns on one equity curve, as
+    Portfolio.output_summary_stats calls them. Items: bars.
+    """
+    equity = _equity(ctx)
+    returns = equity.pct_change()
+
+    def run():
+        create_sharpe_ratio(returns, periods=ctx['periods'])
+        create_drawdowns(equity)
+        return len(equity)
+    return run
+
+
+def performance_batch(ctx):
+    """
+    create_batch_summary_stats on the curves of every symbol.
+    Items: runs x bars.
+    """
+    bars = _csv_handler(ctx)
+    equity = np.vstack([bars.all_data_dic[s]['adj_close'].values
+                        for s in ctx['symbol_list']])
+
+    def run():
+        create_batch_summary_stats(equity, periods=ctx['periods'])
+        return equity.size
+    return run
+
+
+SCENARIOS = OrderedDict([
+    ('load_csv', load_csv),
+    ('update_bars_csv', update_bars_csv),
+    ('update_bars_shared', update_bars_shared),
+    ('backtest_loop', backtest_loop),
+    ('portfolio_bookkeeping', portfolio_bookkeeping),
+    ('performance_sharpe_drawdowns', performance_sharpe_drawdowns),
+    ('performance_batch', performance_batch),
+])
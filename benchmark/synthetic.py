@@ -0,0 +1,144 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# benchmark.synthetic.py
+
+'''
+@summary: Seeded synthetic OHLCV data at daily, minute or tick
+          resolution, written in the CSV format read by
+          HistoricCSVDataHandler. The same seed always gives the same
+          bars, whatever the number of symbols.
+'''
+
+# General imports
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+
+RESOLUTIONS = ('daily', 'minute', 'tick')
+
+# Regular session, 09:30 to 16:00
+SESSION_OPEN = pd.Timedelta(hours=9, minutes=30)
+SESSION_MINUTES = 390
+SESSION_NS = SESSION_MINUTES * 60 * 10 ** 9
+
+# Mean time between two ticks
+TICK_GAP_NS = 500 * 10 ** 6
+
+HEADERS = ['open', 'high', 'low', 'close', 'volume', 'adj_close']
+
+
+def bars_per_year(resolution):
+    """
+    :return: (dbl) bars in 252 trading days, the periods used to
+             annualise the statistics.
+    """
+    if resolution == 'daily':
+        return 252.0
+    if resolution == 'minute':
+        return 252.0 * SESSION_MINUTES
+    if resolution == 'tick':
+        return 252.0 * SESSION_NS / TICK_GAP_NS
+    raise ValueError("Unknown resolution %s, expected one of %s"
+                     % (resolution, ', '.join(RESOLUTIONS)))
+
+
+def symbol_names(n_symbols):
+    return ['SYN%04d' % i for i in range(n_symbols)]
+
+
+def make_index(n_bars, resolution, start='2000-01-03', rng=None):
+    """
+    Timestamps shared by every symbol: business days, the minutes of the
+    regular sessions, or ticks arriving at exponential intervals within
+    the sessions (unique, to the nanosecond).
+
+    :param rng: (Generator) draws the tick arrivals.
+    """
+    bars_per_year(resolution)
+    if resolution == 'daily':
+        return pd.bdate_range(start, periods=n_bars, name='date')
+
+    if resolution == 'minute':
+        offsets = np.arange(n_bars, dtype=np.int64) * 60 * 10 ** 9
+    else:
+        gaps = np.maximum(rng.exponential(TICK_GAP_NS, n_bars), 1)
+        offsets = np.cumsum(gaps.astype(np.int64))
+        offsets -= offsets[0]
+    sessions = offsets // SESSION_NS
+    days = pd.bdate_range(start, periods=int(sessions[-1]) + 1 if n_bars
+                          else 0)
+    index = days[sessions] + SESSION_OPEN + \
+        pd.to_timedelta(offsets % SESSION_NS, unit='ns')
+    return pd.DatetimeIndex(index, name='date')
+
+
+def generate_bars(n_symbols, n_bars, resolution='daily', seed=0,
+                  start='2000-01-03'):
+    """
+    Random walks with a common market factor, one frame per symbol.
+
+    Each symbol has its own start price, volatility and market beta; log
+    returns are beta times the market return plus an idiosyncratic one,
+    scaled to the resolution. Ticks have open = high = low = close.
+
+    :param n_symbols: (int) symbols to generate.
+    :param n_bars: (int) bars per symbol.
+    :param resolution: (str) 'daily', 'minute' or 'tick'.
+    :param seed: (int) seed of the data.
+    :param start: (str) first day.
+    :return: (dict) symbol -> DataFrame of open, high, low, close,
+             volume and adj_close indexed by date.
+    """
+    periods = bars_per_year(resolution)
+    market_rng = np.random.default_rng(seed)
+    index = make_index(n_bars, resolution, start, market_rng)
+    market = market_rng.normal(0.0, 0.18 / np.sqrt(periods), n_bars)
+
+    data = {}
+    for i, symbol in enumerate(symbol_names(n_symbols)):
+        # Own stream per symbol, independent of n_symbols
+        rng = np.random.default_rng([seed, i + 1])
+        price = rng.uniform(20.0, 200.0)
+        sigma = rng.uniform(0.15, 0.45) / np.sqrt(periods)
+        beta = rng.uniform(0.5, 1.5)
+
+        log_ret = beta * market + rng.normal(0.0, sigma, n_bars)
+        close = price * np.exp(np.cumsum(log_ret))
+        if resolution == 'tick':
+            open_ = high = low = close
+            volume = rng.geometric(0.01, n_bars)
+        else:
+            prev = np.concatenate(([price], close[:-1]))
+            open_ = prev * np.exp(rng.normal(0.0, sigma / 4.0, n_bars))
+            wick = np.abs(rng.normal(0.0, sigma / 2.0, (2, n_bars)))
+            high = np.maximum(open_, close) * np.exp(wick[0])
+            low = np.minimum(open_, close) * np.exp(-wick[1])
+            volume = rng.lognormal(13.0 if resolution == 'daily' else 8.0,
+                                   0.5, n_bars).astype(np.int64)
+
+        data[symbol] = pd.DataFrame({'open': open_, 'high': high,
+                                     'low': low, 'close': close,
+                                     'volume': volume, 'adj_close': close},
+                                    index=index, columns=HEADERS)
+    return data
+
+
+def write_csv_dir(csv_dir, n_symbols, n_bars, resolution='daily', seed=0,
+                  start='2000-01-03'):
+    """
+    Generates the bars and writes one <symbol>.csv per symbol.
+
+    :return: (list) the symbols written.
+    """
+    if not os.path.isdir(csv_dir):
+        os.makedirs(csv_dir)
+    data = generate_bars(n_symbols, n_bars, resolution, seed, start)
+    for symbol, frame in data.items():
+        frame.to_csv(os.path.join(csv_dir, '%s.csv' % symbol),
+                     index_label='date')
+    logging.info("Wrote %d symbols x %d %s bars to %s", n_symbols, n_bars,
+                 resolution, csv_dir)
+    return list(data)
@@ -70,4 +70,11 @@ class DataHandler(object):
         in a tuple OHLCVI format: (datetime, open, high, low,
         close, volume, open interest).
         """
-        raise NotImplementedError("Should implement update_bars()")
\ No newline at end of file
+        raise NotImplementedError("Should implement update_bars()")
+
+    def close(self):
+        """
+        Releases the resources held by the handler once the backtest
+        is over. Does nothing by default.
+        """
+        pass
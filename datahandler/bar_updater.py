@@ -0,0 +1,229 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# datahandler.bar_updater.py
+
+'''
+@summary: Incremental updater of the CSV bar store read by
+          HistoricCSVDataHandler. Only the bars newer than the last one
+          stored are fetched from a pluggable source and appended, and
+          the caches built on the updated symbols are invalidated.
+'''
+
+# General imports
+from abc import ABCMeta, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+import re
+import shutil
+import tempfile
+
+import pandas as pd
+
+from utils.create_lagged_series import clear_lagged_series_cache
+
+
+COLUMNS = ['open', 'high', 'low', 'close', 'volume', 'adj_close']
+
+
+class BarSource(object):
+
+    """
+    BarSource is an abstract base class for the providers of new bars.
+    """
+
+    __metaclass__ = ABCMeta
+
+    @abstractmethod
+    def fetch(self, symbol, since):
+        """
+        Returns the bars of a symbol strictly after since.
+
+        :param symbol: (str) the symbol.
+        :param since: (Timestamp) last stored bar, None when the symbol
+                      has no bars yet.
+        :return: (DataFrame) date indexed bars with the COLUMNS columns.
+        """
+        raise NotImplementedError("Should implement fetch()")
+
+
+class FileDropSource(BarSource):
+
+    """
+    Imports bars from CSV files dropped in a directory, in the format of
+    the bar store. Every file named '<symbol>.csv' or
+    '<symbol>_<YYYYMMDD>.csv' is read, so daily drops can pile up; bars
+    already stored are skipped, which makes imports idempotent. The
+    date suffix is matched exactly, so the drops of BRK never pick up
+    those of BRK_B.
+    """
+
+    def __init__(self, drop_dir):
+        """
+        :param drop_dir: (str) directory where the new files are dropped.
+        """
+        self.drop_dir = drop_dir
+
+    def fetch(self, symbol, since):
+        pattern = re.compile(r'%s(_\d{8})?\.csv$' % re.escape(symbol))
+        names = [n for n in os.listdir(self.drop_dir) if pattern.match(n)]
+        frames = [read_bars(os.path.join(self.drop_dir, name))
+                  for name in sorted(names)]
+        if not frames:
+            return pd.DataFrame(columns=COLUMNS)
+        bars = pd.concat(frames)
+        bars = bars[~bars.index.duplicated(keep='last')].sort_index()
+        if since is not None:
+            bars = bars[bars.index > since]
+        return bars
+
+
+def read_bars(path):
+    """
+    Reads a bar file with the header used by HistoricCSVDataHandler.
+    """
+    return pd.read_csv(path, header=0, index_col=0, parse_dates=True,
+                       names=['date'] + COLUMNS).sort_index()
+
+
+def last_timestamp(path):
+    """
+    Returns the date of the last bar of a bar file, reading only its
+    tail, or None when the file has no bars.
+    """
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        block = min(size, 4096)
+        while True:
+            f.seek(size - block)
+            lines = f.read(block).splitlines()
+            lines = [l for l in lines if l.strip()]
+            if len(lines) > 1 or block == size:
+                break
+            block = min(size, block * 2)
+    if len(lines) < 2 and block == size:
+        # Header only
+        return None
+    return pd.Timestamp(lines[-1].split(b',', 1)[0].decode('utf-8'))
+
+
+class BarStoreUpdater(object):
+
+    """
+    Brings the bar store '<csv_dir>/<symbol>.csv' up to date.
+
+    For every symbol the date of the last stored bar is read from the
+    end of its file, only newer bars are requested from the source and
+    they are appended to a copy of the file which then replaces the
+    original with os.replace, so a reader sees either the old or the
+    new file, never a partial append. The symbols are updated in
+    parallel by a thread pool, and the lagged series memo and the model
+    cache entries of the updated symbols only are dropped.
+    """
+
+    def __init__(self, csv_dir, source, model_cache=None, max_workers=8):
+        """
+        :param csv_dir: (str) directory of the bar store.
+        :param source: (BarSource) provider of the new bars.
+        :param model_cache: (ModelCache) cache to invalidate, if any.
+        :param max_workers: (int) symbols updated concurrently.
+        """
+        self.csv_dir = csv_dir
+        self.source = source
+        self.model_cache = model_cache
+        self.max_workers = max_workers
+
+    def update_symbol(self, symbol):
+        """
+        Appends the new bars of one symbol.
+
+        :return: (int) number of bars appended.
+        """
+        path = os.path.join(self.csv_dir, '%s.csv' % symbol)
+        exists = os.path.exists(path)
+        since = last_timestamp(path) if exists else None
+
+        bars = self.source.fetch(symbol, since)
+        if since is not None:
+            bars = bars[bars.index > since]
+        if bars.empty:
+            return 0
+        bars = bars[COLUMNS]
+
+        intraday = (bars.index != bars.index.normalize()).any()
+        block = bars.to_csv(header=not exists, index_label='date',
+                            date_format=None if intraday else '%Y-%m-%d')
+
+        fd, tmp = tempfile.mkstemp(dir=self.csv_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                if exists:
+                    with open(path, 'r') as src:
+                        shutil.copyfileobj(src, f)
+                        src.seek(0, os.SEEK_END)
+                        if src.tell() > 0:
+                            src.seek(src.tell() - 1)
+                            if src.read(1) != '\n':
+                                f.write('\n')
+                f.write(block)
+                f.flush()
+                os.fsync(f.fileno())
+            if exists:
+                shutil.copymode(path, tmp)
+            else:
+                os.chmod(tmp, 0o644)
+            os.replace(tmp, path)
+        except Exception:
+            os.remove(tmp)
+            raise
+
+        clear_lagged_series_cache(symbol)
+        if self.model_cache is not None:
+            self.model_cache.invalidate(symbol)
+        logging.info("Appended %d bars to %s (%s to %s)", len(bars), symbol,
+                     bars.index[0], bars.index[-1])
+        return len(bars)
+
+    def update(self, symbol_list):
+        """
+        Updates all the symbols in parallel. A failure is logged and does
+        not stop the other symbols.
+
+        :return: (dict) symbol -> bars appended, None when it failed.
+        """
+        def _update(symbol):
+            try:
+                return symbol, self.update_symbol(symbol)
+            except Exception as e:
+                logging.error("Update of %s failed [%s]", symbol, e)
+                return symbol, None
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            appended = dict(pool.map(_update, symbol_list))
+        logging.info("Bar store updated: %d bars over %d symbols",
+                     sum(n for n in appended.values() if n),
+                     sum(1 for n in appended.values() if n))
+        return appended
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    ch = logging.StreamHandler(sys.stdout)
+    ch.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    root.addHandler(ch)
+
+    parser = argparse.ArgumentParser(description='Append new bars to the '
+                                                 'CSV bar store.')
+    parser.add_argument('csv_dir')
+    parser.add_argument('drop_dir')
+    parser.add_argument('symbols', nargs='+')
+    parser.add_argument('--workers', type=int, default=8)
+    args = parser.parse_args()
+
+    updater = BarStoreUpdater(args.csv_dir, FileDropSource(args.drop_dir),
+                              max_workers=args.workers)
+    updater.update(args.symbols)
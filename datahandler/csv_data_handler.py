@@ -176,10 +176,20 @@ class HistoricCSVDataHandler(DataHandler):
             if not bars_list:
                 raise KeyError('latest_symbol_data has not been initialized.')
             else:
-                logging.debug("Bar List")
-                logging.debug(bars_list)
+                logging.debug("Bar List %s", bars_list)
                 return np.array([getattr(b[1], val_type) for b in bars_list])
 
+    def get_all_bars_values(self, symbol, val_type):
+        """
+        Returns the values of every bar of the replay window, including
+        the bars not yet pushed. Meant for vectorised pre-computation
+        only, strategies must not use it to look ahead.
+        """
+        try:
+            return self.all_data_dic[symbol][val_type].values
+        except KeyError:
+            raise KeyError("Symbol is not available in the data set.")
+
     def update_bars(self):
         """
         Pushes the latest bar to the latest_symbol_data structure
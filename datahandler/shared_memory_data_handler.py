@@ -0,0 +1,256 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# datahandler.shared_memory_data_handler.py
+
+'''
+@summary: DataHandler reading the aligned bar arrays from shared memory.
+          A parent process loads the CSV files once and any number of
+          worker processes replay them without parsing or copying them.
+'''
+
+# General imports
+from collections import namedtuple
+import logging
+from multiprocessing import shared_memory
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+import numpy as np
+import pandas as pd
+
+from datahandler import DataHandler
+from datahandler.csv_data_handler import HistoricCSVDataHandler
+from events.events_impl import MarketEvent
+
+
+FIELDS = ('open', 'high', 'low', 'close', 'volume', 'adj_close')
+
+Bar = namedtuple('Bar', FIELDS)
+
+
+def _attach(name):
+    try:
+        # Python 3.13+: the creating process alone owns the segment
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+class SharedBarStore(object):
+
+    """
+    The bars of a symbol list, aligned exactly like
+    HistoricCSVDataHandler aligns them, held in two shared memory
+    blocks: a (symbols x bars x fields) float64 array and the bar
+    timestamps.
+
+    The parent creates the store and hands its picklable `spec` to the
+    workers, which attach() to the same memory. The creator must call
+    unlink() once the workers are done.
+    """
+
+    def __init__(self, spec, values_shm, index_shm, owner):
+        self.spec = spec
+        self._values_shm = values_shm
+        self._index_shm = index_shm
+        self.owner = owner
+
+        shape = tuple(spec['shape'])
+        self.values = np.ndarray(shape, dtype=np.float64,
+                                 buffer=values_shm.buf)
+        self.index = np.ndarray(shape[1], dtype=np.int64,
+                                buffer=index_shm.buf)
+        if not owner:
+            self.values.flags.writeable = False
+            self.index.flags.writeable = False
+
+    @classmethod
+    def create(cls, csv_dir, symbol_list, start_date):
+        """
+        Loads the CSV files once and copies the aligned bars into new
+        shared memory blocks.
+        """
+        csv_handler = HistoricCSVDataHandler(queue.Queue(), csv_dir,
+                                             symbol_list, start_date)
+        frames = [csv_handler.all_data_dic[s] for s in symbol_list]
+        n_bars = len(frames[0].index) if frames else 0
+        shape = (len(symbol_list), n_bars, len(FIELDS))
+
+        values_shm = shared_memory.SharedMemory(
+            create=True, size=max(int(np.prod(shape)) * 8, 1))
+        index_shm = shared_memory.SharedMemory(create=True,
+                                               size=max(n_bars * 8, 1))
+        spec = {'values': values_shm.name, 'index': index_shm.name,
+                'shape': shape, 'symbol_list': list(symbol_list),
+                'csv_dir': csv_dir, 'start_date': start_date}
+        store = cls(spec, values_shm, index_shm, owner=True)
+        for i, frame in enumerate(frames):
+            store.values[i] = frame[list(FIELDS)].values
+        if n_bars:
+            store.index[:] = frames[0].index.values.astype('datetime64[ns]') \
+                .astype(np.int64)
+        logging.info("Shared %d symbols x %d bars (%.1f MB)", shape[0],
+                     n_bars, store.values.nbytes / 1e6)
+        return store
+
+    @classmethod
+    def attach(cls, spec):
+        """
+        Maps the store created by another process, read-only.
+        """
+        return cls(spec, _attach(spec['values']), _attach(spec['index']),
+                   owner=False)
+
+    def close(self):
+        self.values = None
+        self.index = None
+        self._values_shm.close()
+        self._index_shm.close()
+
+    def unlink(self):
+        """
+        Closes and frees the shared memory, creator only.
+        """
+        self.close()
+        self._values_shm.unlink()
+        self._index_shm.unlink()
+
+
+class SharedMemoryDataHandler(DataHandler):
+
+    """
+    Replays a SharedBarStore with the same interface and semantics as
+    HistoricCSVDataHandler: one bar per symbol per update_bars(), a
+    MarketEvent every call and continue_backtest cleared once the bars
+    run out.
+
+    Values are read straight from the shared arrays; the
+    get_latest_bars_values arrays are read-only views, not copies.
+
+    Pass the spec of a store created by the parent as shared_spec (e.g.
+    Backtest(data_handler_params={'shared_spec': store.spec})). Without
+    one the handler loads and shares the CSV files itself.
+    """
+
+    def __init__(self, events, csv_dir, symbol_list, start_date,
+                 shared_spec=None):
+        """
+        :param events: The Event Queue
+        :param csv_dir: absolute directory path to the CSV files.
+        :param symbol_list: A list of symbol strings.
+        :param start_date: (date) the start datetime of the strategy.
+        :param shared_spec: (dict) SharedBarStore.spec to attach to.
+        """
+        self.events = events
+        self.csv_dir = csv_dir
+        self.symbol_list = symbol_list
+        self.start_date = start_date
+        self.continue_backtest = True
+
+        if shared_spec is None:
+            self.store = SharedBarStore.create(csv_dir, symbol_list,
+                                               start_date)
+        else:
+            if list(symbol_list) != shared_spec['symbol_list']:
+                raise ValueError("symbol_list does not match the shared "
+                                 "store.")
+            self.store = SharedBarStore.attach(shared_spec)
+
+        self._symbol_idx = dict((s, i) for i, s in enumerate(symbol_list))
+        self._field_idx = dict((f, i) for i, f in enumerate(FIELDS))
+        self._n_bars = self.store.values.shape[1]
+        self.bar_index = 0
+        self.closed = False
+
+    def _symbol(self, symbol):
+        try:
+            idx = self._symbol_idx[symbol]
+        except KeyError:
+            raise KeyError("Symbol is not available in the data set.")
+        if self.bar_index == 0:
+            raise KeyError('latest_symbol_data has not been initialized.')
+        return idx
+
+    def _bar(self, idx, pos):
+        return (pd.Timestamp(self.store.index[pos]),
+                Bar(*self.store.values[idx, pos]))
+
+    def get_latest_bar(self, symbol):
+        """
+        Returns the last bar as a (datetime, Bar) tuple.
+        """
+        idx = self._symbol(symbol)
+        return self._bar(idx, self.bar_index - 1)
+
+    def get_latest_bars(self, symbol, bars=1):
+        """
+        Returns the last N bars, or N-k if less available. Like
+        HistoricCSVDataHandler this holds up to 2*N bars.
+        """
+        idx = self._symbol(symbol)
+        start = max(self.bar_index - 2 * bars, 0)
+        return [self._bar(idx, pos) for pos in range(start, self.bar_index)]
+
+    def get_latest_bar_datetime(self, symbol):
+        """
+        Returns a Python datetime object for the last bar.
+        """
+        self._symbol(symbol)
+        return pd.Timestamp(self.store.index[self.bar_index - 1])
+
+    def get_latest_bar_value(self, symbol, val_type):
+        """
+        Returns one of the Open, High, Low, Close, Volume or OI
+        values of the last bar.
+        """
+        idx = self._symbol(symbol)
+        return self.store.values[idx, self.bar_index - 1,
+                                 self._field_idx[val_type]]
+
+    def get_latest_bars_values(self, symbol, val_type, bars=1):
+        """
+        Returns the last N bar values, or N-k if less available, with
+        the same window as get_latest_bars.
+        """
+        idx = self._symbol(symbol)
+        start = max(self.bar_index - 2 * bars, 0)
+        return self.store.values[idx, start:self.bar_index,
+                                 self._field_idx[val_type]]
+
+    def get_all_bars_values(self, symbol, val_type):
+        """
+        Returns the values of every bar of the replay window, including
+        the bars not yet pushed. Meant for vectorised pre-computation
+        only, strategies must not use it to look ahead.
+        """
+        try:
+            idx = self._symbol_idx[symbol]
+        except KeyError:
+            raise KeyError("Symbol is not available in the data set.")
+        return self.store.values[idx, :, self._field_idx[val_type]]
+
+    def update_bars(self):
+        """
+        Moves every symbol one bar forward.
+        """
+        if self.bar_index < self._n_bars:
+            self.bar_index += 1
+        else:
+            self.continue_backtest = False
+        self.events.put(MarketEvent())
+
+    def close(self):
+        """
+        Detaches from the shared memory, freeing it when this handler
+        created it. Backtest calls it once the run is over.
+        """
+        if self.closed:
+            return
+        if self.store.owner:
+            self.store.unlink()
+        else:
+            self.store.close()
+        self.closed = True
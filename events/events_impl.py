@@ -59,17 +59,20 @@ class OrderEvent(Event):
     quantity and a direction.
     """
 
-    def __init__(self, symbol, order_type, quantity, direction):
+    def __init__(self, symbol, order_type, quantity, direction, price=None):
         """
         Initialises the order type, setting whether it is
-        a Market order ('MKT') or Limit order ('LMT'), has
-        a quantity (integral) and its direction ('BUY' or
-        'SELL').
+        a Market order ('MKT'), Limit order ('LMT') or Stop
+        order ('STP'), has a quantity (integral) and its
+        direction ('BUY' or 'SELL').
 
         :param symbol: (str) The instrument to trade.
-        :param order_type: (str) 'MKT' or 'LMT' for Market or Limit.
+        :param order_type: (str) 'MKT', 'LMT' or 'STP' for Market, Limit
+                           or Stop.
         :param quantity: (Int) Non-negative integer for quantity.
         :param direction: (str) 'BUY' or 'SELL' for long or short.
+        :param price: (dbl) limit price of a 'LMT' order or trigger
+                      price of a 'STP' order.
 
         TODO: Must handle error checking here to obtain
         rational orders (i.e. no negative quantities etc).
@@ -79,16 +82,43 @@ class OrderEvent(Event):
         self.order_type = order_type
         self.quantity = quantity
         self.direction = direction
+        self.price = price
 
     def dump_order(self):
         """
         :return: print output for order
         """
-        logging.info("Order: Symbol:{}, Type:{}, Quantity:{}, Direction:{}"
+        logging.info("Order: Symbol:{}, Type:{}, Quantity:{}, Direction:{}, "
+                     "Price:{}"
               .format(self.symbol,
                       self.order_type,
                       self.quantity,
-                      self.direction))
+                      self.direction,
+                      self.price))
+
+
+class OrderBatchEvent(Event):
+
+    """
+    Handles the events of sending all Orders generated for one bar
+    to an execution system at once.
+    """
+
+    def __init__(self, orders):
+        """
+        Initialises the OrderBatchEvent.
+
+        :param orders: (list) OrderEvent objects to execute.
+        """
+        self.type = 'ORDER_BATCH'
+        self.orders = orders
+
+    def dump_orders(self):
+        """
+        :return: print output for every order of the batch
+        """
+        for order in self.orders:
+            order.dump_order()
 
 
 class FillEvent(Event):
@@ -120,7 +150,8 @@ class FillEvent(Event):
         :param exchange: The exchange where the order was filled
         :param quantity: The filled quantity.
         :param direction: The direction of fill ('BUY' or 'SELL')
-        :param fill_cost: The holdings value in dollars.
+        :param fill_cost: The holdings value in dollars (price x quantity),
+                          0 to value the fill at the latest adj_close.
         :param commission:  An optional commission sent from IB.
         """
         self.type = 'FILL'
@@ -134,4 +165,23 @@ class FillEvent(Event):
         # TODO: Update commission later
         # Calculate commission
         if commission is None:
-            self.commission = 0.0
\ No newline at end of file
+            self.commission = 0.0
+        else:
+            self.commission = commission
+
+
+class FillBatchEvent(Event):
+
+    """
+    Handles the events of receiving all the Fills of one bar at
+    once, so that the Portfolio can apply them in a single pass.
+    """
+
+    def __init__(self, fills):
+        """
+        Initialises the FillBatchEvent.
+
+        :param fills: (list) FillEvent objects.
+        """
+        self.type = 'FILL_BATCH'
+        self.fills = fills
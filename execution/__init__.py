@@ -29,4 +29,44 @@ class ExecutionHandler(object):
         Parameters:
         event - Contains an Event object with order information.
         """
-        raise NotImplementedError("Should implement execute_order()")
\ No newline at end of file
+        raise NotImplementedError("Should implement execute_order()")
+
+    def update_market(self, event):
+        """
+        Called on every Market event before the strategy, so that
+        handlers holding resting orders can match them against the
+        new bar. Does nothing by default.
+
+        Parameters:
+        event - The Market event.
+        """
+        pass
+
+    def end_of_bar(self):
+        """
+        Called once the events of a bar have been handled, so that
+        handlers batching orders can release their fills. Does nothing
+        by default.
+        """
+        pass
+
+    def end_of_run(self):
+        """
+        Called once the data has run out, before the performance is
+        output, so that handlers with orders still open can settle them,
+        putting their fills on the events queue, and release their
+        resources. Does nothing by default.
+        """
+        pass
+
+    def execute_orders(self, orders):
+        """
+        Executes a batch of Order events, e.g. the orders of an
+        OrderBatchEvent. Handlers that can fill a batch more cheaply
+        than order by order should override this.
+
+        Parameters:
+        orders - List of Order events.
+        """
+        for order in orders:
+            self.execute_order(order)
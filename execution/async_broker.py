@@ -0,0 +1,283 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# execution.async_broker.py
+
+'''
+@summary: asyncio based ExecutionHandler for socket brokers. Orders are
+          pipelined over one TCP connection as newline delimited JSON
+          and fills come back asynchronously onto the events queue, so
+          the strategy loop never waits for the round trip.
+'''
+
+# General imports
+import asyncio
+import datetime
+import itertools
+import json
+import logging
+import threading
+import time
+
+import numpy as np
+
+from events import events_impl
+from execution import ExecutionHandler
+
+
+def encode_message(msg):
+    """
+    :return: (bytes) one protocol line for a message dict.
+    """
+    return (json.dumps(msg, separators=(',', ':')) + '\n').encode('utf-8')
+
+
+def decode_message(line):
+    """
+    :return: (dict) the message carried by one protocol line.
+    """
+    return json.loads(line.decode('utf-8'))
+
+
+class LatencyHistogram(object):
+
+    """
+    Log-scaled histogram of latencies in seconds. Bucket i counts the
+    samples in [2**(i-1), 2**i) microseconds, so recording is O(1) and
+    the memory use is fixed whatever the number of orders.
+    """
+
+    def __init__(self, n_buckets=32):
+        self.counts = np.zeros(n_buckets, dtype=np.int64)
+        self.total = 0.0
+        self.max = 0.0
+        self.n = 0
+
+    def record(self, seconds):
+        micros = max(seconds * 1e6, 0.0)
+        bucket = min(int(micros).bit_length(), len(self.counts) - 1)
+        self.counts[bucket] += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.n += 1
+
+    def percentile(self, pct):
+        """
+        :return: (dbl) upper bound of the bucket holding the percentile.
+        """
+        if self.n == 0:
+            return 0.0
+        rank = np.searchsorted(np.cumsum(self.counts), pct / 100.0 * self.n)
+        return min(2.0 ** rank / 1e6, self.max)
+
+    def summary(self):
+        """
+        :return: (dict) count, mean, p50, p90, p99 and max latency.
+        """
+        return {'count': self.n,
+                'mean': self.total / self.n if self.n else 0.0,
+                'p50': self.percentile(50), 'p90': self.percentile(90),
+                'p99': self.percentile(99), 'max': self.max}
+
+    def dump(self):
+        """
+        Logs the histogram, one line per non-empty bucket.
+        """
+        logging.info("Order-to-fill latency: {}".format(
+            ', '.join('%s=%.6fs' % kv for kv in sorted(self.summary().items())
+                      if kv[0] != 'count')))
+        for i in np.flatnonzero(self.counts):
+            low = 0 if i == 0 else 2 ** (i - 1)
+            logging.info("  [%8dus, %8dus): %d", low, 2 ** i, self.counts[i])
+
+
+class AsyncBrokerExecutionHandler(ExecutionHandler):
+
+    """
+    Sends orders to a broker over a socket and receives the fills
+    asynchronously.
+
+    An asyncio loop runs in a background thread. execute_order() only
+    hands the encoded order to that loop, so any number of orders can be
+    in flight at once (pipelining) while the strategy loop carries on.
+    Fills are put on the events queue as they arrive and the
+    order-to-fill latency of each one goes into a LatencyHistogram.
+
+    Fills land on whatever bar is being processed when they arrive.
+    With settle_each_bar the handler waits for them at the end of every
+    bar instead, so each fill is booked on the bar of its order and the
+    results are reproducible; orders of a bar are still pipelined.
+
+    The wire protocol is newline delimited JSON, see
+    execution.simulated_broker for a local stand-in broker.
+    """
+
+    def __init__(self, events_queue, bars=None, host='127.0.0.1', port=9100,
+                 connect_timeout=5.0, settle_each_bar=False,
+                 fill_timeout=5.0):
+        """
+        Initializes the handler and connects to the broker.
+
+        :param events_queue: The queue of event objects.
+        :param bars: The DataHandler object, used to send a reference
+                     price with market orders when available.
+        :param host: (str) broker host.
+        :param port: (int) broker port.
+        :param connect_timeout: (dbl) seconds to wait for the connection.
+        :param settle_each_bar: (bool) wait for the fills of every bar
+                                before the next one.
+        :param fill_timeout: (dbl) seconds to wait for outstanding fills
+                             at the end of a bar or of the run.
+        """
+        self.events = events_queue
+        self.bars = bars
+        self.host = host
+        self.port = port
+        self.settle_each_bar = settle_each_bar
+        self.fill_timeout = fill_timeout
+        self.latency = LatencyHistogram()
+        self.closed = False
+
+        self._ids = itertools.count(1)
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._all_filled = threading.Event()
+        self._all_filled.set()
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever,
+                                        name='async-broker')
+        self._thread.daemon = True
+        self._thread.start()
+        future = asyncio.run_coroutine_threadsafe(self._connect(), self._loop)
+        future.result(connect_timeout)
+
+    async def _connect(self):
+        self._reader, self._writer = await asyncio.open_connection(
+            self.host, self.port)
+        self._reader_task = self._loop.create_task(self._read_loop())
+
+    async def _read_loop(self):
+        while True:
+            line = await self._reader.readline()
+            if not line:
+                logging.info("Broker closed the connection")
+                break
+            self._on_message(decode_message(line))
+
+    def _on_message(self, msg):
+        with self._lock:
+            sent = self._in_flight.pop(msg['id'], None)
+            if not self._in_flight:
+                self._all_filled.set()
+        if sent is None:
+            logging.error("Message for unknown order [%s]", msg)
+            return
+        self.latency.record(time.perf_counter() - sent)
+
+        if msg['type'] == 'fill':
+            fill_event = events_impl.FillEvent(
+                timeindex=datetime.datetime.strptime(
+                    msg['timestamp'], '%Y-%m-%dT%H:%M:%S.%f'),
+                symbol=msg['symbol'],
+                exchange=msg.get('exchange', 'BROKER'),
+                quantity=msg['quantity'],
+                direction=msg['direction'],
+                fill_cost=msg['price'] * msg['quantity'],
+                commission=msg.get('commission'))
+            self.events.put(fill_event)
+        else:
+            logging.error("Order [%s] rejected: %s", msg['id'],
+                          msg.get('reason'))
+
+    def _write(self, data):
+        self._writer.write(data)
+
+    def _order_message(self, event):
+        order_id = next(self._ids)
+        msg = {'type': 'order', 'id': order_id, 'symbol': event.symbol,
+               'order_type': event.order_type, 'quantity': event.quantity,
+               'direction': event.direction, 'price': event.price}
+        if self.bars is not None:
+            msg['ref_price'] = self.bars.get_latest_bar_value(
+                event.symbol, "adj_close")
+        return order_id, encode_message(msg)
+
+    def execute_order(self, event):
+        """
+        Sends an Order to the broker without waiting for the fill.
+
+        :param event: Contains an Event object with order information.
+        """
+        if event.type == 'ORDER':
+            self.execute_orders([event])
+
+    def execute_orders(self, orders):
+        """
+        Sends a batch of orders in one socket write, without waiting
+        for the fills.
+        """
+        lines = [self._order_message(event) for event in orders]
+        if not lines:
+            return
+
+        with self._lock:
+            now = time.perf_counter()
+            for order_id, _ in lines:
+                self._in_flight[order_id] = now
+            self._all_filled.clear()
+        self._loop.call_soon_threadsafe(
+            self._write, b''.join(line for _, line in lines))
+
+    @property
+    def in_flight(self):
+        """
+        (int) number of orders waiting for a fill or reject.
+        """
+        return len(self._in_flight)
+
+    def wait_for_fills(self, timeout=None):
+        """
+        Blocks until every order sent has been answered.
+
+        :return: (bool) False if the timeout expired first.
+        """
+        return self._all_filled.wait(timeout)
+
+    def _settle(self, timeout):
+        if not self.wait_for_fills(timeout):
+            logging.warning("%d orders still unanswered after %.1fs",
+                            self.in_flight, timeout)
+
+    def end_of_bar(self):
+        """
+        Waits for the fills of the bar when settle_each_bar is set.
+        """
+        if self.settle_each_bar and self._in_flight:
+            self._settle(self.fill_timeout)
+
+    def end_of_run(self):
+        """
+        Waits for the fills still in flight, which the Backtest then
+        books, closes the connection and logs the latency histogram.
+        """
+        self.close(self.fill_timeout)
+
+    def close(self, timeout=5.0):
+        """
+        Waits for the outstanding fills, then closes the connection and
+        stops the background loop. Does nothing once closed.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self._settle(timeout)
+
+        async def _close():
+            self._reader_task.cancel()
+            self._writer.close()
+
+        asyncio.run_coroutine_threadsafe(_close(), self._loop).result(timeout)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout)
+        self._loop.close()
+        self.latency.dump()
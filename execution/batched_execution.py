@@ -0,0 +1,91 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# execution.batched_execution.py
+
+'''
+@summary: ExecutionHandler that gathers the orders of a bar, nets the
+          opposing ones per symbol and fills the result as one batch.
+'''
+
+from events import events_impl
+from execution import ExecutionHandler
+from execution.costs import NoSlippage, ZeroCommission
+
+
+class BatchedExecutionHandler(ExecutionHandler):
+
+    """
+    Bar-end order batching.
+
+    Orders are only accumulated while a bar is processed. When the bar
+    is settled (end_of_bar) the signed quantities are netted per symbol
+    and each symbol with a non-zero net quantity gets one fill at the
+    adjusted close. All fills of the bar travel in a single
+    FillBatchEvent, which the Portfolio applies in one pass.
+
+    Like SimulatedExecutionHandler it has no latency or fill-ratio
+    issues; slippage and commission models can be added (see
+    execution.costs) and are charged on the netted quantity only.
+    """
+
+    def __init__(self, events_queue, bars, slippage=None, commission=None,
+                 exchange='NSE'):
+        """
+        Initializes the handler, setting the event queues
+        up internally.
+
+        :param events_queue: The queue of event objects.
+        :param bars: The DataHandler object with current market data.
+        :param slippage: slippage model, see execution.costs.
+        :param commission: commission model, see execution.costs.
+        :param exchange: (str) exchange reported on the fills.
+        """
+        self.events = events_queue
+        self.bars = bars
+        self.slippage = slippage or NoSlippage()
+        self.commission = commission or ZeroCommission()
+        self.exchange = exchange
+        self.pending = {}
+        self.orders_received = 0
+        self.fills_sent = 0
+
+    def execute_order(self, event):
+        """
+        Adds an Order to the net quantity of its symbol for this bar.
+
+        :param event: Contains an Event object with order information.
+        """
+        if event.type == 'ORDER':
+            sign = 1 if event.direction == 'BUY' else -1
+            self.pending[event.symbol] = \
+                self.pending.get(event.symbol, 0) + sign * event.quantity
+            self.orders_received += 1
+
+    def end_of_bar(self):
+        """
+        Fills the net quantity of every symbol ordered during the bar
+        and puts them on the queue as one FillBatchEvent.
+        """
+        if not self.pending:
+            return
+        fills = []
+        for symbol, net in self.pending.items():
+            if net == 0:
+                continue
+            direction = 'BUY' if net > 0 else 'SELL'
+            quantity = abs(net)
+            price = self.slippage.apply(
+                self.bars.get_latest_bar_value(symbol, "adj_close"),
+                direction, quantity)
+            fills.append(events_impl.FillEvent(
+                timeindex=self.bars.get_latest_bar_datetime(symbol),
+                symbol=symbol,
+                exchange=self.exchange,
+                quantity=quantity,
+                direction=direction,
+                fill_cost=price * quantity,
+                commission=self.commission.calculate(price, quantity)))
+        self.pending = {}
+        if fills:
+            self.fills_sent += len(fills)
+            self.events.put(events_impl.FillBatchEvent(fills))
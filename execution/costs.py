@@ -0,0 +1,92 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# execution.costs.py
+
+'''
+@summary: Slippage and commission models used by the simulated
+          execution handlers.
+'''
+
+
+class NoSlippage(object):
+
+    """
+    Fills at the quoted price.
+    """
+
+    def apply(self, price, direction, quantity):
+        return price
+
+
+class FixedBpsSlippage(object):
+
+    """
+    Moves the fill price against the order by a fixed number of
+    basis points.
+    """
+
+    def __init__(self, bps=5.0):
+        """
+        :param bps: (dbl) adverse price move in basis points.
+        """
+        self.bps = bps
+
+    def apply(self, price, direction, quantity):
+        """
+        :param price: (dbl) quoted price.
+        :param direction: (str) 'BUY' or 'SELL'.
+        :param quantity: (int) filled quantity.
+        :return: (dbl) the price actually paid or received.
+        """
+        move = price * self.bps / 10000.0
+        return price + move if direction == 'BUY' else price - move
+
+
+class ZeroCommission(object):
+
+    """
+    Trades for free, as the idealised SimulatedExecutionHandler does.
+    """
+
+    def calculate(self, price, quantity):
+        return 0.0
+
+
+class FixedRateCommission(object):
+
+    """
+    Commission as a fraction of the traded value.
+    """
+
+    def __init__(self, rate=0.0005, minimum=0.0):
+        """
+        :param rate: (dbl) fraction of the traded value, e.g. 0.0005.
+        :param minimum: (dbl) minimum commission per fill.
+        """
+        self.rate = rate
+        self.minimum = minimum
+
+    def calculate(self, price, quantity):
+        return max(self.minimum, self.rate * price * quantity)
+
+
+class PerShareCommission(object):
+
+    """
+    Interactive Brokers style commission: a fee per share with a
+    minimum per order, capped at a percentage of the trade value.
+    """
+
+    def __init__(self, per_share=0.005, minimum=1.0, max_pct=0.01):
+        """
+        :param per_share: (dbl) fee per share.
+        :param minimum: (dbl) minimum fee per fill.
+        :param max_pct: (dbl) cap as a fraction of the traded value.
+        """
+        self.per_share = per_share
+        self.minimum = minimum
+        self.max_pct = max_pct
+
+    def calculate(self, price, quantity):
+        fee = max(self.minimum, self.per_share * quantity)
+        return min(fee, self.max_pct * price * quantity)
@@ -0,0 +1,213 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# execution.limit_order_book.py
+
+'''
+@summary: ExecutionHandler that keeps resting limit and stop orders in
+          price-indexed heaps per symbol and matches them against the
+          high and low of every new bar.
+'''
+
+# General imports
+import heapq
+import itertools
+import logging
+
+from events import events_impl
+from execution import ExecutionHandler
+from execution.costs import NoSlippage, ZeroCommission
+
+
+class SymbolOrderBook(object):
+
+    """
+    Resting orders of one symbol. Each side is a heap keyed so that the
+    order closest to being triggered is on top:
+
+    - buy limits, highest price first, fill when the low reaches them.
+    - sell limits, lowest price first, fill when the high reaches them.
+    - buy stops, lowest price first, trigger when the high reaches them.
+    - sell stops, highest price first, trigger when the low reaches them.
+
+    A bar therefore only touches the orders it triggers, O(k log n).
+    Cancelled orders are dropped lazily when they reach the top.
+    """
+
+    def __init__(self):
+        self.buy_limits = []
+        self.sell_limits = []
+        self.buy_stops = []
+        self.sell_stops = []
+        self.cancelled = set()
+        self.size = 0
+
+    def add(self, order, seq):
+        """
+        Adds a resting order, seq gives time priority at equal prices.
+        """
+        if order.order_type == 'LMT':
+            if order.direction == 'BUY':
+                heapq.heappush(self.buy_limits, (-order.price, seq, order))
+            else:
+                heapq.heappush(self.sell_limits, (order.price, seq, order))
+        else:
+            if order.direction == 'BUY':
+                heapq.heappush(self.buy_stops, (order.price, seq, order))
+            else:
+                heapq.heappush(self.sell_stops, (-order.price, seq, order))
+        self.size += 1
+
+    def cancel(self, seq):
+        self.cancelled.add(seq)
+        self.size -= 1
+
+    def _pop_while(self, heap, triggered):
+        out = []
+        while heap and triggered(heap[0][0]):
+            _, seq, order = heapq.heappop(heap)
+            if seq in self.cancelled:
+                self.cancelled.discard(seq)
+                continue
+            self.size -= 1
+            out.append(order)
+        return out
+
+    def match(self, open_, high, low):
+        """
+        Removes and returns the orders triggered by a bar as
+        (order, reference price) pairs. Orders gapped through at the
+        open are filled at the open.
+        """
+        matched = []
+        for o in self._pop_while(self.buy_limits, lambda k: -k >= low):
+            matched.append((o, min(o.price, open_)))
+        for o in self._pop_while(self.sell_limits, lambda k: k <= high):
+            matched.append((o, max(o.price, open_)))
+        for o in self._pop_while(self.buy_stops, lambda k: k <= high):
+            matched.append((o, max(o.price, open_)))
+        for o in self._pop_while(self.sell_stops, lambda k: -k >= low):
+            matched.append((o, min(o.price, open_)))
+        return matched
+
+
+class LimitOrderBookExecutionHandler(ExecutionHandler):
+
+    """
+    Simulated execution with resting orders.
+
+    Market orders fill on the current bar at the adjusted close. Limit
+    ('LMT') and stop ('STP') orders rest in a SymbolOrderBook and are
+    matched against the high and low of every following bar. Limit
+    orders fill at their price (or better on a gap), stops fill as
+    market orders once triggered. Slippage applies to market and stop
+    fills, commission to every fill.
+
+    Bar prices are scaled by adj_close / close so that fills are on the
+    same basis as the Portfolio valuation.
+    """
+
+    def __init__(self, events_queue, bars, slippage=None, commission=None,
+                 exchange='SIM'):
+        """
+        Initializes the handler, setting the event queues
+        up internally.
+
+        :param events_queue: The queue of event objects.
+        :param bars: The DataHandler object with current market data.
+        :param slippage: slippage model, see execution.costs.
+        :param commission: commission model, see execution.costs.
+        :param exchange: (str) exchange reported on the fills.
+        """
+        self.events = events_queue
+        self.bars = bars
+        self.slippage = slippage or NoSlippage()
+        self.commission = commission or ZeroCommission()
+        self.exchange = exchange
+        self.books = {}
+        self._seq = itertools.count()
+        self._resting = {}
+
+    def open_orders(self, symbol=None):
+        """
+        :return: (int) number of resting orders, for one or all symbols.
+        """
+        if symbol is not None:
+            return self.books[symbol].size if symbol in self.books else 0
+        return sum(b.size for b in self.books.values())
+
+    def cancel_order(self, order):
+        """
+        Cancels a resting order.
+
+        :return: (bool) True if the order was still resting.
+        """
+        key = id(order)
+        if key not in self._resting:
+            return False
+        symbol, seq = self._resting.pop(key)
+        self.books[symbol].cancel(seq)
+        return True
+
+    def _bar_prices(self, symbol):
+        bar = self.bars.get_latest_bar(symbol)[1]
+        close = getattr(bar, 'close')
+        factor = getattr(bar, 'adj_close') / close if close else 1.0
+        return (getattr(bar, 'open') * factor, getattr(bar, 'high') * factor,
+                getattr(bar, 'low') * factor, getattr(bar, 'adj_close'))
+
+    def _fill(self, order, price, slipped=True):
+        if slipped:
+            price = self.slippage.apply(price, order.direction, order.quantity)
+        fill_event = events_impl.FillEvent(
+            timeindex=self.bars.get_latest_bar_datetime(order.symbol),
+            symbol=order.symbol,
+            exchange=self.exchange,
+            quantity=order.quantity,
+            direction=order.direction,
+            fill_cost=price * order.quantity,
+            commission=self.commission.calculate(price, order.quantity))
+        self.events.put(fill_event)
+
+    def execute_order(self, event):
+        """
+        Fills market orders on the current bar and rests limit and stop
+        orders in the book of their symbol.
+
+        :param event: Contains an Event object with order information.
+        """
+        if event.type != 'ORDER':
+            return
+        if event.quantity <= 0:
+            logging.error("Rejected order with quantity [%s]", event.quantity)
+            return
+
+        if event.order_type == 'MKT':
+            price = self._bar_prices(event.symbol)[3]
+            if price == price:
+                self._fill(event, price)
+            else:
+                logging.error("No price for %s, order rejected", event.symbol)
+        elif event.order_type in ('LMT', 'STP') and event.price is not None:
+            seq = next(self._seq)
+            book = self.books.setdefault(event.symbol, SymbolOrderBook())
+            book.add(event, seq)
+            self._resting[id(event)] = (event.symbol, seq)
+        else:
+            logging.error("Rejected %s order without a usable price",
+                          event.order_type)
+
+    def update_market(self, event):
+        """
+        Matches the resting orders of every symbol against the new bar.
+        """
+        for symbol, book in self.books.items():
+            if book.size == 0:
+                continue
+            open_, high, low, _ = self._bar_prices(symbol)
+            if not (high == high and low == low):
+                continue
+            if open_ != open_:
+                open_ = (high + low) / 2.0
+            for order, price in book.match(open_, high, low):
+                self._resting.pop(id(order), None)
+                self._fill(order, price, slipped=order.order_type == 'STP')
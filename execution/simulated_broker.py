@@ -0,0 +1,176 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# execution.simulated_broker.py
+
+'''
+@summary: Local stand-in broker speaking the newline delimited JSON
+          protocol of AsyncBrokerExecutionHandler. Every order is
+          answered with a fill (or a reject) after a configurable
+          latency, so the asynchronous execution path can be exercised
+          without a brokerage account.
+'''
+
+# General imports
+import argparse
+import asyncio
+import datetime
+import logging
+import random
+import sys
+import threading
+
+from execution.async_broker import encode_message, decode_message
+from execution.costs import ZeroCommission
+
+
+class SimulatedBroker(object):
+
+    """
+    asyncio TCP server filling orders after `latency` (+/- `jitter`)
+    seconds. Orders of one connection are answered concurrently, so a
+    pipelining client gets fills as soon as each one is due rather than
+    one round trip at a time.
+
+    Market orders fill at the 'ref_price' sent by the client, limit and
+    stop orders at their own price. Orders with neither are rejected.
+    """
+
+    def __init__(self, host='127.0.0.1', port=9100, latency=0.001,
+                 jitter=0.0, commission=None, exchange='SIMBROKER',
+                 seed=None):
+        """
+        :param host: (str) interface to listen on.
+        :param port: (int) port to listen on, 0 picks a free port.
+        :param latency: (dbl) seconds between an order and its fill.
+        :param jitter: (dbl) uniform random latency added on top.
+        :param commission: commission model, see execution.costs.
+        :param exchange: (str) exchange reported on the fills.
+        :param seed: (int) seed of the jitter.
+        """
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.commission = commission or ZeroCommission()
+        self.exchange = exchange
+        self.orders = 0
+        self._random = random.Random(seed)
+        self._server = None
+
+    async def start(self):
+        """
+        Starts listening, self.port is updated with the bound port.
+        """
+        self._server = await asyncio.start_server(
+            self._handle_client, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logging.info("Simulated broker listening on %s:%d",
+                     self.host, self.port)
+
+    async def serve_forever(self):
+        await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    def _answer(self, order):
+        price = order.get('price')
+        if order['order_type'] == 'MKT' or price is None:
+            price = order.get('ref_price')
+        if price is None or order['quantity'] <= 0:
+            return {'type': 'reject', 'id': order['id'],
+                    'reason': 'no price or invalid quantity'}
+        return {'type': 'fill', 'id': order['id'], 'symbol': order['symbol'],
+                'quantity': order['quantity'],
+                'direction': order['direction'], 'price': price,
+                'commission': self.commission.calculate(price,
+                                                        order['quantity']),
+                'exchange': self.exchange,
+                'timestamp': datetime.datetime.utcnow().strftime(
+                    '%Y-%m-%dT%H:%M:%S.%f')}
+
+    @staticmethod
+    async def _send(writer, lock, reply, delay=0.0):
+        if delay > 0:
+            await asyncio.sleep(delay)
+        try:
+            # One writer at a time, so that every drain covers its write
+            async with lock:
+                writer.write(reply)
+                await writer.drain()
+        except ConnectionError:
+            pass
+
+    async def _handle_client(self, reader, writer):
+        lock = asyncio.Lock()
+        pending = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                order = decode_message(line)
+                self.orders += 1
+                delay = self.latency + self._random.uniform(0.0, self.jitter)
+                reply = encode_message(self._answer(order))
+                if delay > 0:
+                    task = asyncio.ensure_future(
+                        self._send(writer, lock, reply, delay))
+                    pending.add(task)
+                    task.add_done_callback(pending.discard)
+                else:
+                    await self._send(writer, lock, reply)
+        except ConnectionError:
+            pass
+        finally:
+            # The client is gone, drop the replies not sent yet
+            for task in list(pending):
+                task.cancel()
+            writer.close()
+
+    def start_in_thread(self):
+        """
+        Runs the broker on its own event loop in a daemon thread, e.g.
+        next to a backtest in the same process.
+
+        :return: (int) the bound port.
+        """
+        started = threading.Event()
+        self._loop = asyncio.new_event_loop()
+
+        def _run():
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(self.start())
+            started.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=_run, name='simulated-broker')
+        self._thread.daemon = True
+        self._thread.start()
+        started.wait()
+        return self.port
+
+    def stop(self):
+        """
+        Stops a broker started with start_in_thread().
+        """
+        self._loop.call_soon_threadsafe(self._server.close)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+
+if __name__ == "__main__":
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    ch = logging.StreamHandler(sys.stdout)
+    ch.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    root.addHandler(ch)
+
+    parser = argparse.ArgumentParser(description='Simulated broker server.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9100)
+    parser.add_argument('--latency', type=float, default=0.001)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    args = parser.parse_args()
+
+    broker = SimulatedBroker(args.host, args.port, args.latency, args.jitter)
+    asyncio.run(broker.serve_forever())
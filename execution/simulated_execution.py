@@ -30,14 +30,17 @@ class SimulatedExecutionHandler(ExecutionHandler):
     handler.
     """
 
-    def __init__(self, events_queue):
+    def __init__(self, events_queue, bars=None):
         """
         Initializes the handler, setting the event queues
         up internally.
 
         :param events: The queue of event objects.
+        :param bars: The DataHandler object, used to time stamp the
+                     fills with the bar they happen on.
         """
         self.events = events_queue
+        self.bars = bars
 
     def execute_order(self, event):
         """
@@ -47,7 +50,11 @@ class SimulatedExecutionHandler(ExecutionHandler):
         :param event: Contains an Event object with order information.
         """
         if event.type == 'ORDER':
-            fill_event = events_impl.FillEvent(timeindex=datetime.datetime.utcnow(),
+            if self.bars is not None:
+                timeindex = self.bars.get_latest_bar_datetime(event.symbol)
+            else:
+                timeindex = datetime.datetime.utcnow()
+            fill_event = events_impl.FillEvent(timeindex=timeindex,
                                                symbol=event.symbol,
                                                exchange='NSE',
                                                quantity=event.quantity,
@@ -56,4 +56,142 @@ def create_drawdowns(pnl):
         duration[each_row] = (
             0 if drawdown[each_row] == 0 else duration[each_row - 1] + 1)
 
-    return drawdown, drawdown.max(), duration.max()
\ No newline at end of file
+    return drawdown, drawdown.max(), duration.max()
+
+# ==========================
+# BATCHED (RUNS x BARS) STATS
+# ==========================
+
+def _as_equity_matrix(equity):
+    """
+    Converts equity curves into a float (runs x bars) matrix,
+    normalised so that every run starts at 1.0, matching the
+    'equity_curve' column built by the Portfolio.
+
+    :param equity: 2-D array-like (or 1-D for a single run) of equity values.
+    :return: (ndarray) normalised equity matrix.
+    """
+    equity = np.asarray(equity, dtype=np.float64)
+    if equity.ndim == 1:
+        equity = equity[np.newaxis, :]
+    if equity.ndim != 2:
+        raise ValueError("Equity curves must be a (runs x bars) matrix.")
+    if equity.shape[1] < 2:
+        raise ValueError("Equity curves need at least two bars.")
+    return equity / equity[:, :1]
+
+
+def create_returns_matrix(equity):
+    """
+    Creates the period percentage returns of every run in one pass.
+
+    :param equity: A (runs x bars) matrix of equity values.
+    :return: (ndarray) a (runs x bars-1) matrix of period returns.
+    """
+    equity = _as_equity_matrix(equity)
+    return equity[:, 1:] / equity[:, :-1] - 1.0
+
+
+def create_sharpe_ratios(returns, periods=252):
+    """
+    Vectorised version of create_sharpe_ratio, one value per run.
+
+    :param returns: A (runs x bars) matrix of period percentage returns.
+    :param periods: Daily (252), Hourly (252*6.5), Minutely(252*6.5*60) etc.
+
+    :return (ndarray) sharpe ratio of each run, NaN for flat runs.
+    """
+    returns = np.asarray(returns, dtype=np.float64)
+    std = returns.std(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sharpe = np.sqrt(periods) * returns.mean(axis=1) / std
+    sharpe[std == 0] = np.nan
+    return sharpe
+
+
+def create_total_returns(equity):
+    """
+    Total return of every run, last bar over first bar.
+
+    :param equity: A (runs x bars) matrix of equity values.
+    :return: (ndarray) total return of each run.
+    """
+    equity = _as_equity_matrix(equity)
+    return equity[:, -1] - 1.0
+
+
+def create_annualized_returns(equity, periods=365):
+    """
+    Annualised return of every run, compounded over the number of
+    bars in the same way as Portfolio.output_summary_stats.
+
+    :param equity: A (runs x bars) matrix of equity values.
+    :param periods: number of bars in one year.
+    :return: (ndarray) annualised return of each run.
+    """
+    equity = _as_equity_matrix(equity)
+    return equity[:, -1] ** (float(periods) / equity.shape[1]) - 1.0
+
+
+def create_drawdowns_matrix(equity):
+    """
+    Vectorised version of create_drawdowns. Calculates the largest
+    peak-to-trough drawdown of every run and the longest number of
+    bars spent below a previous high water mark.
+
+    :param equity: A (runs x bars) matrix of equity values.
+    :return: max_drawdown, duration - (ndarray) one value per run.
+    """
+    equity = _as_equity_matrix(equity)
+    hwm = np.maximum.accumulate(equity, axis=1)
+    drawdown = hwm - equity
+
+    # The duration at each bar is the distance to the last bar that
+    # sat on the high water mark.
+    bar_idx = np.arange(equity.shape[1])
+    last_peak = np.where(drawdown == 0, bar_idx, 0)
+    np.maximum.accumulate(last_peak, axis=1, out=last_peak)
+    duration = (bar_idx - last_peak).max(axis=1)
+
+    return drawdown.max(axis=1), duration
+
+
+def create_batch_summary_stats(equity, periods=252):
+    """
+    Creates the summary statistics produced by
+    Portfolio.output_summary_stats for many equity curves at once,
+    e.g. after a parameter sweep.
+
+    :param equity: A (runs x bars) matrix of equity values.
+    :param periods: periods used to annualise the Sharpe ratio.
+    :return: (dict) statistic name -> ndarray with one value per run.
+    """
+    equity = _as_equity_matrix(equity)
+    returns = equity[:, 1:] / equity[:, :-1] - 1.0
+    max_dd, dd_duration = create_drawdowns_matrix(equity)
+
+    stats = dict()
+    stats['Total Return'] = equity[:, -1] - 1.0
+    stats['Annualized Return'] = create_annualized_returns(equity)
+    stats['Length of Series'] = np.full(equity.shape[0], equity.shape[1])
+    stats['Sharpe Ratio'] = create_sharpe_ratios(returns, periods=periods)
+    stats['Max Drawdown'] = max_dd
+    stats['Drawdown Duration'] = dd_duration
+    return stats
+
+
+def rank_runs(stats, key='Sharpe Ratio', ascending=False):
+    """
+    Returns the run indices ordered by one of the batched statistics,
+    NaN values last.
+
+    :param stats: (dict) output of create_batch_summary_stats.
+    :param key: (str) statistic to rank by.
+    :param ascending: (bool) rank from lowest to highest.
+    :return: (ndarray) run indices, best first.
+    """
+    values = np.asarray(stats[key], dtype=np.float64)
+    if not ascending:
+        values = -values
+    return np.argsort(np.where(np.isnan(values), np.inf, values),
+                      kind='stable')
@@ -0,0 +1,284 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# performance.resampling.py
+
+'''
+@summary: Bootstrap and Monte Carlo robustness analysis of a finished
+          backtest. Synthetic equity paths are generated in batches,
+          summarised with the batched performance functions and only the
+          per-path statistics are kept, so memory stays bounded by the
+          batch size rather than the number of paths.
+'''
+
+# General imports
+from concurrent.futures import ProcessPoolExecutor
+import logging
+
+import numpy as np
+import pandas as pd
+
+# local imports
+from performance.performance import create_batch_summary_stats
+
+
+METHODS = ('block_bootstrap', 'trade_shuffle', 'entry_delay')
+
+# Per-process copy of the backtest returns, set once by the pool initializer
+# so that tasks only carry a seed and a batch size.
+_worker_state = {}
+
+
+def _init_worker(returns, in_market, periods):
+    _worker_state['returns'] = returns
+    _worker_state['trades'] = _find_trades(in_market)
+    _worker_state['periods'] = periods
+
+
+def _find_trades(in_market):
+    """
+    Splits the in-market bar mask into contiguous trades.
+
+    :param in_market: (ndarray) bool mask, True while a position is held.
+    :return: starts, lengths - (ndarray) first bar and length of each trade.
+    """
+    in_market = np.asarray(in_market, dtype=bool).astype(np.int8)
+    edges = np.diff(np.concatenate(([0], in_market, [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    return starts, ends - starts
+
+
+def block_bootstrap_paths(returns, rng, n_paths, block_size=20):
+    """
+    Circular block bootstrap of the period returns, which keeps the
+    short-term autocorrelation inside each block.
+
+    :param returns: (ndarray) period returns of the backtest.
+    :param rng: numpy Generator.
+    :param n_paths: number of synthetic paths.
+    :param block_size: number of consecutive bars per block.
+    :return: (ndarray) a (n_paths x bars) matrix of returns.
+    """
+    n_bars = len(returns)
+    block_size = max(1, min(block_size, n_bars))
+    n_blocks = -(-n_bars // block_size)
+    starts = rng.integers(0, n_bars, size=(n_paths, n_blocks))
+    idx = (starts[:, :, np.newaxis] + np.arange(block_size)) % n_bars
+    return returns[idx.reshape(n_paths, -1)[:, :n_bars]]
+
+
+def trade_shuffle_paths(returns, trades, rng, n_paths):
+    """
+    Replays the trades of the backtest in a random order. The bars of
+    each trade stay together and the flat periods between trades keep
+    their place, so total return is unchanged while drawdowns vary.
+
+    :param returns: (ndarray) period returns of the backtest.
+    :param trades: (tuple) starts and lengths from _find_trades.
+    :param rng: numpy Generator.
+    :param n_paths: number of synthetic paths.
+    :return: (ndarray) a (n_paths x bars) matrix of returns.
+    """
+    starts, lengths = trades
+    n_bars, n_trades = len(returns), len(starts)
+    if n_trades == 0:
+        return np.repeat(returns[np.newaxis, :], n_paths, axis=0)
+
+    # Segments alternate flat gap, trade, flat gap, ..., flat gap
+    ends = starts + lengths
+    seg_start = np.empty(2 * n_trades + 1, dtype=np.int64)
+    seg_start[0::2] = np.concatenate(([0], ends))
+    seg_start[1::2] = starts
+    seg_len = np.empty_like(seg_start)
+    seg_len[0::2] = np.concatenate((starts, [n_bars])) - seg_start[0::2]
+    seg_len[1::2] = lengths
+
+    order = np.empty((n_paths, 2 * n_trades + 1), dtype=np.int64)
+    order[:, 0::2] = np.arange(0, 2 * n_trades + 1, 2)
+    order[:, 1::2] = 2 * np.argsort(rng.random((n_paths, n_trades)),
+                                    axis=1) + 1
+
+    perm_lengths = seg_len[order]
+    offsets = np.cumsum(perm_lengths, axis=1) - perm_lengths
+    shift = np.repeat((seg_start[order] - offsets).ravel(),
+                      perm_lengths.ravel())
+    idx = shift.reshape(n_paths, n_bars) + np.arange(n_bars)
+    return returns[idx]
+
+
+def entry_delay_paths(returns, trades, rng, n_paths, max_delay=5):
+    """
+    Delays the entry of every trade by a random number of bars, i.e.
+    the first bars of each trade earn nothing.
+
+    :param returns: (ndarray) period returns of the backtest.
+    :param trades: (tuple) starts and lengths from _find_trades.
+    :param rng: numpy Generator.
+    :param n_paths: number of synthetic paths.
+    :param max_delay: largest entry delay in bars.
+    :return: (ndarray) a (n_paths x bars) matrix of returns.
+    """
+    starts, lengths = trades
+    paths = np.repeat(returns[np.newaxis, :], n_paths, axis=0)
+    if len(starts) == 0:
+        return paths
+
+    # Trade id and bar offset inside the trade for every traded bar
+    trade_id = np.repeat(np.arange(len(starts)), lengths)
+    bar = np.repeat(starts, lengths) + \
+        (np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths,
+                                              lengths))
+    offset = bar - starts[trade_id]
+
+    delays = rng.integers(0, max_delay + 1, size=(n_paths, len(starts)))
+    paths[:, bar] *= offset >= delays[:, trade_id]
+    return paths
+
+
+def _simulate_batch(task):
+    """
+    Generates one batch of synthetic return paths in a worker and
+    reduces it to the summary statistics of each path.
+    """
+    method, seed, n_paths, options = task
+    returns = _worker_state['returns']
+    trades = _worker_state['trades']
+    rng = np.random.default_rng(seed)
+
+    if method == 'block_bootstrap':
+        paths = block_bootstrap_paths(returns, rng, n_paths, **options)
+    elif method == 'trade_shuffle':
+        paths = trade_shuffle_paths(returns, trades, rng, n_paths)
+    else:
+        paths = entry_delay_paths(returns, trades, rng, n_paths, **options)
+
+    equity = np.ones((n_paths, len(returns) + 1))
+    np.cumprod(1.0 + paths, axis=1, out=equity[:, 1:])
+    return create_batch_summary_stats(equity,
+                                      periods=_worker_state['periods'])
+
+
+class MonteCarloAnalysis(object):
+
+    """
+    Resamples the returns of a finished backtest into many synthetic
+    equity paths and collects the distribution of the summary
+    statistics reported by Portfolio.output_summary_stats.
+
+    Paths are generated in batches, each batch vectorised and the
+    batches spread across a process pool. Only the per-path statistics
+    are sent back, so memory is bounded by batch_size x bars.
+    """
+
+    def __init__(self, returns, in_market=None, periods=252):
+        """
+        :param returns: (array-like) period percentage returns of the run.
+        :param in_market: (array-like) bool mask of the bars a position
+                          was held, used for the trade based methods.
+        :param periods: periods used to annualise the Sharpe ratio.
+        """
+        self.returns = np.nan_to_num(np.asarray(returns, dtype=np.float64))
+        if in_market is None:
+            in_market = self.returns != 0
+        self.in_market = np.asarray(in_market, dtype=bool)
+        if len(self.in_market) != len(self.returns):
+            raise ValueError("in_market must have one value per return.")
+        self.periods = periods
+
+    @classmethod
+    def from_portfolio(cls, portfolio, periods=252):
+        """
+        Builds the analysis from a Portfolio whose equity curve has been
+        created. A bar counts as in the market when any position recorded
+        for it is non-zero.
+        """
+        returns = portfolio.equity_curve['returns'].fillna(0.0).values
+        positions = pd.DataFrame(portfolio.all_positions)
+        in_market = (positions[portfolio.symbol_list] != 0).any(axis=1).values
+        return cls(returns, in_market[-len(returns):], periods=periods)
+
+    def run(self, method='block_bootstrap', n_paths=10000, batch_size=1000,
+            n_jobs=None, seed=None, **options):
+        """
+        Generates n_paths synthetic paths and returns their statistics.
+
+        :param method: (str) 'block_bootstrap', 'trade_shuffle' or
+                       'entry_delay'.
+        :param n_paths: (int) number of synthetic paths.
+        :param batch_size: (int) paths generated per vectorised batch.
+        :param n_jobs: (int) worker processes, None for one per CPU and 1
+                       to run in this process.
+        :param seed: (int) seed for reproducible results.
+        :param options: block_size for the bootstrap, max_delay for the
+                        entry delay.
+        :return: (MonteCarloResult) statistics of every path.
+        """
+        if method not in METHODS:
+            raise ValueError("Unknown resampling method [%s]" % method)
+        if n_paths < 1:
+            raise ValueError("n_paths must be at least 1, got %s" % n_paths)
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1, got %s"
+                             % batch_size)
+
+        sizes = [batch_size] * (n_paths // batch_size)
+        if n_paths % batch_size:
+            sizes.append(n_paths % batch_size)
+        seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+        tasks = [(method, s, n, options) for s, n in zip(seeds, sizes)]
+
+        init_args = (self.returns, self.in_market, self.periods)
+        logging.info("Resampling %d paths with [%s] in %d batches",
+                     n_paths, method, len(tasks))
+        if n_jobs == 1:
+            _init_worker(*init_args)
+            batches = [_simulate_batch(t) for t in tasks]
+        else:
+            with ProcessPoolExecutor(max_workers=n_jobs,
+                                     initializer=_init_worker,
+                                     initargs=init_args) as pool:
+                batches = list(pool.map(_simulate_batch, tasks))
+
+        stats = dict((k, np.concatenate([b[k] for b in batches]))
+                     for k in batches[0])
+        observed = self._observed_stats()
+        return MonteCarloResult(method, stats, observed)
+
+    def _observed_stats(self):
+        equity = np.concatenate(([1.0], np.cumprod(1.0 + self.returns)))
+        stats = create_batch_summary_stats(equity, periods=self.periods)
+        return dict((k, v[0]) for k, v in stats.items())
+
+
+class MonteCarloResult(object):
+
+    """
+    Distribution of the summary statistics over the synthetic paths.
+    """
+
+    def __init__(self, method, stats, observed):
+        self.method = method
+        self.stats = stats
+        self.observed = observed
+
+    def to_dataframe(self):
+        """
+        :return: (DataFrame) one row per synthetic path.
+        """
+        return pd.DataFrame(self.stats)
+
+    def confidence_intervals(self, level=0.95):
+        """
+        Percentile confidence intervals of every statistic.
+
+        :param level: (dbl) confidence level, e.g. 0.95.
+        :return: (DataFrame) observed value, lower, median and upper bound.
+        """
+        tail = (1.0 - level) / 2.0 * 100.0
+        rows = dict()
+        for key, values in self.stats.items():
+            lower, median, upper = np.nanpercentile(
+                values, [tail, 50.0, 100.0 - tail])
+            rows[key] = {'Observed': self.observed[key], 'Lower': lower,
+                         'Median': median, 'Upper': upper}
+        return pd.DataFrame(rows).T[['Observed', 'Lower', 'Median', 'Upper']]
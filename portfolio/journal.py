@@ -0,0 +1,204 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# portfolio.journal.py
+
+'''
+@summary: Append-only binary results journal. Holdings, fills and equity
+          rows are streamed during the run into one directory per run,
+          one raw little-endian file per column, by a background writer
+          thread. load_journal() maps them back into pandas DataFrames.
+'''
+
+# General imports
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+import datetime
+import json
+import logging
+import os
+import threading
+import uuid
+
+import numpy as np
+import pandas as pd
+
+
+SCHEMA_FILE = 'schema.json'
+
+
+class ResultsJournal(object):
+
+    """
+    Streams result rows to a per-run columnar directory:
+
+        <root_dir>/<run_id>/schema.json
+        <root_dir>/<run_id>/<table>.<column>.bin
+
+    Rows are buffered per table in the calling thread and handed to the
+    writer thread every `flush_rows` rows, so the event loop only pays
+    for a list append. Every run gets its own directory, so concurrent
+    runs never collide.
+    """
+
+    def __init__(self, root_dir='results', run_id=None, flush_rows=4096):
+        """
+        :param root_dir: (str) directory holding the run directories.
+        :param run_id: (str) name of this run, generated when None.
+        :param flush_rows: (int) rows buffered before a write is queued.
+        """
+        if run_id is None:
+            run_id = '%s-%d-%s' % (
+                datetime.datetime.now().strftime('%Y%m%d-%H%M%S'),
+                os.getpid(), uuid.uuid4().hex[:8])
+        self.run_id = run_id
+        self.path = os.path.join(root_dir, run_id)
+        os.makedirs(self.path)
+
+        self.flush_rows = flush_rows
+        self.schema = {}
+        self._buffers = {}
+        self._files = {}
+        self._error = None
+        self._queue = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop,
+                                        name='journal-%s' % run_id)
+        self._writer.daemon = True
+        self._writer.start()
+        self.closed = False
+
+    def add_table(self, table, columns, categories=None):
+        """
+        Declares a table before rows are appended to it.
+
+        :param table: (str) name of the table, e.g. 'holdings'.
+        :param columns: (list) (name, numpy dtype string) pairs.
+        :param categories: (dict) column -> list of labels for integer
+                           coded columns.
+        """
+        self.schema[table] = {
+            'columns': [[name, np.dtype(dtype).str] for name, dtype in columns],
+            'categories': categories or {}}
+        self._buffers[table] = []
+        self._write_schema()
+
+    def append(self, table, row):
+        """
+        Appends one row (a tuple in column order) to a table.
+        """
+        buf = self._buffers[table]
+        buf.append(row)
+        if len(buf) >= self.flush_rows:
+            self._queue.put((table, buf))
+            self._buffers[table] = []
+
+    def flush(self):
+        """
+        Hands all the buffered rows to the writer thread.
+        """
+        for table, buf in self._buffers.items():
+            if buf:
+                self._queue.put((table, buf))
+                self._buffers[table] = []
+
+    def close(self):
+        """
+        Flushes the remaining rows, waits for the writer thread and
+        closes the column files.
+        """
+        if self.closed:
+            return
+        self.flush()
+        self._queue.put(None)
+        self._writer.join()
+        self.closed = True
+        if self._error is not None:
+            raise self._error
+
+    def _write_schema(self):
+        tmp = os.path.join(self.path, SCHEMA_FILE + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(self.schema, f)
+        os.replace(tmp, os.path.join(self.path, SCHEMA_FILE))
+
+    def _write_loop(self):
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                if self._error is None:
+                    self._write_rows(*item)
+        except Exception as e:
+            logging.error("Results journal writer failed [%s]", e)
+            self._error = e
+        finally:
+            for f in self._files.values():
+                f.close()
+
+    def _write_rows(self, table, rows):
+        columns = self.schema[table]['columns']
+        for (name, dtype), values in zip(columns, zip(*rows)):
+            key = (table, name)
+            if key not in self._files:
+                self._files[key] = open(os.path.join(
+                    self.path, '%s.%s.bin' % (table, name)), 'ab')
+            self._files[key].write(np.asarray(values, dtype=dtype).tobytes())
+        for (t, _), f in self._files.items():
+            if t == table:
+                f.flush()
+
+
+def list_runs(root_dir='results'):
+    """
+    :return: (list) run directories under root_dir, oldest first.
+    """
+    if not os.path.isdir(root_dir):
+        return []
+    runs = [os.path.join(root_dir, d) for d in sorted(os.listdir(root_dir))
+            if os.path.isfile(os.path.join(root_dir, d, SCHEMA_FILE))]
+    return runs
+
+
+def load_table(path, table):
+    """
+    Loads one table of a journal run directory into a DataFrame. Only
+    complete rows are returned, so a run still being written (or one
+    that crashed) can be read safely.
+
+    :param path: (str) the run directory.
+    :param table: (str) the table name.
+    :return: (DataFrame) the table, integer coded columns as categoricals.
+    """
+    with open(os.path.join(path, SCHEMA_FILE)) as f:
+        spec = json.load(f)[table]
+
+    data = {}
+    for name, dtype in spec['columns']:
+        col_path = os.path.join(path, '%s.%s.bin' % (table, name))
+        if os.path.exists(col_path):
+            data[name] = np.fromfile(col_path, dtype=np.dtype(dtype))
+        else:
+            data[name] = np.empty(0, dtype=np.dtype(dtype))
+    n_rows = min(len(v) for v in data.values()) if data else 0
+
+    frame = pd.DataFrame(dict((k, v[:n_rows]) for k, v in data.items()),
+                         columns=[name for name, _ in spec['columns']])
+    for name, labels in spec['categories'].items():
+        frame[name] = pd.Categorical.from_codes(frame[name], labels)
+    if 'datetime' in frame:
+        frame.set_index('datetime', inplace=True)
+    return frame
+
+
+def load_journal(path):
+    """
+    Loads every table of a journal run directory.
+
+    :param path: (str) the run directory.
+    :return: (dict) table name -> DataFrame.
+    """
+    with open(os.path.join(path, SCHEMA_FILE)) as f:
+        tables = list(json.load(f))
+    return dict((t, load_table(path, t)) for t in tables)
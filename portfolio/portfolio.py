@@ -9,15 +9,20 @@
 '''
 
 # General imports
+import numpy as np
 import pandas as pd
 from math import floor
 import logging
 
 # local imports
-from events.events_impl import OrderEvent
+from events.events_impl import OrderEvent, OrderBatchEvent
 from performance.performance import create_sharpe_ratio, create_drawdowns
+from portfolio.sizing import FixedQuantitySizer
 
 
+# Target position sign of each signal type, used by the batch order path
+DIRECTION_SIGN = {'LONG': 1, 'SHORT': -1, 'EXIT': 0}
+
 
 class Portfolio(object):
 
@@ -35,7 +40,8 @@ class Portfolio(object):
     portfolio total across bars.
     """
 
-    def __init__(self, bars, events, start_date, initial_capital=100000.0):
+    def __init__(self, bars, events, start_date, initial_capital=100000.0,
+                 risk_engine=None, sizer=None, journal=None):
         """
         w the portfolio with bars and an event queue.
         Also includes a starting datetime index and initial capital
@@ -46,6 +52,12 @@ class Portfolio(object):
         events - The Event Queue object.
         start_date - The start date (bar) of the portfolio.
         initial_capital - The starting capital in INR.
+        risk_engine - Optional risk engine (e.g. HistoricalVaREngine)
+                      consulted when sizing orders.
+        sizer - PositionSizer used by the batch order path, defaults to
+                a fixed 100 shares like generate_naive_order.
+        journal - Optional ResultsJournal the holdings, equity and fills
+                  are streamed to during the run.
         """
         self.bars = bars
         self.events = events
@@ -59,6 +71,36 @@ class Portfolio(object):
         self.current_holdings = self.construct_current_holdings()
         self.equity_curve = 0
 
+        self.sizer = sizer or FixedQuantitySizer(100)
+        self.risk_engine = risk_engine
+        if self.risk_engine is not None:
+            self.risk_engine.attach(self.bars, self.symbol_list)
+
+        self.journal = journal
+        if self.journal is not None:
+            self.construct_journal_tables()
+
+    def construct_journal_tables(self):
+        """
+        Declares the holdings, equity and fills tables of the journal.
+        """
+        self._sym_code = dict((s, i) for i, s in enumerate(self.symbol_list))
+        self._last_total = None
+        self.journal.add_table(
+            'holdings', [('datetime', 'M8[ns]')] +
+            [(s, 'f8') for s in self.symbol_list] +
+            [('cash', 'f8'), ('commission', 'f8'), ('total', 'f8')])
+        self.journal.add_table(
+            'equity', [('datetime', 'M8[ns]'), ('total', 'f8'),
+                       ('returns', 'f8')])
+        self.journal.add_table(
+            'fills', [('datetime', 'M8[ns]'), ('symbol', 'i4'),
+                      ('quantity', 'i8'), ('direction', 'i1'),
+                      ('fill_cost', 'f8'), ('commission', 'f8')],
+            categories={'symbol': list(self.symbol_list),
+                        'direction': ['BUY', 'SELL']})
+        self.journal_holdings(self.all_holdings[0])
+
     def construct_all_positions(self):
         """
         Constructs the positions list using the start_date
@@ -124,16 +166,36 @@ class Portfolio(object):
         dh['commission'] = self.current_holdings['commission']
         dh['total'] = self.current_holdings['cash']
 
+        prices = {}
         for s in self.symbol_list:
             # Approximation to the real value
-            market_value = self.current_positions[s] * \
-                self.bars.get_latest_bar_value(s, "adj_close")
+            prices[s] = self.bars.get_latest_bar_value(s, "adj_close")
+            market_value = self.current_positions[s] * prices[s]
             dh[s] = market_value
             dh['total'] += market_value
 
         # Append the current holdings
         self.all_holdings.append(dh)
 
+        if self.risk_engine is not None:
+            self.risk_engine.update_bar(prices)
+
+        if self.journal is not None:
+            self.journal_holdings(dh)
+
+    def journal_holdings(self, dh):
+        """
+        Streams one holdings record and its equity row to the journal.
+        """
+        dt = pd.Timestamp(dh['datetime']).to_datetime64()
+        self.journal.append(
+            'holdings', (dt,) + tuple(dh[s] for s in self.symbol_list) +
+            (dh['cash'], dh['commission'], dh['total']))
+        returns = np.nan if not self._last_total else \
+            dh['total'] / self._last_total - 1.0
+        self.journal.append('equity', (dt, dh['total'], returns))
+        self._last_total = dh['total']
+
     # ======================
     # FILL/POSITION HANDLING
     # ======================
@@ -156,6 +218,10 @@ class Portfolio(object):
         # Update positions list with new quantities
         self.current_positions[fill.symbol] += fill_dir * fill.quantity
 
+        if self.risk_engine is not None:
+            self.risk_engine.update_position(
+                fill.symbol, self.current_positions[fill.symbol])
+
     def update_holdings_from_fill(self, fill):
         """
         Takes a Fill object and updates the holdings matrix to
@@ -171,9 +237,13 @@ class Portfolio(object):
         if fill.direction == 'SELL':
             fill_dir = -1
 
-        # Update holdings list with new quantities
-        fill_cost = self.bars.get_latest_bar_value(fill.symbol, "adj_close")
-        cost = fill_dir * fill_cost * fill.quantity
+        # Update holdings list with new quantities, at the execution
+        # price when the handler reports one
+        if fill.fill_cost:
+            cost = fill_dir * fill.fill_cost
+        else:
+            fill_cost = self.bars.get_latest_bar_value(fill.symbol, "adj_close")
+            cost = fill_dir * fill_cost * fill.quantity
         self.current_holdings[fill.symbol] += cost
         self.current_holdings['commission'] += fill.commission
         self.current_holdings['cash'] -= (cost + fill.commission)
@@ -187,12 +257,59 @@ class Portfolio(object):
         if event.type == 'FILL':
             self.update_positions_from_fill(event)
             self.update_holdings_from_fill(event)
+            if self.journal is not None:
+                self.journal_fill(event)
+
+    def journal_fill(self, fill):
+        """
+        Streams one fill to the journal.
+        """
+        self.journal.append('fills', (
+            pd.Timestamp(fill.timeindex).to_datetime64(),
+            self._sym_code[fill.symbol], fill.quantity,
+            0 if fill.direction == 'BUY' else 1,
+            fill.fill_cost, fill.commission))
+
+    def update_fills(self, fills):
+        """
+        Updates the portfolio current positions and holdings from all
+        the Fills of one bar (a FillBatchEvent) in a single pass, with
+        one price lookup per symbol and one cash update.
+        """
+        prices = {}
+        total_cost = 0.0
+        total_commission = 0.0
+        for fill in fills:
+            fill_dir = 1 if fill.direction == 'BUY' else -1
+            symbol = fill.symbol
+            self.current_positions[symbol] += fill_dir * fill.quantity
+
+            if fill.fill_cost:
+                cost = fill_dir * fill.fill_cost
+            else:
+                if symbol not in prices:
+                    prices[symbol] = self.bars.get_latest_bar_value(
+                        symbol, "adj_close")
+                cost = fill_dir * prices[symbol] * fill.quantity
+            self.current_holdings[symbol] += cost
+            total_cost += cost
+            total_commission += fill.commission
+
+            if self.risk_engine is not None:
+                self.risk_engine.update_position(
+                    symbol, self.current_positions[symbol])
+            if self.journal is not None:
+                self.journal_fill(fill)
+
+        self.current_holdings['commission'] += total_commission
+        self.current_holdings['cash'] -= (total_cost + total_commission)
+        self.current_holdings['total'] -= (total_cost + total_commission)
 
     def generate_naive_order(self, signal):
         """
         Simply files an Order object as a constant quantity
-        sizing of the signal object, without risk management or
-        position sizing considerations.
+        sizing of the signal object. When a risk engine is set,
+        new positions are capped to stay within its VaR limit.
 
         Parameters:
         signal - The tuple containing Signal information.
@@ -206,6 +323,14 @@ class Portfolio(object):
         cur_quantity = self.current_positions[symbol]
         order_type = 'MKT'
 
+        if self.risk_engine is not None and cur_quantity == 0 and \
+                direction in ('LONG', 'SHORT'):
+            mkt_quantity = self.risk_engine.size_order(
+                symbol, mkt_quantity, 'BUY' if direction == 'LONG' else 'SELL')
+            if mkt_quantity == 0:
+                logging.info("Signal for %s dropped by the risk limit", symbol)
+                return None
+
         if direction == 'LONG' and cur_quantity == 0:
             order = OrderEvent(symbol, order_type, mkt_quantity, 'BUY')
         if direction == 'SHORT' and cur_quantity == 0:
@@ -224,7 +349,84 @@ class Portfolio(object):
         """
         if event.type == 'SIGNAL':
             order_event = self.generate_naive_order(event)
-            self.events.put(order_event)
+            if order_event is not None:
+                self.events.put(order_event)
+
+    # ====================
+    # BATCH ORDER HANDLING
+    # ====================
+
+    def current_equity(self):
+        """
+        Marks the current positions to the latest adj_close and returns
+        the total portfolio value.
+        """
+        qty = np.array([self.current_positions[s] for s in self.symbol_list],
+                       dtype=np.float64)
+        held = np.flatnonzero(qty)
+        prices = np.array([self.bars.get_latest_bar_value(
+            self.symbol_list[i], "adj_close") for i in held])
+        return self.current_holdings['cash'] + np.nansum(qty[held] * prices)
+
+    def generate_batch_orders(self, signals):
+        """
+        Turns all the signals of one bar into orders in one pass. Each
+        signal sets a target position (LONG/SHORT sized by the sizer,
+        EXIT flat) and the order is the difference to the current
+        position. When a symbol has several signals the last one wins.
+        Unless the sizer reverses positions, LONG/SHORT signals on a
+        symbol already held keep its position, as generate_naive_order
+        does.
+
+        Parameters:
+        signals - List of Signal objects generated on the same bar.
+        """
+        latest = dict((sig.symbol, sig) for sig in signals
+                      if sig.signal_type in DIRECTION_SIGN)
+        symbols = list(latest)
+        if not symbols:
+            return []
+
+        sign = np.array([DIRECTION_SIGN[latest[s].signal_type]
+                         for s in symbols])
+        strength = np.array([latest[s].strength for s in symbols],
+                            dtype=np.float64)
+        current = np.array([self.current_positions[s] for s in symbols])
+        prices = np.array([self.bars.get_latest_bar_value(s, "adj_close")
+                           for s in symbols], dtype=np.float64)
+
+        # Positions held once the batch is applied, for equal weighting
+        others = sum(1 for s in self.symbol_list
+                     if s not in latest and self.current_positions[s] != 0)
+        n_held = others + int(np.count_nonzero(sign))
+
+        size = np.floor(self.sizer.size(self, symbols, strength, prices,
+                                        n_held))
+        target = (sign * size).astype(np.int64)
+        if not self.sizer.reverse:
+            # Entries from flat only
+            target = np.where((sign != 0) & (current != 0), current, target)
+        quantity = target - current
+
+        orders = []
+        for i in np.flatnonzero(quantity):
+            direction = 'BUY' if quantity[i] > 0 else 'SELL'
+            qty = abs(int(quantity[i]))
+            if self.risk_engine is not None and target[i] != 0:
+                qty = self.risk_engine.size_order(symbols[i], qty, direction)
+            if qty > 0:
+                orders.append(OrderEvent(symbols[i], 'MKT', qty, direction))
+        return orders
+
+    def update_signals(self, signals):
+        """
+        Acts on all the SignalEvents of one bar at once and puts a
+        single OrderBatchEvent on the queue.
+        """
+        orders = self.generate_batch_orders(
+            [sig for sig in signals if sig.type == 'SIGNAL'])
+        if orders:
+            self.events.put(OrderBatchEvent(orders))
 
     # ========================
     # POST-BACKTEST STATISTICS
@@ -239,8 +441,7 @@ class Portfolio(object):
         curve.set_index('datetime', inplace=True)
         curve['returns'] = curve['total'].pct_change()
         curve['equity_curve'] = (1.0 + curve['returns']).cumprod()
-        logging.debug("Curve")
-        logging.debug(curve)
+        logging.debug("Curve\n%s", curve)
         self.equity_curve = curve
 
     def output_summary_stats(self):
@@ -266,5 +467,4 @@ class Portfolio(object):
         stats['Max Drawdown'] = max_dd
         stats['Drawdown Duration'] = floor(dd_duration)
 
-        self.equity_curve.to_csv('equity.csv')
         return stats
\ No newline at end of file
@@ -0,0 +1,214 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# portfolio.risk.py
+
+'''
+@summary: Historical-simulation risk engine. Keeps a rolling window of
+          bar returns for every symbol and measures the Value at Risk and
+          Expected Shortfall of the current positions, so that the
+          Portfolio can consult it when sizing orders.
+'''
+
+# General imports
+from math import ceil
+import numpy as np
+
+
+class HistoricalVaREngine(object):
+
+    """
+    Portfolio Value at Risk and Expected Shortfall from historical
+    simulation over the last `window` bars.
+
+    The prices come from the data handler the engine is attached to,
+    but the bar returns live in the engine's own fixed-size circular
+    buffer: the data handlers keep bars rather than returns, so reading
+    the window back from them would cost O(window) per symbol on every
+    bar, whereas the buffer only overwrites one row per bar. The
+    scenario P&L vector (one value per historical bar) is rebuilt at
+    most once per bar, when first requested, and fills or what-if trades
+    within the bar adjust it one column at a time. The VaR itself comes
+    from a partial sort of the scenarios, so a query is O(window).
+
+    VaR and ES are reported as positive amounts in the portfolio
+    currency.
+    """
+
+    def __init__(self, window=250, confidence=0.99, var_limit=None,
+                 min_periods=20):
+        """
+        :param window: (int) number of historical bars used as scenarios.
+        :param confidence: (dbl) VaR confidence level, e.g. 0.99.
+        :param var_limit: (dbl) maximum portfolio VaR allowed when sizing
+                          orders, None for no limit.
+        :param min_periods: (int) bars needed before the engine reports.
+        """
+        if not 0.0 < confidence < 1.0:
+            raise ValueError("confidence must be between 0 and 1.")
+        self.window = window
+        self.confidence = confidence
+        self.var_limit = var_limit
+        self.min_periods = min(min_periods, window)
+        self.symbol_list = []
+
+    def attach(self, bars, symbol_list=None):
+        """
+        Binds the engine to the DataHandler feeding the portfolio.
+
+        :param bars: The DataHandler object with current market data.
+        :param symbol_list: A list of symbol strings, defaults to the
+                            symbols of the data handler.
+        """
+        self.bars = bars
+        self.symbol_list = list(symbol_list or bars.symbol_list)
+        self._sym_idx = dict((s, i) for i, s in enumerate(self.symbol_list))
+
+        n_sym = len(self.symbol_list)
+        self._returns = np.zeros((self.window, n_sym))
+        self._prices = np.full(n_sym, np.nan)
+        self._quantity = np.zeros(n_sym)
+        self._pnl = np.zeros(self.window)
+        self._row = 0
+        self._count = 0
+        self._primed = False
+        self._dirty = True
+
+    # =================
+    # INCREMENTAL STATE
+    # =================
+
+    def update_bar(self, prices=None):
+        """
+        Adds the returns of the latest bar to the scenario window.
+
+        :param prices: (dict) symbol -> latest adj_close; read from the
+                       data handler when not given.
+        """
+        if prices is None:
+            prices = dict((s, self.bars.get_latest_bar_value(s, "adj_close"))
+                          for s in self.symbol_list)
+        new_prices = np.array([prices[s] for s in self.symbol_list],
+                              dtype=np.float64)
+
+        if not self._primed:
+            # First bar, no return available yet
+            self._prices = new_prices
+            self._primed = True
+            return
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ret = new_prices / self._prices - 1.0
+        ret[~np.isfinite(ret)] = 0.0
+
+        self._returns[self._row] = ret
+        self._row = (self._row + 1) % self.window
+        self._count += 1
+        self._prices = np.where(np.isnan(new_prices), self._prices,
+                                new_prices)
+        self._dirty = True
+
+    def update_position(self, symbol, quantity):
+        """
+        Records the new position held in a symbol, e.g. after a fill.
+
+        :param symbol: (str) the instrument.
+        :param quantity: (int) the signed quantity now held.
+        """
+        i = self._sym_idx[symbol]
+        delta = quantity - self._quantity[i]
+        if delta == 0:
+            return
+        self._quantity[i] = quantity
+        if not self._dirty:
+            self._pnl += self._returns[:, i] * (delta * self._price(i))
+
+    def _price(self, i):
+        price = self._prices[i]
+        return 0.0 if np.isnan(price) else price
+
+    def _scenario_pnl(self):
+        if self._dirty:
+            exposure = self._quantity * np.nan_to_num(self._prices)
+            np.dot(self._returns, exposure, out=self._pnl)
+            self._dirty = False
+        return self._pnl[:min(self._count, self.window)]
+
+    # ========
+    # MEASURES
+    # ========
+
+    @property
+    def is_ready(self):
+        """
+        True once enough bars have been seen to report a VaR.
+        """
+        return self._count >= self.min_periods
+
+    def _tail(self, pnl):
+        losses = -pnl
+        # Round first so that e.g. 5% of 100 scenarios gives 5, not 6
+        k = max(1, int(ceil(round((1.0 - self.confidence) * len(losses), 9))))
+        tail = np.partition(losses, len(losses) - k)[len(losses) - k:]
+        var = tail.min()
+        return max(var, 0.0), max(tail.mean(), 0.0)
+
+    def value_at_risk(self):
+        """
+        :return: (dbl) historical VaR of the current positions.
+        """
+        if not self.is_ready:
+            return 0.0
+        return self._tail(self._scenario_pnl())[0]
+
+    def expected_shortfall(self):
+        """
+        :return: (dbl) mean loss of the scenarios beyond the VaR.
+        """
+        if not self.is_ready:
+            return 0.0
+        return self._tail(self._scenario_pnl())[1]
+
+    def risk_with_trade(self, symbol, quantity):
+        """
+        VaR and ES the portfolio would have after trading `quantity`
+        (signed) in `symbol`, without changing the engine state.
+
+        :return: var, es - (dbl) tuple of the what-if measures.
+        """
+        if not self.is_ready:
+            return 0.0, 0.0
+        i = self._sym_idx[symbol]
+        pnl = self._scenario_pnl()
+        return self._tail(pnl + self._returns[:len(pnl), i] *
+                          (quantity * self._price(i)))
+
+    def size_order(self, symbol, quantity, direction):
+        """
+        Caps an order quantity so that the portfolio VaR after the trade
+        stays within var_limit. Trades that reduce the VaR are never
+        capped.
+
+        :param symbol: (str) the instrument to trade.
+        :param quantity: (int) requested non-negative quantity.
+        :param direction: (str) 'BUY' or 'SELL'.
+        :return: (int) the quantity allowed by the risk limit.
+        """
+        if self.var_limit is None or not self.is_ready or quantity <= 0:
+            return quantity
+        sign = 1 if direction == 'BUY' else -1
+        current = self.value_at_risk()
+        var_full = self.risk_with_trade(symbol, sign * quantity)[0]
+        if var_full <= max(self.var_limit, current):
+            return quantity
+        if current >= self.var_limit:
+            return 0
+
+        # Bisect for the largest quantity within the limit
+        low, high = 0, quantity
+        while high - low > 1:
+            mid = (low + high) // 2
+            if self.risk_with_trade(symbol, sign * mid)[0] <= self.var_limit:
+                low = mid
+            else:
+                high = mid
+        return low
@@ -0,0 +1,145 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# portfolio.sizing.py
+
+'''
+@summary: Pluggable position sizing schemes used by the Portfolio batch
+          order path. A sizer turns the signals of one bar into absolute
+          target quantities for all of their symbols in one array
+          operation.
+'''
+
+# General imports
+from abc import ABCMeta, abstractmethod
+import numpy as np
+
+
+class PositionSizer(object):
+
+    """
+    PositionSizer is an abstract base class providing an interface for
+    all subsequent (inherited) sizing schemes.
+
+    size() receives the signals of one bar as arrays and returns the
+    absolute quantity to hold for each of them. The Portfolio applies
+    the direction and turns targets into orders.
+
+    With `reverse` set, a LONG or SHORT signal on a symbol already held
+    resizes the position to the new target, flipping it when it is on
+    the other side (LONG while short 100 buys 100 + target). Without
+    it, LONG and SHORT only open positions from flat and are ignored
+    otherwise, as in Portfolio.generate_naive_order.
+    """
+
+    __metaclass__ = ABCMeta
+
+    reverse = True
+
+    @abstractmethod
+    def size(self, portfolio, symbols, strengths, prices, n_held):
+        """
+        Returns the absolute target quantity for each signal.
+
+        :param portfolio: The Portfolio requesting the sizes.
+        :param symbols: (list) symbols of the signals.
+        :param strengths: (ndarray) signal strengths.
+        :param prices: (ndarray) latest adj_close of each symbol.
+        :param n_held: (int) positions held once the batch is applied.
+        :return: (ndarray) non-negative quantities.
+        """
+        raise NotImplementedError("Should implement size()")
+
+
+class FixedQuantitySizer(PositionSizer):
+
+    """
+    Constant quantity per position. By default it follows the rules of
+    Portfolio.generate_naive_order: positions are opened from flat only,
+    so the batch path sends the same orders as the per-signal one.
+    """
+
+    def __init__(self, quantity=100, reverse=False):
+        """
+        :param quantity: (int) shares per position.
+        :param reverse: (bool) let LONG/SHORT signals flip an open
+                        position instead of ignoring them.
+        """
+        self.quantity = quantity
+        self.reverse = reverse
+
+    def size(self, portfolio, symbols, strengths, prices, n_held):
+        return np.full(len(symbols), self.quantity, dtype=np.float64)
+
+
+class FixedFractionalSizer(PositionSizer):
+
+    """
+    Commits a fixed fraction of the portfolio equity to each new
+    position, scaled by the signal strength.
+    """
+
+    def __init__(self, fraction=0.02):
+        self.fraction = fraction
+
+    def size(self, portfolio, symbols, strengths, prices, n_held):
+        equity = portfolio.current_equity()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            qty = equity * self.fraction * strengths / prices
+        return np.nan_to_num(qty, posinf=0.0, neginf=0.0)
+
+
+class EqualWeightSizer(PositionSizer):
+
+    """
+    Splits the gross exposure equally between all positions held once
+    the bar's signals are applied.
+    """
+
+    def __init__(self, gross_exposure=1.0):
+        self.gross_exposure = gross_exposure
+
+    def size(self, portfolio, symbols, strengths, prices, n_held):
+        equity = portfolio.current_equity()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            qty = equity * self.gross_exposure / max(n_held, 1) / prices
+        return np.nan_to_num(qty, posinf=0.0, neginf=0.0)
+
+
+class VolatilityTargetSizer(PositionSizer):
+
+    """
+    Sizes each position so that its annualised volatility contributes
+    target_vol of the portfolio equity, using the realised volatility of
+    the symbol over the last `lookback` bars.
+    """
+
+    def __init__(self, target_vol=0.10, lookback=20, periods=252,
+                 max_leverage=1.0):
+        """
+        :param target_vol: (dbl) annualised volatility target per position.
+        :param lookback: (int) bars used to estimate the volatility.
+        :param periods: (int) bars per year.
+        :param max_leverage: (dbl) cap on a position's notional over equity.
+        """
+        self.target_vol = target_vol
+        self.lookback = lookback
+        self.periods = periods
+        self.max_leverage = max_leverage
+
+    def size(self, portfolio, symbols, strengths, prices, n_held):
+        equity = portfolio.current_equity()
+        vols = np.empty(len(symbols))
+        for i, s in enumerate(symbols):
+            closes = portfolio.bars.get_latest_bars_values(
+                s, "adj_close", bars=self.lookback + 1)
+            # The CSV handler returns up to twice the bars asked for
+            closes = closes[-(self.lookback + 1):]
+            rets = np.diff(closes) / closes[:-1]
+            vols[i] = np.nanstd(rets) if len(rets) > 1 else np.nan
+        vols *= np.sqrt(self.periods)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            weight = np.minimum(self.target_vol / vols, self.max_leverage)
+            weight = np.nan_to_num(weight, posinf=0.0, neginf=0.0)
+            qty = equity * weight * strengths / prices
+        return np.nan_to_num(qty, posinf=0.0, neginf=0.0)
@@ -0,0 +1,173 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# strategy.features.py
+
+'''
+@summary: Incremental rolling feature engine for strategies. Lagged
+          returns, rolling mean and volatility of returns and volume
+          features are maintained in fixed-size circular buffers, so a
+          new bar is an O(1) update per symbol instead of a rebuild from
+          the bar history.
+'''
+
+# General imports
+import numpy as np
+
+
+class RollingFeatureEngine(object):
+
+    """
+    Maintains the model features of one or several symbols bar by bar.
+
+    Every call to update() takes the latest adj_close (and volume) of
+    all the symbols, writes one slot of the circular buffers, adjusts
+    the running sums and refreshes the preallocated `features` matrix,
+    one row per symbol, ready to be handed to a model's predict().
+
+    The columns are, in order (see feature_names):
+
+    - LagK for each K in lags: the percentage return K-1 bars before the
+      latest one, i.e. Lag1 is the latest return. This matches the
+      LagK columns of utils.create_lagged_series on the day being
+      predicted.
+    - RollMean, RollVol: mean and standard deviation of the last
+      `window` percentage returns.
+    - VolumeRatio, VolumeChange (with volume=True): latest volume over
+      its rolling mean and its percentage change from the prior bar.
+
+    Returns are scaled by `scale` (100.0 gives percentages like
+    create_lagged_series). A missing (NaN) price counts as an unchanged
+    price so the running sums stay finite.
+    """
+
+    def __init__(self, n_symbols=1, lags=(1, 2), window=20, volume=False,
+                 scale=100.0):
+        """
+        :param n_symbols: (int) number of symbols updated together.
+        :param lags: (tuple) lags of the return features, 1-based.
+        :param window: (int) bars of the rolling mean, volatility and
+                       volume average.
+        :param volume: (bool) add the volume features.
+        :param scale: (dbl) multiplier applied to the returns.
+        """
+        self.n_symbols = n_symbols
+        self.lags = tuple(lags)
+        self.window = window
+        self.volume = volume
+        self.scale = scale
+
+        self.feature_names = ['Lag%d' % k for k in self.lags] + \
+            ['RollMean', 'RollVol']
+        if volume:
+            self.feature_names += ['VolumeRatio', 'VolumeChange']
+        self.features = np.full((n_symbols, len(self.feature_names)), np.nan)
+
+        self._size = max(max(self.lags) if self.lags else 1, window)
+        self._lag_cols = np.arange(len(self.lags))
+        self._lag_offsets = np.array(self.lags) - 1
+        self._returns = np.zeros((self._size, n_symbols))
+        self._volumes = np.zeros((window, n_symbols))
+        self._last_price = np.full(n_symbols, np.nan)
+        self._last_volume = np.full(n_symbols, np.nan)
+        self._sum = np.zeros(n_symbols)
+        self._sum_sq = np.zeros(n_symbols)
+        self._vol_sum = np.zeros(n_symbols)
+        self._pos = 0
+        self._vol_pos = 0
+        self.count = 0
+
+    @property
+    def is_ready(self):
+        """
+        True once every feature is computed from a full window.
+        """
+        return self.count >= self._size
+
+    def update(self, prices, volumes=None):
+        """
+        Adds one bar for all the symbols.
+
+        :param prices: (array-like) latest adj_close, one per symbol.
+        :param volumes: (array-like) latest volume, one per symbol.
+        :return: (ndarray) the features matrix, updated in place.
+        """
+        prices = np.asarray(prices, dtype=np.float64).reshape(self.n_symbols)
+        prices = np.where(np.isnan(prices), self._last_price, prices)
+
+        if np.isnan(self._last_price).all():
+            # First bar, no return yet
+            self._last_price = prices
+            self._update_volume(volumes, first=True)
+            return self.features
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ret = (prices / self._last_price - 1.0) * self.scale
+        ret[~np.isfinite(ret)] = 0.0
+        self._last_price = np.where(np.isnan(prices), self._last_price,
+                                    prices)
+
+        # Slide the rolling window: drop the oldest return in the window
+        old = self._returns[(self._pos - self.window) % self._size]
+        if self.count >= self.window:
+            self._sum -= old
+            self._sum_sq -= old * old
+        self._returns[self._pos] = ret
+        self._sum += ret
+        self._sum_sq += ret * ret
+        self._pos = (self._pos + 1) % self._size
+        self.count += 1
+        if self.count % (64 * self._size) == 0:
+            self._resync()
+
+        n = min(self.count, self.window)
+        feats = self.features
+        feats[:, self._lag_cols] = self._returns[
+            (self._pos - 1 - self._lag_offsets) % self._size].T
+        if self.count < max(self.lags):
+            feats[:, self._lag_cols[self._lag_offsets >= self.count]] = np.nan
+        mean = self._sum / n
+        k = len(self.lags)
+        feats[:, k] = mean
+        feats[:, k + 1] = np.sqrt(np.maximum(self._sum_sq / n - mean * mean,
+                                             0.0))
+        if self.volume:
+            self._update_volume(volumes)
+        return feats
+
+    def _resync(self):
+        # Recompute the running sums now and then to stop float drift
+        idx = (self._pos - 1 - np.arange(self.window)) % self._size
+        window = self._returns[idx]
+        self._sum = window.sum(axis=0)
+        self._sum_sq = (window * window).sum(axis=0)
+
+    def _update_volume(self, volumes, first=False):
+        if not self.volume:
+            return
+        volumes = np.asarray(volumes, dtype=np.float64).reshape(self.n_symbols)
+        volumes = np.where(np.isnan(volumes), 0.0, volumes)
+
+        n_seen = self.count + 1
+        if n_seen > self.window:
+            self._vol_sum -= self._volumes[self._vol_pos]
+        self._volumes[self._vol_pos] = volumes
+        self._vol_sum += volumes
+        self._vol_pos = (self._vol_pos + 1) % self.window
+        if first:
+            self._last_volume = volumes
+            return
+
+        k = len(self.lags) + 2
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.features[:, k] = volumes / (self._vol_sum /
+                                             min(n_seen, self.window))
+            self.features[:, k + 1] = (volumes / self._last_volume - 1.0) * \
+                self.scale
+        self._last_volume = volumes
+
+    def row(self, symbol_idx=0):
+        """
+        :return: (ndarray) a (1 x n_features) view of one symbol's
+                 features, e.g. for a single-symbol predict().
+        """
+        return self.features[symbol_idx:symbol_idx + 1]
@@ -0,0 +1,135 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# strategy.retraining.py
+
+'''
+@summary: Periodic model retraining in the background. New models are
+          fitted in a worker thread or process on a snapshot of the
+          training features and swapped in at a bar boundary.
+'''
+
+# General imports
+from concurrent.futures import Executor, ProcessPoolExecutor, \
+    ThreadPoolExecutor
+import logging
+
+
+class RetrainingScheduler(object):
+
+    """
+    Refits a strategy's model every `every` bars (an int) or at the
+    start of every month ('M') or week ('W') of the bar dates.
+
+    On a retraining bar on_bar() takes a snapshot of the training data
+    through the strategy supplied callable and submits fit(*snapshot) to
+    the executor; the event loop carries on with the current model.
+
+    The new model becomes `model` exactly `swap_delay` bars later:
+
+    - deterministic=True (backtests): on that bar the scheduler waits
+      for the fit if it is still running, so the swap bar never depends
+      on machine load and runs are reproducible.
+    - deterministic=False (live): from that bar on the model is swapped
+      in on the first bar the fit has completed, never blocking.
+
+    The swap is a single reference assignment, so readers always see
+    either the old or the new model, never a partially fitted one.
+    """
+
+    def __init__(self, fit, model, every='M', swap_delay=1,
+                 executor='thread', deterministic=True):
+        """
+        :param fit: callable returning a fitted model from the snapshot;
+                    must be picklable (module level) for 'process'.
+        :param model: the initial fitted model.
+        :param every: (int/str) bars between fits, 'M' or 'W'.
+        :param swap_delay: (int) bars between a fit and its swap.
+        :param executor: 'thread', 'process' or a concurrent.futures
+                         Executor.
+        :param deterministic: (bool) wait for the fit on the swap bar.
+        """
+        self.fit = fit
+        self.model = model
+        self.every = every
+        self.swap_delay = max(int(swap_delay), 0)
+        self.deterministic = deterministic
+        self._owns_executor = not isinstance(executor, Executor)
+        if isinstance(executor, Executor):
+            self._executor = executor
+        elif executor == 'process':
+            self._executor = ProcessPoolExecutor(max_workers=1)
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=1)
+
+        self._future = None
+        self._due_bar = None
+        self._last_period = None
+        self.retrains = 0
+        self.swaps = 0
+
+    def _is_boundary(self, bar_number, bar_datetime):
+        if isinstance(self.every, int):
+            return bar_number > 0 and bar_number % self.every == 0
+        if bar_datetime is None:
+            return False
+        if self.every == 'W':
+            period = tuple(bar_datetime.isocalendar()[:2])
+        else:
+            period = (bar_datetime.year, bar_datetime.month)
+        new_period = self._last_period is not None and \
+            period != self._last_period
+        self._last_period = period
+        return new_period
+
+    def _swap(self):
+        try:
+            model = self._future.result()
+        except Exception as e:
+            logging.error("Model retraining failed, keeping the current "
+                          "model [%s]", e)
+        else:
+            self.model = model
+            self.swaps += 1
+        self._future = None
+        self._due_bar = None
+
+    def on_bar(self, bar_number, bar_datetime, snapshot):
+        """
+        Swaps in a finished model when due and starts a new fit on a
+        retraining bar. Call once per bar before predicting.
+
+        :param bar_number: (int) bar counter of the strategy.
+        :param bar_datetime: (datetime) date of the latest bar.
+        :param snapshot: callable returning the fit arguments as a tuple,
+                         or None to skip this retraining.
+        :return: the model to use for this bar.
+        """
+        if self._future is not None and bar_number >= self._due_bar:
+            if self.deterministic or self._future.done():
+                self._swap()
+
+        if self._is_boundary(bar_number, bar_datetime):
+            if self._future is not None:
+                logging.info("Previous retraining still pending, skipped")
+            else:
+                args = snapshot()
+                if args is not None:
+                    self._future = self._executor.submit(self.fit, *args)
+                    self._due_bar = bar_number + self.swap_delay
+                    self.retrains += 1
+                    if self.swap_delay == 0:
+                        self._swap()
+        return self.model
+
+    def shutdown(self):
+        """
+        Drops a fit that has not been swapped in and stops the executor,
+        unless it was supplied by the caller. Waits for a fit already
+        running, so no worker outlives the run.
+        """
+        if self._future is not None:
+            self._future.cancel()
+            self._future = None
+            self._due_bar = None
+        if self._owns_executor:
+            self._executor.shutdown(wait=True)
@@ -42,4 +42,12 @@ class Strategy(object):
         Dump the count for movement up and down.
         """
         raise NotImplementedError("Should implement dump_updown_count()")
+
+    def end_of_run(self):
+        """
+        Called once the data has run out, so that strategies can release
+        their resources, e.g. background workers. Does nothing by
+        default.
+        """
+        pass
     
\ No newline at end of file
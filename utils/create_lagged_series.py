@@ -1,13 +1,65 @@
 # -*- coding: utf-8 -*-
 
+from collections import OrderedDict
 import datetime
+import os
 
 import numpy as np
 import pandas as pd
-import pandas_datareader.data as web
 import logging
 
-def create_lagged_series(symbol, start_date, end_date, lags=5):
+# In-process memo of the lagged series, keyed by symbol, window, lags and
+# source (with the modification time of a local file), least recently
+# used first
+_lagged_series_cache = OrderedDict()
+LAGGED_SERIES_CACHE_SIZE = 64
+
+
+def _read_local_bars(symbol, csv_dir, start_date, end_date):
+    """
+    Reads the bars of a symbol from the CSV bar store used by
+    HistoricCSVDataHandler ('<csv_dir>/<symbol>.csv').
+    """
+    headers = [
+        'date', 'open', 'high', 'low', 'close', 'volume', 'adj_close']
+    ts = pd.read_csv(os.path.join(csv_dir, '%s.csv' % symbol),
+                     header=0, index_col=0, parse_dates=True,
+                     names=headers).sort_index()
+    ts = ts[(ts.index >= start_date) & (ts.index <= end_date)]
+    return ts['adj_close'], ts['volume']
+
+
+def _read_yahoo_bars(symbol, start_date, end_date):
+    # Imported here so that offline runs do not need pandas_datareader
+    import pandas_datareader.data as web
+    ts = web.DataReader(symbol, "yahoo", start_date, end_date)
+    return ts["Adj Close"], ts["Volume"]
+
+
+def lagged_series_source(symbol, csv_dir=None):
+    """
+    Identity of the data create_lagged_series reads: the local file and
+    its modification time, or 'yahoo', which does not tell revisions of
+    the downloaded history apart.
+    """
+    if csv_dir is None:
+        return 'yahoo'
+    path = os.path.join(csv_dir, '%s.csv' % symbol)
+    return (path, os.path.getmtime(path))
+
+
+def clear_lagged_series_cache(symbol=None):
+    """
+    Drops the memoized series of one symbol, or of all of them.
+    """
+    if symbol is None:
+        _lagged_series_cache.clear()
+        return
+    for key in [k for k in _lagged_series_cache if k[0] == symbol]:
+        del _lagged_series_cache[key]
+
+
+def create_lagged_series(symbol, start_date, end_date, lags=5, csv_dir=None):
     """
     This creates a pandas DataFrame that stores the
     percentage returns of the adjusted closing value of
@@ -15,26 +67,40 @@ def create_lagged_series(symbol, start_date, end_date, lags=5):
     number of lagged returns from the prior trading days
     (lags defaults to 5 days). Trading volume, as well as
     the Direction from the previous day, are also included.
-    """
 
-    # Obtain stock information from Yahoo Finance
-    ts = web.DataReader(symbol, "yahoo",
-                        start_date-datetime.timedelta(days=365),
-                        end_date)
+    With csv_dir the bars are read from the local CSV bar store of
+    HistoricCSVDataHandler instead, so no network access is needed.
+    Results are memoized per (symbol, window, lags, source); a local
+    file that changed on disk is read again.
+    """
+    source = lagged_series_source(symbol, csv_dir)
+    key = (symbol, start_date, end_date, lags, source)
+    if key in _lagged_series_cache:
+        _lagged_series_cache.move_to_end(key)
+        return _lagged_series_cache[key].copy()
 
-    # Create the new lagged DataFrame
-    tslag = pd.DataFrame(index=ts.index)
-    tslag["Today"] = ts["Adj Close"]
-    tslag["Volume"] = ts["Volume"]
+    # Obtain stock information from the local store or Yahoo Finance
+    window_start = start_date - datetime.timedelta(days=365)
+    if csv_dir is not None:
+        close, volume = _read_local_bars(symbol, csv_dir, window_start,
+                                         end_date)
+    else:
+        close, volume = _read_yahoo_bars(symbol, window_start, end_date)
 
-    # Create the shifted lag series of prior trading period close values
-    for i in range(0,lags):
-        tslag["Lag%s" % str(i+1)] = ts["Adj Close"].shift(i+1)
+    # Row t of the strided view holds the prices p[t-lags-1] .. p[t], so
+    # column k of the reversed return matrix is the return k days back.
+    # Missing closes are carried forward first, as pct_change() does.
+    prices = np.concatenate((np.full(lags + 1, np.nan),
+                             close.ffill().values.astype(np.float64)))
+    windows = np.lib.stride_tricks.sliding_window_view(prices, lags + 2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns = (windows[:, 1:] / windows[:, :-1] - 1.0)[:, ::-1] * 100.0
 
     # Create the returns DataFrame
-    tsret = pd.DataFrame(index=tslag.index)
-    tsret["Volume"] = tslag["Volume"]
-    tsret["Today"] = tslag["Today"].pct_change()*100.0
+    tsret = pd.DataFrame(
+        returns, index=close.index,
+        columns=["Today"] + ["Lag%s" % str(i+1) for i in range(0, lags)])
+    tsret.insert(0, "Volume", volume.values)
 
     # If any of the values of percentage returns equal zero, set them to
     # a small number (stops issues with QDA model in scikit-learn)
@@ -43,12 +109,11 @@ def create_lagged_series(symbol, start_date, end_date, lags=5):
     #      if (abs(x) < 0.0001):
     #          tsret["Today"].loc[i] = 0.0001
 
-    # Create the lagged percentage returns columns
-    for i in range(0,lags):
-        tsret["Lag%s" % str(i+1)] = tslag["Lag%s" % str(i+1)].pct_change()*100.0
-    
-        
     # Create the "Direction" column (+1 or -1) indicating an up/down day
     tsret["Direction"] = np.sign(tsret["Today"])
     #tsret = tsret[tsret.index >= start_date]
-    return tsret
\ No newline at end of file
+    logging.debug("Lagged series of %s built, %d rows", symbol, len(tsret))
+    _lagged_series_cache[key] = tsret
+    while len(_lagged_series_cache) > LAGGED_SERIES_CACHE_SIZE:
+        _lagged_series_cache.popitem(last=False)
+    return tsret.copy()
@@ -1,158 +1,292 @@
-import re, sys, time, string
-from bs4 import BeautifulSoup
-import urllib2
+# -*- coding: utf-8 -*-
+
+'''
+@summary: Crawls the Yahoo symbol lookup pages for the whole symbol
+          universe. Pages are fetched concurrently with asyncio over a
+          pooled HTTP session, with bounded concurrency, per-host rate
+          limiting and exponential backoff, and parsed in worker
+          processes off the event loop.
+'''
+
+import argparse
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+import random
+import re
+import string
+import sys
+import time
+from urllib.parse import urlsplit
 import logging
 
+import aiohttp
+from bs4 import BeautifulSoup
+
+from utils.recorded_pages import record_page
+from utils.symbol_store import SymbolStore
+
+
+RESULTS_PER_PAGE = 20
+
+
+def parse_page_count(html):
+    """
+    Get the number of result pages of a search from its first page.
+    :param html (str): the first page of the search.
+    """
+    soup = BeautifulSoup(html, "html.parser")
+    total_search_str = str(soup.find_all("div", id="pagination"))
+    match = re.search(r'of ([1-9]*,*[0-9]*).*', total_search_str)
+    if match is None or not match.group(1):
+        return 0
+    total_search_qty = int(match.group(1).replace(',', ''))
+    return total_search_qty // RESULTS_PER_PAGE
+
+
+def parse_symbols(html):
+    """
+    Scan all the symbols of one page.
+    :param html (str): the page.
+    :return: (dict) symbol -> [full name, type, exchange, url]
+    """
+    sym_info = {}
+    soup = BeautifulSoup(html, "html.parser")
+    table = soup.find_all("div", class_="yui-content")
+    if not table:
+        return sym_info
+    for table_row in table[0].find_all('tr'):
+        if table_row.find('td'):
+            cells = table_row.find_all('td')
+            if len(cells) > 4 and cells[2].text != 'NaN':
+                link = table_row.a["href"] if table_row.a else ''
+                sym_info[cells[0].text] = [cells[1].text, cells[3].text,
+                                           cells[4].text, link]
+    return sym_info
+
+
+def parse_page(html, first):
+    """
+    :return: (tuple) page count (None unless first) and the symbols.
+    """
+    return (parse_page_count(html) if first else None), parse_symbols(html)
+
+
+class HostRateLimiter(object):
+
+    """
+    Spaces the requests to each host at least 1/rate seconds apart. The
+    slots are handed out in request order on the event loop thread, so
+    no lock is needed.
+    """
+
+    def __init__(self, rate):
+        """
+        :param rate: (dbl) requests per second per host, None for no limit.
+        """
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next_slot = {}
+
+    async def wait(self, host):
+        if not self.interval:
+            return
+        now = asyncio.get_running_loop().time()
+        slot = max(now, self._next_slot.get(host, now))
+        self._next_slot[host] = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
 class FetchAllSybols(object):
-    
-    def __init__(self):
-        # URL
-        # default m (market) - IN, t (type) - S (stock)
-        self.sym_start_url = "https://in.finance.yahoo.com/lookup/stocks?t=S&m=IN"
-        self.sym_page_url = '&b=0'#page
-        self.sym_alphanum_search_url = '&s=a' #search alphabet a
-        self.sym_full_url = ''
-        self.alphabet_str_to_search = string.ascii_lowercase # full alphabet
-        self.sym_info = {}
-        self.header = "SymbolId,Full Name, Type, Exchange, URL\n" 
-        
-    def set_alphabet_in_url(self, alphabet):
-        """ 
-        Set the alphabet portion of the url by passing the alphabet.
-        :param alphbet (str): can be alphabet.
+
+    """
+    Collects the symbol, full name, type, exchange and URL of every
+    stock listed by the lookup pages, searching each letter of the
+    alphabet.
+
+    The first page of every letter gives its page count; the remaining
+    pages of all the letters are then fetched concurrently, at most
+    `concurrency` at a time over one keep-alive connection pool and at
+    most `rate` requests per second per host. Failed requests (network
+    errors, timeouts, 429 and 5xx answers) are retried with exponential
+    backoff and jitter. Parsing runs in a process pool so the event loop
+    only does I/O.
+
+    Pointing base_url at a utils.recorded_pages.RecordedPageServer
+    replays pages saved with record_dir instead of the real site.
+    """
+
+    def __init__(self,
+                 base_url="https://in.finance.yahoo.com/lookup/stocks?t=S&m=IN&r=",
+                 alphabet=string.ascii_lowercase, concurrency=16, rate=20.0,
+                 retries=6, backoff=0.5, timeout=30.0, parse_workers=None,
+                 record_dir=None):
+        """
+        :param base_url: (str) lookup URL, default m (market) - IN,
+                         t (type) - S (stock).
+        :param alphabet: (str) search terms, one search per character.
+        :param concurrency: (int) requests in flight at once.
+        :param rate: (dbl) requests per second per host, None for no limit.
+        :param retries: (int) attempts per page.
+        :param backoff: (dbl) first retry delay in seconds, doubled each
+                        attempt.
+        :param timeout: (dbl) seconds allowed per request.
+        :param parse_workers: (int) parsing processes, None for one per CPU.
+        :param record_dir: (str) save every fetched page there for replay.
         """
-        self.sym_alphanum_search_url = '&s=' + str(alphabet)
+        self.base_url = base_url
+        self.alphabet_str_to_search = alphabet
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.parse_workers = parse_workers
+        self.record_dir = record_dir
+        self.rate_limiter = HostRateLimiter(rate)
+        self.sym_info = {}
+        self.pages_fetched = 0
+        self.pages_failed = 0
 
-    def set_pagenumber_in_url(self, pageno):
-        """ 
-        Set the page portion of the url by passing the pageno.
-        :param pageno (str): page number.
+    def page_url(self, alphabet, pageno):
         """
-        self.sym_page_url = '&b=' + str(pageno)
+        Creates the full url of one result page.
+        :param alphabet (str): the search term.
+        :param pageno (int): page number, 0 based.
+        """
+        return '%s&s=%s&b=%d' % (self.base_url, alphabet,
+                                 pageno * RESULTS_PER_PAGE)
 
-    
-    def gen_next_url(self):
-        """ 
-        Creates the full url necessary for sym scan by joining the search parameter and page no.
+    async def fetch(self, url):
         """
-        self.sym_full_url =  self.sym_start_url + self.sym_alphanum_search_url + self.sym_page_url    
-    
-    def get_data_from_next_page(self):
-        self.gen_next_url()
-        print ("Fetching data from URL", self.sym_full_url)
-        req = urllib2.Request(self.sym_full_url, headers={ 'User-Agent': 'Mozilla/5.0' })
-        html = None
-        counter = 0
-        while counter < 10:
-            try:
-                html = urllib2.urlopen(req)
-            except urllib2.HTTPError, error:
-                logging.error(error.read())
-                logging.info("Will try 10 times with 2 seconds sleep")
-                time.sleep(2) 
-                counter += 1
-            else:
-                break
-            
-        soup = BeautifulSoup(html, "html")
-        return soup
-    
-    def get_all_valid_symbols(self):
-        """ 
-        Scan all the symbol for one page. The parsing are split into odd and even rows.
+        Fetches one page, retrying with exponential backoff.
+        :return: (str) the page, None if every attempt failed.
         """
-        soup = self.get_data_from_next_page()
-        table = soup.find_all("div", class_="yui-content")
-        table_rows = table[0].find_all('tr')
-        for table_row in table_rows:
-            if table_row.find('td'):
-                if table_row.contents[2].text != 'NaN':
-                    self.sym_info[table_row.contents[0].text]=[table_row.contents[1].text,
-                                                               table_row.contents[3].text,
-                                                               table_row.contents[4].text,
-                                                               table_row.a["href"]]
-                    
-    def get_total_page_to_scan_for_alphabet(self, alphabet):
-        """ 
-        Get the total search results based on each search to determine the number of page to scan.
-        :param alphabet (int): The total number of page to scan
+        host = urlsplit(url).netloc
+        for attempt in range(self.retries):
+            delay = self.backoff * 2 ** attempt
+            async with self._semaphore:
+                await self.rate_limiter.wait(host)
+                logging.debug("Fetching data from URL %s", url)
+                try:
+                    async with self._session.get(url) as resp:
+                        if resp.status == 200:
+                            html = await resp.text()
+                            self.pages_fetched += 1
+                            if self.record_dir:
+                                parts = urlsplit(url)
+                                record_page(self.record_dir, '%s?%s' % (
+                                    parts.path, parts.query), html)
+                            return html
+                        if resp.status != 429 and resp.status < 500:
+                            logging.error("HTTP %d for %s, not retried",
+                                          resp.status, url)
+                            break
+                        retry_after = resp.headers.get('Retry-After', '')
+                        if retry_after.isdigit():
+                            delay = max(delay, float(retry_after))
+                        error = 'HTTP %d' % resp.status
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    error = repr(e)
+            if attempt + 1 < self.retries:
+                logging.info("Attempt %d for %s failed [%s], retrying in "
+                             "%.2fs", attempt + 1, url, error, delay)
+                await asyncio.sleep(delay + random.uniform(0, self.backoff))
+        self.pages_failed += 1
+        logging.error("Giving up on %s", url)
+        return None
+
+    async def _fetch_and_parse(self, alphabet, pageno):
+        html = await self.fetch(self.page_url(alphabet, pageno))
+        if html is None:
+            return 0, {}
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._parse_pool, parse_page,
+                                          html, pageno == 0)
+
+    async def get_total_sym_for_each_search(self, alphabet):
         """
-        self.sym_start_url = "https://in.finance.yahoo.com/lookup/stocks?t=S&m=IN&r="
-        self.sym_page_url = '&b=0'#page
-        self.sym_alphanum_search_url = '&s='+alphabet
-        
-        soup = self.get_data_from_next_page()
-        total_search_str = (str(soup.find_all("div", id="pagination")))
-        
-        #Get the number of page
-        total_search_qty = re.search('of ([1-9]*\,*[0-9]*).*',total_search_str).group(1)
-        total_search_qty = int(total_search_qty.replace(',','', total_search_qty.count(',')))
-        final_search_page_count = total_search_qty/20 #20 seach per page.
- 
-        return final_search_page_count
-    
-    
-    def get_total_sym_for_each_search(self, alphabet):
-        """ 
-        Scan all the page indicate by the search item.
-        The first time search or the first page will get the total number of search.
-        Dividing it by 20 results per page will give the number of page to search.
+        Scan all the pages of one search. The first page gives the
+        number of results, 20 per page, hence the pages to scan.
         :param alphabet(str)
         """
-        # Get the first page info first
-        self.set_pagenumber_in_url(0)
-        total_page_to_scan =  self.get_total_page_to_scan_for_alphabet(alphabet)
-        logging.info('Total number of pages to scan: [%d]'% total_page_to_scan)
-
-        # Scan the rest of the page.
-        # may need to get time to rest
-        for page_no in range(0,total_page_to_scan+1,1):
-            self.set_pagenumber_in_url(page_no*20)
-            self.gen_next_url()
-            logging.info('Scanning page number: [%d] url: [%s]  ' % (page_no, self.sym_full_url))          
-            self.get_all_valid_symbols()
-    
-    def serach_for_each_alphabet(self):
-        """ 
+        total_page_to_scan, symbols = await self._fetch_and_parse(alphabet, 0)
+        self.sym_info.update(symbols)
+        logging.info('Searching for [%s]: [%d] pages to scan', alphabet,
+                     total_page_to_scan + 1)
+
+        pages = await asyncio.gather(*[
+            self._fetch_and_parse(alphabet, page_no)
+            for page_no in range(1, total_page_to_scan + 1)])
+        for _, symbols in pages:
+            self.sym_info.update(symbols)
+
+    async def crawl(self):
+        """
         Sweep through all the alphabets to get the full list of shares.
         """
-        for alphabet in self.alphabet_str_to_search:
-            logging.info('Searching for : [%s]' % alphabet)
-            self.set_alphabet_in_url(alphabet)
-            self.get_total_sym_for_each_search(alphabet)
-    
-    def dump_into_file(self):
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        headers = {'User-Agent': 'Mozilla/5.0'}
+        with ProcessPoolExecutor(max_workers=self.parse_workers) as pool:
+            self._parse_pool = pool
+            async with aiohttp.ClientSession(connector=connector,
+                                             timeout=timeout,
+                                             headers=headers) as session:
+                self._session = session
+                await asyncio.gather(*[
+                    self.get_total_sym_for_each_search(alphabet)
+                    for alphabet in self.alphabet_str_to_search])
+        return self.sym_info
+
+    def serach_for_each_alphabet(self):
+        """
+        Runs the crawl to completion.
+        :return: (dict) symbol -> [full name, type, exchange, url]
+        """
+        start = time.time()
+        asyncio.run(self.crawl())
+        logging.info("Crawled %d symbols from %d pages (%d failed) in %.1fs",
+                     len(self.sym_info), self.pages_fetched,
+                     self.pages_failed, time.time() - start)
+        return self.sym_info
+
+    def dump_into_store(self, path='symbols.db'):
         '''
-        Store all symbols into a csv file.
+        Merge all symbols into the symbol store.
+        :param path (str): database file of the SymbolStore.
         '''
-        f = open('Symbol_Info.csv', 'w')
-        f.write(self.header)
-        
-        for key in sorted(self.sym_info):
-            values = self.sym_info[key]
-            sym = key+','
-            for value in values:
-                sym += str(value) + ','
-            sym += '\n'
-            f.write(sym)
-        f.close()
-        
+        store = SymbolStore(path)
+        try:
+            return store.upsert(self.sym_info)
+        finally:
+            store.close()
+
+
 if __name__ == "__main__":
     root = logging.getLogger()
     root.setLevel(logging.INFO)
 
     ch = logging.StreamHandler(sys.stdout)
     ch.setLevel(logging.DEBUG)
-    
+
     formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
     ch.setFormatter(formatter)
     root.addHandler(ch)
-    
+
     fileHandler = logging.FileHandler("dump.log")
     fileHandler.setFormatter(formatter)
     root.addHandler(fileHandler)
 
-    f = FetchAllSybols()
-    f.alphanum_str_to_search = 'abcdefghijklmnopqrstuvwxyz'
+    parser = argparse.ArgumentParser(description='Crawl the symbol universe.')
+    parser.add_argument('--base-url',
+                        default="https://in.finance.yahoo.com/lookup/stocks?t=S&m=IN&r=")
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--rate', type=float, default=20.0)
+    parser.add_argument('--record-dir', default=None)
+    parser.add_argument('--store', default='symbols.db')
+    args = parser.parse_args()
+
+    f = FetchAllSybols(base_url=args.base_url, concurrency=args.concurrency,
+                       rate=args.rate, record_dir=args.record_dir)
     f.serach_for_each_alphabet()
-    f.dump_into_file()
\ No newline at end of file
+    f.dump_into_store(args.store)
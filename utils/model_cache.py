@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+
+'''
+@summary: On-disk cache of fitted models. Entries are keyed by a hash of
+          the symbol, training window, lags, model class and
+          hyper-parameters and of the identity of the training data
+          (its source file and modification time, or the data itself),
+          and the cache is trimmed to a size budget, least recently used
+          first.
+'''
+
+import glob
+import hashlib
+import json
+import logging
+import os
+import pickle
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+
+class ModelCache(object):
+
+    """
+    Stores fitted models as pickles named '<symbol>-<key>.pkl' in
+    cache_dir. A hit refreshes the file modification time, so eviction
+    by oldest modification time is least-recently-used eviction.
+    Writes go through a temporary file and os.replace, so concurrent
+    backtests can share one cache directory.
+    """
+
+    def __init__(self, cache_dir='.model_cache', max_bytes=512 * 1024 ** 2):
+        """
+        :param cache_dir: (str) directory holding the cached models.
+        :param max_bytes: (int) size budget of the cache directory.
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    @staticmethod
+    def _hash_data(data):
+        digest = hashlib.sha256()
+        if isinstance(data, (pd.DataFrame, pd.Series)):
+            digest.update(pd.util.hash_pandas_object(data, index=True)
+                          .values.tobytes())
+            if isinstance(data, pd.DataFrame):
+                digest.update(repr(list(data.columns)).encode('utf-8'))
+        else:
+            arr = np.ascontiguousarray(data)
+            digest.update(str(arr.dtype).encode('utf-8'))
+            digest.update(str(arr.shape).encode('utf-8'))
+            digest.update(arr.tobytes())
+        return digest.hexdigest()
+
+    def make_key(self, symbol, start_date, end_date, lags, model, data=None,
+                 source=None):
+        """
+        Builds the cache key of a model. The training data is identified
+        by its source, which lets a hit skip loading the data at all, or
+        by a hash of the data itself.
+
+        :param symbol: (str) the symbol the model is trained on.
+        :param start_date: (date) start of the training window.
+        :param end_date: (date) end of the training window.
+        :param lags: lags / feature names used by the model.
+        :param model: an unfitted sklearn style estimator.
+        :param data: (DataFrame/ndarray) the training data.
+        :param source: identity of the training data, e.g. the
+                       (path, mtime) given by lagged_series_source().
+        :return: (str) hex digest.
+        """
+        if data is None and source is None:
+            raise ValueError("make_key needs the data or its source.")
+        params = model.get_params() if hasattr(model, 'get_params') else {}
+        spec = {
+            'symbol': symbol,
+            'start': str(start_date),
+            'end': str(end_date),
+            'lags': repr(lags),
+            'model': '%s.%s' % (type(model).__module__, type(model).__name__),
+            'params': sorted((k, repr(v)) for k, v in params.items()),
+        }
+        if data is not None:
+            spec['data'] = self._hash_data(data)
+        if source is not None:
+            spec['source'] = repr(source)
+        return hashlib.sha256(json.dumps(spec, sort_keys=True)
+                              .encode('utf-8')).hexdigest()
+
+    def _path(self, symbol, key):
+        return os.path.join(self.cache_dir, '%s-%s.pkl' % (symbol, key))
+
+    def get(self, symbol, key):
+        """
+        :return: the cached model, or None on a miss. An entry that can
+                 not be unpickled any more, e.g. after a refactor, is
+                 removed and counts as a miss.
+        """
+        path = self._path(symbol, key)
+        try:
+            f = open(path, 'rb')
+        except (IOError, OSError):
+            return None
+        try:
+            with f:
+                model = pickle.load(f)
+        except Exception as exc:
+            logging.warning("Dropping unreadable cached model %s: %r",
+                            path, exc)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        os.utime(path, None)
+        logging.info("Model cache hit for %s [%s]", symbol, key[:12])
+        return model
+
+    def put(self, symbol, key, model):
+        """
+        Stores a fitted model and trims the cache to its size budget.
+        """
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(model, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self._path(symbol, key))
+        self.evict()
+
+    def get_or_fit(self, symbol, key, fit):
+        """
+        Returns the cached model, or calls fit() and caches its result.
+
+        :param fit: callable returning a fitted model.
+        """
+        model = self.get(symbol, key)
+        if model is None:
+            logging.info("Model cache miss for %s, fitting", symbol)
+            model = fit()
+            self.put(symbol, key, model)
+        return model
+
+    def entries(self):
+        """
+        :return: (list) (mtime, size, path) of every entry, oldest first.
+        """
+        out = []
+        for path in glob.glob(os.path.join(self.cache_dir, '*.pkl')):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            out.append((st.st_mtime, st.st_size, path))
+        return sorted(out)
+
+    def evict(self):
+        """
+        Removes the least recently used entries beyond max_bytes.
+        """
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def invalidate(self, symbol):
+        """
+        Removes every cached model of a symbol, e.g. after its bars were
+        updated.
+
+        :return: (int) number of entries removed.
+        """
+        removed = 0
+        pattern = '%s-%s.pkl' % (glob.escape(symbol), '[0-9a-f]' * 64)
+        for path in glob.glob(os.path.join(self.cache_dir, pattern)):
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+        return removed
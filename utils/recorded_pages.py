@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+'''
+@summary: Local HTTP stand-in serving pages recorded by the symbol
+          crawler, so a universe refresh can be run and timed without
+          hitting the real site.
+'''
+
+import hashlib
+import logging
+import os
+import random
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def page_file(record_dir, path_qs):
+    """
+    :param path_qs: (str) path and query string of the page URL.
+    :return: (str) file holding the recorded page.
+    """
+    name = hashlib.sha1(path_qs.encode('utf-8')).hexdigest()
+    return os.path.join(record_dir, name + '.html')
+
+
+def record_page(record_dir, path_qs, html):
+    """
+    Saves one fetched page for later replay.
+    """
+    if not os.path.isdir(record_dir):
+        os.makedirs(record_dir)
+    with open(page_file(record_dir, path_qs), 'w', encoding='utf-8') as f:
+        f.write(html)
+
+
+class RecordedPageServer(object):
+
+    """
+    Serves the pages saved by record_page() by path and query string,
+    answering 404 for the others. latency delays every answer and
+    error_rate answers that share of the requests with a 503, to
+    exercise the crawler's concurrency and retries.
+    """
+
+    def __init__(self, record_dir, host='127.0.0.1', port=0, latency=0.0,
+                 error_rate=0.0, seed=None):
+        """
+        :param record_dir: (str) directory of the recorded pages.
+        :param host: (str) interface to listen on.
+        :param port: (int) port to listen on, 0 picks a free port.
+        :param latency: (dbl) seconds before each answer.
+        :param error_rate: (dbl) share of requests answered with a 503.
+        :param seed: (int) seed of the errors.
+        """
+        self.record_dir = record_dir
+        self.latency = latency
+        self.error_rate = error_rate
+        self.requests = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        server = self
+
+        class _Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                with server._lock:
+                    server.requests += 1
+                    fail = server._random.random() < server.error_rate
+                if server.latency:
+                    time.sleep(server.latency)
+                path = page_file(server.record_dir, self.path)
+                if fail or not os.path.exists(path):
+                    self.send_response(503 if fail else 404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                with open(path, 'rb') as f:
+                    body = f.read()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, fmt, *args):
+                logging.debug(fmt, *args)
+
+        _Handler.protocol_version = 'HTTP/1.1'
+        self._httpd = ThreadingHTTPServer((host, port), _Handler)
+        self._httpd.daemon_threads = True
+        self.host, self.port = self._httpd.server_address[:2]
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://%s:%d' % (self.host, self.port)
+
+    def start(self):
+        """
+        Serves in a daemon thread.
+
+        :return: (str) base URL of the server.
+        """
+        self._thread = threading.Thread(target=self._httpd.serve_forever,
+                                        name='recorded-pages')
+        self._thread.daemon = True
+        self._thread.start()
+        logging.info("Serving recorded pages of %s on %s",
+                     self.record_dir, self.url)
+        return self.url
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self._thread.join()
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+
+'''
+@summary: Persistent, indexed store of the symbol metadata collected by
+          the symbol crawler, backed by SQLite.
+'''
+
+import sqlite3
+import time
+import logging
+
+
+class SymbolStore(object):
+
+    """
+    One row per symbol with its full name, type, exchange and URL.
+
+    The symbol is the primary key of a WITHOUT ROWID table, so a lookup
+    or a prefix search is a B-tree seek; exchange and type have their own
+    indexes. Crawl results are merged with an upsert in one transaction,
+    only the rows given are written.
+    """
+
+    COLUMNS = ('symbol', 'name', 'type', 'exchange', 'url', 'updated')
+
+    def __init__(self, path='symbols.db'):
+        """
+        :param path: (str) database file, ':memory:' for a private store.
+        """
+        self.path = path
+        self._conn = sqlite3.connect(path)
+        self._conn.row_factory = sqlite3.Row
+        if path != ':memory:':
+            self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS symbols (
+                symbol TEXT PRIMARY KEY,
+                name TEXT,
+                type TEXT,
+                exchange TEXT,
+                url TEXT,
+                updated REAL
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS symbols_exchange
+                ON symbols (exchange, symbol);
+            CREATE INDEX IF NOT EXISTS symbols_type ON symbols (type, symbol);
+        ''')
+
+    def upsert(self, sym_info):
+        """
+        Inserts new symbols and updates the known ones.
+
+        :param sym_info: (dict) symbol -> [full name, type, exchange, url],
+                         as collected by FetchAllSybols.
+        :return: (int) number of rows written.
+        """
+        now = time.time()
+        rows = [(symbol, values[0], values[1], values[2], values[3], now)
+                for symbol, values in sym_info.items()]
+        with self._conn:
+            self._conn.executemany('''
+                INSERT INTO symbols (symbol, name, type, exchange, url, updated)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (symbol) DO UPDATE SET
+                    name = excluded.name, type = excluded.type,
+                    exchange = excluded.exchange, url = excluded.url,
+                    updated = excluded.updated
+            ''', rows)
+        logging.info("Upserted %d symbols into %s", len(rows), self.path)
+        return len(rows)
+
+    def get(self, symbol):
+        """
+        :return: (dict) the metadata of a symbol, None if unknown.
+        """
+        row = self._conn.execute('SELECT * FROM symbols WHERE symbol = ?',
+                                 (symbol,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def query(self, prefix=None, exchange=None, type=None, limit=None):
+        """
+        Symbols matching all the given filters, in symbol order.
+
+        :param prefix: (str) start of the symbol.
+        :param exchange: (str) exchange code.
+        :param type: (str) security type, e.g. 'Stock'.
+        :param limit: (int) maximum number of rows.
+        :return: (list) one dict per symbol.
+        """
+        clauses, params = [], []
+        if prefix:
+            # Range over the primary key rather than LIKE, which SQLite
+            # cannot always turn into an index seek
+            clauses.append('symbol >= ? AND symbol < ?')
+            params += [prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)]
+        if exchange is not None:
+            clauses.append('exchange = ?')
+            params.append(exchange)
+        if type is not None:
+            clauses.append('type = ?')
+            params.append(type)
+        sql = 'SELECT * FROM symbols'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        sql += ' ORDER BY symbol'
+        if limit is not None:
+            sql += ' LIMIT %d' % int(limit)
+        return [dict(row) for row in self._conn.execute(sql, params)]
+
+    def search_prefix(self, prefix, limit=None):
+        """
+        :return: (list) the symbols starting with prefix.
+        """
+        return self.query(prefix=prefix, limit=limit)
+
+    def symbols(self, exchange=None, type=None):
+        """
+        :return: (list) the tickers matching the filters, e.g. to build
+                 the symbol_list of a backtest.
+        """
+        return [row['symbol'] for row in
+                self.query(exchange=exchange, type=type)]
+
+    def delete(self, symbols):
+        """
+        Removes delisted symbols.
+
+        :return: (int) number of rows removed.
+        """
+        with self._conn:
+            cur = self._conn.executemany(
+                'DELETE FROM symbols WHERE symbol = ?',
+                [(s,) for s in symbols])
+        return cur.rowcount
+
+    def __len__(self):
+        return self._conn.execute('SELECT COUNT(*) FROM symbols').fetchone()[0]
+
+    def __contains__(self, symbol):
+        return self._conn.execute('SELECT 1 FROM symbols WHERE symbol = ?',
+                                  (symbol,)).fetchone() is not None
+
+    def close(self):
+        self._conn.close()